@@ -4,8 +4,85 @@ JC3248W535EN screen;
 
 uint16_t touchX, touchY;
 
+// Binary frames: SYNC | opcode | fixed little-endian fields | [len | text] | CRC-8,
+// or SYNC_SEQ | seq | opcode | ... | CRC-8 with the CRC covering seq too.
+// See binary_protocol.py in this folder for the host side encoder.
+//
+// Commands that carry a sequence number (text prefixed with "#<seq>|" or
+// SYNC_SEQ frames) are answered with "ok <seq>" or "err <seq> <code>"
+// instead of the response text, so the host can match answers to commands.
+// Reported by "version" together with the optional protocol features
+#define FIRMWARE_VERSION "1.6"
+#define FIRMWARE_CAPABILITIES "bin,blit,bitmap,font,link,ping,seq"
+
+#define FRAME_SYNC 0xA5
+#define FRAME_SYNC_SEQ 0xA6  // Followed by a sequence number byte
+#define FRAME_MAX_TEXT 255
+
+// Link negotiation (see link_setup.py): the sketch starts at BOOT_BAUD and
+// switches on "link|<baud>"; the host has LINK_CONFIRM_MS to confirm at the
+// new rate, otherwise the previous rate is restored.
+#define BOOT_BAUD 115200
+#define MAX_LINK_BAUD 2000000
+#define RX_BUFFER_SIZE 1024
+#define LINK_CONFIRM_MS 300
+
+uint32_t linkBaud = BOOT_BAUD;
+
+enum ErrorCode : uint8_t {
+  ERR_UNKNOWN = 1,  // Unknown or incomplete command
+  ERR_FORMAT = 2,   // Invalid command format
+  ERR_FRAME = 3,    // Bad or truncated binary frame
+  ERR_DATA = 4      // Bad blit or bitmap data, unknown font
+};
+
+// Sequence number of the command being processed, -1 if it has none
+int16_t commandSeq = -1;
+
+void reply(const String &text) {
+  if (commandSeq < 0) {
+    Serial.println(text);
+  } else {
+    Serial.print("ok ");
+    Serial.println(commandSeq);
+  }
+}
+
+void replyError(uint8_t code, const String &text) {
+  if (commandSeq < 0) {
+    Serial.println(text);
+  } else {
+    Serial.print("err ");
+    Serial.print(commandSeq);
+    Serial.print(" ");
+    Serial.println(code);
+  }
+}
+
+enum FrameOpcode : uint8_t {
+  OP_PRT = 0x01,
+  OP_CLEAR = 0x02,
+  OP_SET_COLOR = 0x03,
+  OP_QR_CODE = 0x04,
+  OP_FILL_RECT = 0x05,
+  OP_RECT = 0x06,
+  OP_LINE = 0x07,
+  OP_FILL_CIRCLE = 0x08,
+  OP_CIRCLE_OUTLINE = 0x09,
+  OP_TRIANGLE = 0x0A,
+  OP_FILL_TRIANGLE = 0x0B,
+  OP_ROUND_RECT = 0x0C,
+  OP_FILL_ROUND_RECT = 0x0D,
+  OP_ELLIPSE = 0x0E,
+  OP_FILL_ELLIPSE = 0x0F,
+  OP_FLUSH = 0x10,
+  OP_BLIT = 0x11,
+  OP_BITMAP = 0x12
+};
+
 void setup() {
-  Serial.begin(115200);
+  Serial.setRxBufferSize(RX_BUFFER_SIZE);
+  Serial.begin(BOOT_BAUD);
 
   // Initialize the screen
   if (!screen.begin()) {
@@ -17,7 +94,7 @@ void setup() {
   // Print available commands
   Serial.println("Serial command interface ready!");
   Serial.println("Available commands (format: command|param1|param2|...):");
-  Serial.println("  prt|text|x|y|size");
+  Serial.println("  prt|text|x|y|size[|font]  (font: name of a GFXfont built into the sketch)");
   Serial.println("  clear|r|g|b");
   Serial.println("  setColor|r|g|b");
   Serial.println("  drawQRCode|data|x|y|moduleSize|bgR|bgG|bgB|fgR|fgG|fgB");
@@ -33,13 +110,315 @@ void setup() {
   Serial.println("  drawEllipse|x|y|rx|ry");
   Serial.println("  drawFillEllipse|x|y|rx|ry");
   Serial.println("  flush");
+  Serial.println("  blit|x|y|count|hexdata  (RLE pixels into one physical canvas row)");
+  Serial.println("  drawBitmap|x|y|width|scale|hexdata  (1-bpp rows, set bits in the current color)");
+  Serial.println("  proto|bin  (binary frames starting with 0xA5 are accepted at any time)");
+  Serial.println("  link|baud  (switch the serial rate, confirm with link|confirm at the new rate)");
+  Serial.println("  ping|payload");
+  Serial.println("  version");
+  Serial.println("  #seq|command  (answered with ok seq or err seq code)");
+}
+
+void setLinkBaud(uint32_t baud) {
+#if ARDUINO_USB_CDC_ON_BOOT
+  // Native USB CDC runs at USB speed whatever rate the host asks for
+  (void)baud;
+#else
+  Serial.updateBaudRate(baud);
+#endif
+}
+
+void switchLink(uint32_t baud) {
+  if (baud < 9600 || baud > MAX_LINK_BAUD) {
+    Serial.println("Link refused");
+    return;
+  }
+  Serial.print("Link switching|");
+  Serial.print(baud);
+  Serial.print("|");
+  Serial.println(RX_BUFFER_SIZE);
+  Serial.flush();
+  setLinkBaud(baud);
+
+  // Anything but a confirmation at the new rate means the link does not work
+  Serial.setTimeout(LINK_CONFIRM_MS);
+  String reply = Serial.readStringUntil('\n');
+  Serial.setTimeout(1000);
+  reply.trim();
+  if (reply == "link|confirm") {
+    linkBaud = baud;
+    Serial.println("Link confirmed");
+  } else {
+    setLinkBaud(linkBaud);
+  }
+}
+
+uint8_t crc8(const uint8_t* data, size_t len, uint8_t crc = 0) {
+  while (len--) {
+    crc ^= *data++;
+    for (uint8_t i = 0; i < 8; i++) {
+      crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+int16_t readInt16(const uint8_t* p) {
+  return (int16_t)(p[0] | (p[1] << 8));
+}
+
+uint16_t readUint16(const uint8_t* p) {
+  return (uint16_t)(p[0] | (p[1] << 8));
+}
+
+// Decode the hex data of a text blit or drawBitmap command, returns the byte count or -1
+int hexDecode(const String &hex, uint8_t* out, size_t maxLen) {
+  size_t len = hex.length() / 2;
+  if (hex.length() % 2 || len > maxLen) return -1;
+  for (size_t i = 0; i < len; i++) {
+    char pair[3] = {hex[2 * i], hex[2 * i + 1], '\0'};
+    char* end;
+    out[i] = (uint8_t)strtoul(pair, &end, 16);
+    if (*end != '\0') return -1;
+  }
+  return (int)len;
+}
+
+// GFX fonts that prt can name in its optional last field. To add one, copy its
+// header (e.g. ../CustomFonts/Roboto_Regular16pt7b.h) next to this sketch,
+// include it and list it under the name of its GFXfont variable; the designer
+// finds the same header by that name to preview the text.
+// #include "Roboto_Regular16pt7b.h"
+struct NamedFont {
+  const char* name;
+  const GFXfont* font;
+};
+
+const NamedFont FONTS[] = {
+  // {"Roboto_Regular16pt7b", &Roboto_Regular16pt7b},
+  {nullptr, nullptr}
+};
+
+// Print with the named font, the built-in one if the name is empty; false for unknown names
+bool printWithFont(const String &text, int x, int y, uint8_t size, const String &fontName) {
+  const GFXfont* font = nullptr;
+  if (fontName.length() > 0) {
+    const NamedFont* entry = FONTS;
+    while (entry->name && fontName != entry->name) entry++;
+    if (!entry->name) return false;
+    font = entry->font;
+  }
+  screen.setFont(font);
+  screen.prt(text, x, y, size);
+  screen.setFont(nullptr);
+  return true;
+}
+
+// Draw the rows of a packed 1-bpp bitmap; false unless the data holds whole rows
+bool drawPackedBitmap(int16_t x, int16_t y, uint8_t width, uint8_t scale, const uint8_t* bits, size_t len) {
+  uint16_t stride = (width + 7) / 8;
+  if (width == 0 || len == 0 || len % stride) return false;
+  screen.drawBitmap(bits, x, y, width, len / stride, scale);
+  return true;
+}
+
+// Number of fixed payload bytes for an opcode, or -1 if the opcode is unknown
+int8_t frameFixedLength(uint8_t opcode) {
+  switch (opcode) {
+    case OP_PRT: return 5;
+    case OP_CLEAR:
+    case OP_SET_COLOR: return 3;
+    case OP_QR_CODE: return 11;
+    case OP_FILL_RECT:
+    case OP_RECT:
+    case OP_LINE:
+    case OP_ELLIPSE:
+    case OP_FILL_ELLIPSE: return 8;
+    case OP_FILL_CIRCLE:
+    case OP_CIRCLE_OUTLINE: return 6;
+    case OP_TRIANGLE:
+    case OP_FILL_TRIANGLE: return 12;
+    case OP_ROUND_RECT:
+    case OP_FILL_ROUND_RECT: return 10;
+    case OP_FLUSH: return 0;
+    case OP_BLIT:
+    case OP_BITMAP: return 6;
+    default: return -1;
+  }
+}
+
+void skipToNextFrame() {
+  while (Serial.available() && Serial.peek() != FRAME_SYNC && Serial.peek() != FRAME_SYNC_SEQ) {
+    Serial.read();
+  }
+}
+
+void processBinaryFrame() {
+  // opcode + fixed fields + length byte + text
+  static uint8_t frame[1 + 12 + 1 + FRAME_MAX_TEXT + 1];
+  char text[FRAME_MAX_TEXT + 1];
+  
+  uint8_t seq = 0;
+  bool sequenced = Serial.read() == FRAME_SYNC_SEQ;
+  commandSeq = -1;
+  if (sequenced) {
+    if (Serial.readBytes(&seq, 1) != 1) {
+      Serial.println("Bad frame: truncated");
+      return;
+    }
+    commandSeq = seq;
+  }
+  if (Serial.readBytes(frame, 1) != 1) {
+    replyError(ERR_FRAME, "Bad frame: truncated");
+    return;
+  }
+  
+  uint8_t opcode = frame[0];
+  int8_t fixedLen = frameFixedLength(opcode);
+  if (fixedLen < 0) {
+    replyError(ERR_FRAME, "Bad frame opcode");
+    skipToNextFrame();
+    return;
+  }
+  
+  size_t len = 1;
+  if (Serial.readBytes(frame + len, fixedLen) != (size_t)fixedLen) {
+    replyError(ERR_FRAME, "Bad frame: truncated");
+    return;
+  }
+  len += fixedLen;
+  
+  uint8_t textLen = 0;
+  const uint8_t* blob = frame + len;  // Raw payload of OP_BLIT and OP_BITMAP
+  if (opcode == OP_PRT || opcode == OP_QR_CODE || opcode == OP_BLIT || opcode == OP_BITMAP) {
+    if (Serial.readBytes(frame + len, 1) != 1) {
+      replyError(ERR_FRAME, "Bad frame: truncated");
+      return;
+    }
+    textLen = frame[len++];
+    if (Serial.readBytes(frame + len, textLen) != textLen) {
+      replyError(ERR_FRAME, "Bad frame: truncated");
+      return;
+    }
+    memcpy(text, frame + len, textLen);
+    len += textLen;
+  }
+  text[textLen] = '\0';
+  
+  uint8_t crc;
+  uint8_t expected = sequenced ? crc8(frame, len, crc8(&seq, 1)) : crc8(frame, len);
+  if (Serial.readBytes(&crc, 1) != 1 || crc != expected) {
+    replyError(ERR_FRAME, "Bad frame CRC");
+    skipToNextFrame();
+    return;
+  }
+  
+  const uint8_t* p = frame + 1;
+  switch (opcode) {
+    case OP_PRT:
+      screen.prt(text, readInt16(p), readInt16(p + 2), p[4]);
+      reply(String("Text printed: ") + text);
+      break;
+    case OP_CLEAR:
+      screen.clear(p[0], p[1], p[2]);
+      reply("Screen cleared");
+      break;
+    case OP_SET_COLOR:
+      screen.setColor(p[0], p[1], p[2]);
+      reply("Color set");
+      break;
+    case OP_QR_CODE:
+      screen.drawQRCode(text, readInt16(p), readInt16(p + 2), p[4],
+                        p[5], p[6], p[7], p[8], p[9], p[10]);
+      reply("QR code drawn");
+      break;
+    case OP_FILL_RECT:
+      screen.drawFillRect(readInt16(p), readInt16(p + 2), readInt16(p + 4), readInt16(p + 6));
+      reply("Rectangle filled");
+      break;
+    case OP_RECT:
+      screen.drawRect(readInt16(p), readInt16(p + 2), readInt16(p + 4), readInt16(p + 6));
+      reply("Rectangle drawn");
+      break;
+    case OP_LINE:
+      screen.drawLine(readInt16(p), readInt16(p + 2), readInt16(p + 4), readInt16(p + 6));
+      reply("Line drawn");
+      break;
+    case OP_FILL_CIRCLE:
+      screen.drawFillCircle(readInt16(p), readInt16(p + 2), readInt16(p + 4));
+      reply("Circle filled");
+      break;
+    case OP_CIRCLE_OUTLINE:
+      screen.drawCircleOutline(readInt16(p), readInt16(p + 2), readInt16(p + 4));
+      reply("Circle outline drawn");
+      break;
+    case OP_TRIANGLE:
+      screen.drawTriangle(readInt16(p), readInt16(p + 2), readInt16(p + 4),
+                          readInt16(p + 6), readInt16(p + 8), readInt16(p + 10));
+      reply("Triangle drawn");
+      break;
+    case OP_FILL_TRIANGLE:
+      screen.drawFillTriangle(readInt16(p), readInt16(p + 2), readInt16(p + 4),
+                              readInt16(p + 6), readInt16(p + 8), readInt16(p + 10));
+      reply("Triangle filled");
+      break;
+    case OP_ROUND_RECT:
+      screen.drawRoundRect(readInt16(p), readInt16(p + 2), readInt16(p + 4), readInt16(p + 6), readInt16(p + 8));
+      reply("Rounded rectangle drawn");
+      break;
+    case OP_FILL_ROUND_RECT:
+      screen.drawFillRoundRect(readInt16(p), readInt16(p + 2), readInt16(p + 4), readInt16(p + 6), readInt16(p + 8));
+      reply("Rounded rectangle filled");
+      break;
+    case OP_ELLIPSE:
+      screen.drawEllipse(readInt16(p), readInt16(p + 2), readInt16(p + 4), readInt16(p + 6));
+      reply("Ellipse drawn");
+      break;
+    case OP_FILL_ELLIPSE:
+      screen.drawFillEllipse(readInt16(p), readInt16(p + 2), readInt16(p + 4), readInt16(p + 6));
+      reply("Ellipse filled");
+      break;
+    case OP_FLUSH:
+      screen.flush();
+      reply("Screen flushed");
+      break;
+    case OP_BLIT:
+      if (screen.writePixels(readUint16(p), readUint16(p + 2), readUint16(p + 4), blob, textLen)) {
+        reply("Pixels written");
+      } else {
+        replyError(ERR_DATA, "Bad blit data");
+      }
+      break;
+    case OP_BITMAP:
+      if (drawPackedBitmap(readInt16(p), readInt16(p + 2), p[4], p[5], blob, textLen)) {
+        reply("Bitmap drawn");
+      } else {
+        replyError(ERR_DATA, "Bad bitmap data");
+      }
+      break;
+  }
 }
 
 void processSerialCommand() {
-  if (Serial.available()) {
+  if (Serial.available() && (Serial.peek() == FRAME_SYNC || Serial.peek() == FRAME_SYNC_SEQ)) {
+    processBinaryFrame();
+  }
+  else if (Serial.available()) {
     String command = Serial.readStringUntil('\n');
     command.trim();
     
+    // "#<seq>|" asks for a structured answer
+    commandSeq = -1;
+    if (command.startsWith("#")) {
+      int end = command.indexOf('|');
+      if (end < 0) {
+        Serial.println("Invalid command format");
+        return;
+      }
+      commandSeq = command.substring(1, end).toInt() & 0xFF;
+      command = command.substring(end + 1);
+    }
+    
     // Split the command by delimiter '|'
     int params[10];  // Array to store numeric parameters
     String textParam = "";  // For text parameter
@@ -60,7 +439,7 @@ void processSerialCommand() {
     }
     
     if (partCount < 1) {
-      Serial.println("Invalid command format");
+      replyError(ERR_FORMAT, "Invalid command format");
       return;
     }
     
@@ -72,8 +451,11 @@ void processSerialCommand() {
       for (int i = 0; i < 3; i++) {
         params[i] = parts[i+2].toInt();
       }
-      screen.prt(textParam, params[0], params[1], params[2]);
-      Serial.println("Text printed: " + textParam);
+      if (printWithFont(textParam, params[0], params[1], params[2], partCount >= 6 ? parts[5] : String())) {
+        reply("Text printed: " + textParam);
+      } else {
+        replyError(ERR_DATA, "Unknown font");
+      }
     }
     else if (cmd == "clear" && partCount >= 1) {
       if (partCount >= 4) {
@@ -84,14 +466,14 @@ void processSerialCommand() {
       } else {
         screen.clear(); // Use default values
       }
-      Serial.println("Screen cleared");
+      reply("Screen cleared");
     }
     else if (cmd == "setColor" && partCount >= 4) {
       for (int i = 0; i < 3; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.setColor(params[0], params[1], params[2]);
-      Serial.println("Color set");
+      reply("Color set");
     }
     else if (cmd == "drawQRCode" && partCount >= 11) {
       textParam = parts[1];
@@ -100,91 +482,122 @@ void processSerialCommand() {
       }
       screen.drawQRCode(textParam.c_str(), params[0], params[1], params[2], 
                         params[3], params[4], params[5], params[6], params[7], params[8]);
-      Serial.println("QR code drawn");
+      reply("QR code drawn");
     }
     else if (cmd == "drawFillRect" && partCount >= 5) {
       for (int i = 0; i < 4; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawFillRect(params[0], params[1], params[2], params[3]);
-      Serial.println("Rectangle filled");
+      reply("Rectangle filled");
     }
     else if (cmd == "drawRect" && partCount >= 5) {
       for (int i = 0; i < 4; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawRect(params[0], params[1], params[2], params[3]);
-      Serial.println("Rectangle drawn");
+      reply("Rectangle drawn");
     }
     else if (cmd == "drawLine" && partCount >= 5) {
       for (int i = 0; i < 4; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawLine(params[0], params[1], params[2], params[3]);
-      Serial.println("Line drawn");
+      reply("Line drawn");
     }
     else if (cmd == "drawFillCircle" && partCount >= 4) {
       for (int i = 0; i < 3; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawFillCircle(params[0], params[1], params[2]);
-      Serial.println("Circle filled");
+      reply("Circle filled");
     }
     else if (cmd == "drawCircleOutline" && partCount >= 4) {
       for (int i = 0; i < 3; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawCircleOutline(params[0], params[1], params[2]);
-      Serial.println("Circle outline drawn");
+      reply("Circle outline drawn");
     }
     else if (cmd == "drawTriangle" && partCount >= 7) {
       for (int i = 0; i < 6; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawTriangle(params[0], params[1], params[2], params[3], params[4], params[5]);
-      Serial.println("Triangle drawn");
+      reply("Triangle drawn");
     }
     else if (cmd == "drawFillTriangle" && partCount >= 7) {
       for (int i = 0; i < 6; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawFillTriangle(params[0], params[1], params[2], params[3], params[4], params[5]);
-      Serial.println("Triangle filled");
+      reply("Triangle filled");
     }
     else if (cmd == "drawRoundRect" && partCount >= 6) {
       for (int i = 0; i < 5; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawRoundRect(params[0], params[1], params[2], params[3], params[4]);
-      Serial.println("Rounded rectangle drawn");
+      reply("Rounded rectangle drawn");
     }
     else if (cmd == "drawFillRoundRect" && partCount >= 6) {
       for (int i = 0; i < 5; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawFillRoundRect(params[0], params[1], params[2], params[3], params[4]);
-      Serial.println("Rounded rectangle filled");
+      reply("Rounded rectangle filled");
     }
     else if (cmd == "drawEllipse" && partCount >= 5) {
       for (int i = 0; i < 4; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawEllipse(params[0], params[1], params[2], params[3]);
-      Serial.println("Ellipse drawn");
+      reply("Ellipse drawn");
     }
     else if (cmd == "drawFillEllipse" && partCount >= 5) {
       for (int i = 0; i < 4; i++) {
         params[i] = parts[i+1].toInt();
       }
       screen.drawFillEllipse(params[0], params[1], params[2], params[3]);
-      Serial.println("Ellipse filled");
+      reply("Ellipse filled");
     }
     else if (cmd == "flush") {
       screen.flush();
-      Serial.println("Screen flushed");
+      reply("Screen flushed");
+    }
+    else if (cmd == "blit" && partCount >= 5) {
+      static uint8_t blitData[FRAME_MAX_TEXT];
+      int len = hexDecode(parts[4], blitData, sizeof(blitData));
+      if (len >= 0 && screen.writePixels(parts[1].toInt(), parts[2].toInt(), parts[3].toInt(), blitData, len)) {
+        reply("Pixels written");
+      } else {
+        replyError(ERR_DATA, "Bad blit data");
+      }
+    }
+    else if (cmd == "drawBitmap" && partCount >= 6) {
+      static uint8_t bitmapData[FRAME_MAX_TEXT];
+      int len = hexDecode(parts[5], bitmapData, sizeof(bitmapData));
+      if (len >= 0 && drawPackedBitmap(parts[1].toInt(), parts[2].toInt(), parts[3].toInt(), parts[4].toInt(),
+                                       bitmapData, len)) {
+        reply("Bitmap drawn");
+      } else {
+        replyError(ERR_DATA, "Bad bitmap data");
+      }
+    }
+    else if (cmd == "proto" && partCount >= 2 && parts[1] == "bin") {
+      reply("Binary frames supported");
+    }
+    else if (cmd == "link" && partCount >= 2) {
+      switchLink(parts[1].toInt());
+    }
+    else if (cmd == "version") {
+      Serial.println("Version " FIRMWARE_VERSION "|" FIRMWARE_CAPABILITIES);
+    }
+    else if (cmd == "ping") {
+      reply("Pong " + String(partCount >= 2 ? parts[1].length() : 0));
     }
     else {
-      Serial.println("Unknown or incomplete command: " + cmd);
+      replyError(ERR_UNKNOWN, "Unknown or incomplete command: " + cmd);
     }
   }
 }
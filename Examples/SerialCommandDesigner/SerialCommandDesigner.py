@@ -2,10 +2,96 @@ import tkinter as tk
 from tkinter import ttk, colorchooser, simpledialog, filedialog, messagebox
 import serial
 import serial.tools.list_ports
-import time
+import queue
 import json
 import os
 import math
+from functools import lru_cache
+
+from serial_link import SerialWorker, DEFAULT_WINDOW, EMULATOR_PORT, encode_text
+from binary_protocol import encode_command
+from design_compiler import item_command, arduino_code, expand_qr_codes
+from upload_pipeline import prepare_upload
+from raster_upload import UPLOAD_MODES, plan_transfer
+from rasterizer import render_design
+from cost_model import CostModel, ItemCosts, COST_MODEL_FILE, heat_color
+from spatial_index import SpatialIndex, hit_test, pick_bounds
+from design_items import as_item
+from design_file import DESIGN_EXTENSION, write_design, read_design
+from fleet import FleetUpload, FleetState
+from link_setup import LINK_SPEEDS, BOOT_BAUD, LinkSettings, open_link, reset_link
+from layer_list import LayerList
+from frame_pacer import MotionCoalescer
+from edit_history import EditHistory, MoveDelta, FieldsDelta, InsertDelta, DeleteDelta, ClearDelta, LayerDelta
+from item_geometry import qr_size, qr_version_for
+from gfx_font import available_fonts, font_for, mask_rectangles, text_bounds
+import qr_encoder
+
+# Distinct QR code looks kept as Tk images before unused ones are dropped
+QR_IMAGE_LIMIT = 64
+TEXT_IMAGE_LIMIT = 256
+
+# Font choice for text printed with the sketch's built-in font
+BUILTIN_FONT = "Built-in"
+
+# Memory the undo history may hold before the oldest edits are forgotten
+HISTORY_BYTES = 8 * 1024 * 1024
+
+@lru_cache(maxsize=512)
+def rounded_rect_outline(w, h, radius):
+    """Rounded rectangle outline of size w x h at the origin, as a flat point tuple"""
+    # Limit radius to prevent overlap
+    radius = min(radius, w//2, h//2)
+    points = []
+    
+    # Add the points in sequence to form a complete shape
+    points.extend([radius, 0])  # Top left start
+    points.extend([w - radius, 0])  # Top edge
+    
+    # Top right corner
+    for i in range(0, 91, 5):
+        angle = i * math.pi / 180
+        points.extend([
+            w - radius + (radius * math.sin(angle)),
+            radius - (radius * math.cos(angle))
+        ])
+    
+    points.extend([w, radius])  # Right edge start
+    points.extend([w, h - radius])  # Right edge end
+    
+    # Bottom right corner
+    for i in range(0, 91, 5):
+        angle = i * math.pi / 180
+        points.extend([
+            w - radius + (radius * math.cos(angle)),
+            h - radius + (radius * math.sin(angle))
+        ])
+    
+    points.extend([w - radius, h])  # Bottom edge start
+    points.extend([radius, h])  # Bottom edge end
+    
+    # Bottom left corner
+    for i in range(0, 91, 5):
+        angle = i * math.pi / 180
+        points.extend([
+            radius - (radius * math.cos(angle)),
+            h - radius + (radius * math.sin(angle))
+        ])
+    
+    points.extend([0, h - radius])  # Left edge start
+    points.extend([0, radius])  # Left edge end
+    
+    # Top left corner
+    for i in range(0, 91, 5):
+        angle = i * math.pi / 180
+        points.extend([
+            radius - (radius * math.sin(angle)),
+            radius - (radius * math.cos(angle))
+        ])
+    
+    points.extend([radius, 0])  # Close the shape
+    return tuple(points)
+
 
 class ArduinoLCDController:
     def __init__(self, root):
@@ -19,16 +105,39 @@ class ArduinoLCDController:
         
         # Serial connection
         self.serial_conn = None
+        self.serial_worker = None  # Owns serial_conn while connected
         self.connected = False
+        self.upload_job = None
+        self.qr_bitmaps = False  # Firmware draws host encoded QR codes (drawBitmap)
+        self.qr_images = {}  # (data, module size, fg, bg) -> Tk image of the symbol
+        self.named_fonts = True  # Firmware prints with the font a text item names
+        self.text_images = {}  # text_image_key() -> (Tk image of the glyphs, dx, dy)
+        
+        # What the panel shows after the last completed upload (None = unknown)
+        self.device_snapshot = None
+        self.upload_snapshot = None
+        self.fleet_upload = None
+        
+        # Upload time estimates, calibrated by every completed upload
+        self.cost_model = CostModel(COST_MODEL_FILE)
+        self.item_costs = ItemCosts(self.cost_model, command_for=self.get_item_command)
+        self.heat_ids = {}  # item uid -> overlay rectangle
+        self.cost_refresh_pending = False
         
         # Current drawing properties
         self.current_color = (255, 255, 255)  # Default: white
         self.current_text_size = 2
         self.current_tool = "select"
         self.selected_item = None
+        self.selected_items = []  # Rubber-band selection, includes selected_item
         
         # Store all drawn items
         self.canvas_items = []
+        self.spatial_index = SpatialIndex()  # Grid over the items for hit testing
+        self.history = EditHistory(HISTORY_BYTES)
+        self.drag_serial = 0  # Coalesces the history records of one mouse drag
+        self.history_note = ""  # Appended to the status after an undo or redo
+        self.marquee_start = None
         self.temp_item = None
         self.start_x = 0
         self.start_y = 0
@@ -51,6 +160,9 @@ class ArduinoLCDController:
         self.root.bind('<Shift-Right>', self.handle_key_movement)
         self.root.bind('<Shift-Up>', self.handle_key_movement)
         self.root.bind('<Shift-Down>', self.handle_key_movement)
+        self.root.bind('<Control-z>', self.undo)
+        self.root.bind('<Control-y>', self.redo)
+        self.root.bind('<Control-Z>', self.redo)
         
         self.setup_ui()
         self.update_listbox()  # Add this line
@@ -72,18 +184,33 @@ class ArduinoLCDController:
         
         self.port_combo = ttk.Combobox(conn_frame, width=15)
         self.port_combo.grid(row=0, column=1, padx=5, pady=5)
-        self.refresh_ports()
+        self.port_combo.bind("<<ComboboxSelected>>", lambda event: self.select_port_baud())
         
         ttk.Button(conn_frame, text="Refresh", command=self.refresh_ports).grid(row=0, column=2, padx=5, pady=5)
         ttk.Label(conn_frame, text="Baud:").grid(row=1, column=0, padx=5, pady=5)
         
-        self.baud_combo = ttk.Combobox(conn_frame, width=15, values=["9600", "19200", "38400", "57600", "115200"])
-        self.baud_combo.current(4)  # Default to 115200
+        # Rates above the sketch's boot rate are negotiated when connecting
+        self.baud_combo = ttk.Combobox(conn_frame, width=15, values=[str(baud) for baud in LINK_SPEEDS])
+        self.baud_combo.set(str(BOOT_BAUD))
         self.baud_combo.grid(row=1, column=1, padx=5, pady=5)
+        self.link_settings = LinkSettings()
+        self.refresh_ports()
+        self.baud_combo.bind("<<ComboboxSelected>>", lambda event: self.reprice_items())
         
         self.connect_btn = ttk.Button(conn_frame, text="Connect", command=self.toggle_connection)
         self.connect_btn.grid(row=1, column=2, padx=5, pady=5)
         
+        # Number of commands kept in flight while uploading
+        ttk.Label(conn_frame, text="Window:").grid(row=2, column=0, padx=5, pady=5)
+        self.window_var = tk.IntVar(value=DEFAULT_WINDOW)
+        ttk.Spinbox(conn_frame, from_=1, to=64, width=5, textvariable=self.window_var).grid(
+            row=2, column=1, padx=5, pady=5, sticky=tk.W)
+        
+        # Opt-in compact binary frames (falls back to text on older firmware)
+        self.binary_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(conn_frame, text="Binary", variable=self.binary_var,
+                        command=self.reprice_items).grid(row=2, column=2, padx=5, pady=5)
+        
         # Tools
         tools_frame = ttk.LabelFrame(left_panel, text="Tools")
         tools_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -120,8 +247,8 @@ class ArduinoLCDController:
         
         ttk.Button(color_frame, text="Choose Color", command=self.choose_color).grid(row=0, column=1, padx=5, pady=5)
         
-        # Text size
-        text_frame = ttk.LabelFrame(left_panel, text="Text Size")
+        # Text size and font
+        text_frame = ttk.LabelFrame(left_panel, text="Text")
         text_frame.pack(fill=tk.X, padx=5, pady=5)
         
         self.text_size_var = tk.IntVar(value=2)
@@ -130,6 +257,11 @@ class ArduinoLCDController:
         size_spin = ttk.Spinbox(text_frame, from_=1, to=5, width=5, textvariable=self.text_size_var)
         size_spin.grid(row=0, column=1, padx=5, pady=5)
         
+        self.text_font_var = tk.StringVar(value=BUILTIN_FONT)
+        ttk.Label(text_frame, text="Font:").grid(row=1, column=0, padx=5, pady=5)
+        ttk.Combobox(text_frame, textvariable=self.text_font_var, width=20, state="readonly",
+                     values=[BUILTIN_FONT] + available_fonts()).grid(row=1, column=1, padx=5, pady=5)
+        
         # Right side container
         right_container = ttk.Frame(main_frame)
         right_container.pack(side=tk.RIGHT, fill=tk.Y, padx=5, pady=5)
@@ -138,11 +270,39 @@ class ArduinoLCDController:
         project_frame = ttk.LabelFrame(right_container, text="Project")
         project_frame.pack(fill=tk.X, padx=5, pady=5)
         
+        undo_row = ttk.Frame(project_frame)
+        undo_row.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Button(undo_row, text="Undo", command=self.undo).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(undo_row, text="Redo", command=self.redo).pack(side=tk.LEFT, fill=tk.X, expand=True)
         ttk.Button(project_frame, text="Clear Screen", command=self.clear_screen).pack(fill=tk.X, padx=5, pady=2)
         ttk.Button(project_frame, text="Save Design", command=self.save_design).pack(fill=tk.X, padx=5, pady=2)
         ttk.Button(project_frame, text="Load Design", command=self.load_design).pack(fill=tk.X, padx=5, pady=2)
         ttk.Button(project_frame, text="Send to Arduino", command=self.send_to_arduino).pack(fill=tk.X, padx=5, pady=2)
+        ttk.Button(project_frame, text="Cancel Upload", command=self.cancel_upload).pack(fill=tk.X, padx=5, pady=2)
+        ttk.Button(project_frame, text="Send to Fleet", command=self.send_to_fleet).pack(fill=tk.X, padx=5, pady=2)
+        
+        # Skip layers hidden under opaque shapes when uploading
+        self.cull_var = tk.BooleanVar(value=True)
+        self.clip_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(project_frame, text="Skip hidden items", variable=self.cull_var).pack(fill=tk.X, padx=5, pady=2)
+        ttk.Checkbutton(project_frame, text="Clip covered rects", variable=self.clip_var).pack(fill=tk.X, padx=5, pady=2)
+        
+        # Vector commands, raster blits or whichever is fewer bytes
+        upload_row = ttk.Frame(project_frame)
+        upload_row.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Label(upload_row, text="Upload as:").pack(side=tk.LEFT)
+        self.upload_mode_var = tk.StringVar(value="auto")
+        ttk.Combobox(upload_row, textvariable=self.upload_mode_var, values=UPLOAD_MODES,
+                     state="readonly", width=8).pack(side=tk.LEFT, padx=5)
+        
+        # Estimated time of a full upload and where it goes
+        self.estimate_var = tk.StringVar(value="Estimate: -")
+        ttk.Label(project_frame, textvariable=self.estimate_var).pack(fill=tk.X, padx=5, pady=2)
+        self.heat_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(project_frame, text="Cost overlay", variable=self.heat_var,
+                        command=self.draw_heat_overlay).pack(fill=tk.X, padx=5, pady=2)
         ttk.Button(project_frame, text="Export Commands", command=self.export_commands).pack(fill=tk.X, padx=5, pady=2)
+        ttk.Button(project_frame, text="Device Preview", command=self.show_device_preview).pack(fill=tk.X, padx=5, pady=2)
         
         # Center area for canvas and layers
         center_panel = ttk.Frame(main_frame)
@@ -160,6 +320,11 @@ class ArduinoLCDController:
         self.canvas.bind("<ButtonPress-1>", self.on_canvas_click)
         self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
+        
+        # Drags are applied at most once per display frame
+        self.drag_coalescer = MotionCoalescer(self.canvas, self.apply_drag)
+        self.selection_ids = []
+        self.selection_kinds = []
 
         # Layer Management below canvas
         layer_frame = ttk.LabelFrame(center_panel, text="Layers")
@@ -176,6 +341,7 @@ class ArduinoLCDController:
         ttk.Button(list_controls, text="Edit Text", command=self.edit_text).pack(fill=tk.X, pady=2)
         ttk.Button(list_controls, text="Edit Color", command=self.edit_color).pack(fill=tk.X, pady=2)
         ttk.Button(list_controls, text="Text Size", command=self.edit_text_size).pack(fill=tk.X, pady=2)
+        ttk.Button(list_controls, text="Text Font", command=self.edit_text_font).pack(fill=tk.X, pady=2)
 
         self.layer_listbox = tk.Listbox(list_frame, height=6, takefocus=0)
         self.layer_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -183,7 +349,9 @@ class ArduinoLCDController:
         scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.layer_listbox.yview)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        self.layer_listbox.config(yscrollcommand=scrollbar.set)
+        # Only the visible rows are kept in the listbox
+        self.layer_list = LayerList(self.layer_listbox, scrollbar,
+                                    lambda: self.canvas_items, lambda: self.selected_item)
         self.layer_listbox.bind('<<ListboxSelect>>', self.on_select_layer)
         
         # Layer movement buttons
@@ -207,9 +375,18 @@ class ArduinoLCDController:
         
     def refresh_ports(self):
         ports = [port.device for port in serial.tools.list_ports.comports()]
+        if os.path.exists(EMULATOR_PORT):
+            ports.append(EMULATOR_PORT)  # device_emulator.py is running
         self.port_combo['values'] = ports
         if ports:
             self.port_combo.current(0)
+            self.select_port_baud()
+    
+    def select_port_baud(self):
+        """Preselect the fastest link that worked on the chosen port before"""
+        link = self.link_settings.best(self.port_combo.get())
+        if link:
+            self.baud_combo.set(str(link.baud))
             
     def toggle_connection(self):
         if not self.connected:
@@ -217,17 +394,29 @@ class ArduinoLCDController:
             baud = int(self.baud_combo.get())
             
             try:
-                self.serial_conn = serial.Serial(port, baud, timeout=1)
-                time.sleep(2)  # Allow time for Arduino to reset
+                self.serial_conn, link = open_link(port, baud, settings=self.link_settings)
+                self.serial_worker = SerialWorker(self.serial_conn, link.max_inflight_bytes, on_close=reset_link)
+                self.serial_worker.binary_supported = link.device.supports("bin")
+                self.serial_worker.sequenced = bool(link.device.supports("seq"))
+                self.qr_bitmaps = bool(link.device.supports("bitmap"))
+                self.named_fonts = link.device.supports("font") is not False
+                self.serial_worker.start()
                 self.connected = True
+                self.device_snapshot = None
+                self.poll_serial_events()
                 self.connect_btn.config(text="Disconnect")
-                self.status_var.set(f"Connected to {port} at {baud} baud")
+                self.baud_combo.set(str(link.baud))
+                self.reprice_items()
+                self.status_var.set(f"Connected to {port} at {link.summary()} ({link.device.summary()})")
             except Exception as e:
                 messagebox.showerror("Connection Error", f"Failed to connect: {str(e)}")
                 self.status_var.set("Connection failed")
         else:
-            if self.serial_conn:
-                self.serial_conn.close()
+            if self.serial_worker:
+                self.serial_worker.stop()  # Also closes the port
+                self.serial_worker = None
+            self.serial_conn = None
+            self.upload_job = None
             self.connected = False
             self.connect_btn.config(text="Connect")
             self.status_var.set("Disconnected")
@@ -248,21 +437,107 @@ class ArduinoLCDController:
             self.current_color = (r, g, b)
     
     def clear_screen(self):
+        if self.canvas_items:
+            self.history.record(ClearDelta([(index, item, self.spatial_index.z.get(item["uid"]))
+                                            for index, item in enumerate(self.canvas_items)], self.connected))
         self.canvas.delete("all")
+        self.heat_ids = {}
         self.canvas_items = []
+        self.spatial_index.clear()
+        self.item_costs.invalidate()
         self.selected_item = None
-        self.layer_listbox.delete(0, tk.END)  # Clear the listbox
+        self.selected_items = []
+        self.update_listbox()
         if self.connected:
+            self.device_snapshot = None
             self.send_command("clear|0|0|0")
     
     def rgb_to_hex(self, rgb):
         return f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
     
+    def qr_image_key(self, item):
+        return (item["data"], item["module_size"], tuple(item.get("fg_color", (0, 0, 0))),
+                tuple(item.get("bg_color", (255, 255, 255))))
+    
+    def qr_image(self, item):
+        """Tk image of the symbol a QR code item draws, or None if its data does not fit"""
+        key = self.qr_image_key(item)
+        image = self.qr_images.get(key)
+        if image is not None:
+            return image
+        matrix = qr_encoder.matrix_for(item["data"], qr_version_for(item["data"]))
+        if matrix is None:
+            return None
+        if len(self.qr_images) >= QR_IMAGE_LIMIT:
+            # Images still on the canvas must stay referenced
+            in_use = {self.qr_image_key(other) for other in self.canvas_items if other["type"] == "qrcode"}
+            self.qr_images = {k: v for k, v in self.qr_images.items() if k in in_use}
+        data, module_size, fg, bg = key
+        fg, bg = self.rgb_to_hex(fg), self.rgb_to_hex(bg)
+        image = tk.PhotoImage(width=matrix.size, height=matrix.size)
+        image.put(" ".join("{" + " ".join(fg if dark else bg for dark in row) + "}" for row in matrix.modules))
+        image = image.zoom(module_size)
+        self.qr_images[key] = image
+        return image
+    
+    def create_qr_shape(self, item):
+        """Canvas shape of a QR code item: the real modules, or a placeholder if it cannot be encoded"""
+        x, y = item["coords"]
+        image = self.qr_image(item)
+        if image is not None:
+            return self.canvas.create_image(x, y, image=image, anchor="nw")
+        size = qr_size(item["data"], item["module_size"])
+        return self.canvas.create_rectangle(
+            x, y, x + size, y + size,
+            fill=self.rgb_to_hex((0, 0, 0)), outline=self.rgb_to_hex((255, 255, 255))
+        )
+    
+    def text_image_key(self, item):
+        x, y = item["coords"][:2]
+        font = font_for(item.get("font"))
+        layout = font.layout(item["text"], x, y, item["size"])
+        # Glyph positions relative to the cursor only change where the text wraps
+        return (font.name, item["size"], tuple(item["color"]),
+                tuple((index, left - x, top - y) for index, left, top in layout))
+    
+    def text_image(self, item):
+        """(Tk image, dx, dy) of the pixels a text item prints; the image goes at its position plus (dx, dy)"""
+        key = self.text_image_key(item)
+        cached = self.text_images.get(key)
+        if cached is not None:
+            return cached
+        if len(self.text_images) >= TEXT_IMAGE_LIMIT:
+            # Images still on the canvas must stay referenced
+            in_use = {self.text_image_key(other) for other in self.canvas_items if other["type"] == "text"}
+            self.text_images = {k: v for k, v in self.text_images.items() if k in in_use}
+        x, y = item["coords"][:2]
+        (x1, y1), mask = font_for(item.get("font")).render(item["text"], x, y, item["size"])
+        # A new photo image is transparent, so only the glyph pixels are painted
+        image = tk.PhotoImage(width=max(1, mask.shape[1]), height=max(1, mask.shape[0]))
+        color = self.rgb_to_hex(item["color"])
+        for rect in mask_rectangles(mask):
+            image.put(color, to=rect)
+        self.text_images[key] = (image, x1 - x, y1 - y)
+        return self.text_images[key]
+    
+    def create_text_shape(self, item):
+        """Canvas shape of a text item: the glyphs the device prints"""
+        x, y = item["coords"][:2]
+        image, dx, dy = self.text_image(item)
+        return self.canvas.create_image(x + dx, y + dy, image=image, anchor="nw")
+    
+    def update_text_shape(self, item):
+        x, y = item["coords"][:2]
+        image, dx, dy = self.text_image(item)
+        self.canvas.coords(item["id"], x + dx, y + dy)
+        self.canvas.itemconfig(item["id"], image=image)
+    
     def on_canvas_click(self, event):
         self.last_x = event.x
         self.last_y = event.y
         self.start_x = event.x  # Add this line
         self.start_y = event.y  # Add this line
+        self.drag_serial += 1
         
         if self.current_tool == "select":
             # Check if clicking on resize handle
@@ -271,32 +546,36 @@ class ArduinoLCDController:
                 return
                 
             # Check if clicking on an item
+            item = self.spatial_index.item_at(event.x, event.y)
+            if item:
+                # Clicking a member of a rubber-band selection drags the whole group
+                if item not in self.selected_items:
+                    self.selected_items = [item]
+                self.selected_item = item
+                self.dragging = True
+                self.highlight_selected_item()
+                return
+            
+            # Start a rubber-band selection on empty canvas
             self.selected_item = None
-            for item in reversed(self.canvas_items):
-                if self.is_point_in_item(event.x, event.y, item):
-                    self.selected_item = item
-                    self.dragging = True
-                    self.highlight_selected_item()
-                    return
-                    
+            self.selected_items = []
             self.canvas.delete("selection")
+            self.marquee_start = (event.x, event.y)
         
         elif self.current_tool == "text":
             text = simpledialog.askstring("Input", "Enter text:")
             if text:
-                size = self.text_size_var.get()
-                hex_color = self.rgb_to_hex(self.current_color)
-                item_id = self.canvas.create_text(event.x, event.y, text=text, fill=hex_color, anchor="nw", 
-                                                 font=("Arial", 10 * size))
+                font = self.text_font_var.get()
                 item = {
                     "type": "text",
-                    "id": item_id,
                     "coords": [event.x, event.y],
                     "color": self.current_color,
                     "text": text,
-                    "size": size
+                    "size": self.text_size_var.get(),
+                    "font": None if font == BUILTIN_FONT else font
                 }
-                self.canvas_items.append(item)
+                item["id"] = self.create_text_shape(item)
+                self.add_item(item)
                 self.update_listbox()
         
         elif self.current_tool == "qrcode":
@@ -306,21 +585,16 @@ class ArduinoLCDController:
                                                     minvalue=1, maxvalue=10,
                                                     parent=self.root)
                 if module_size:
-                    size = module_size * 25
-                    item_id = self.canvas.create_rectangle(
-                        event.x, event.y, event.x + size, event.y + size,
-                        fill=self.rgb_to_hex((0, 0, 0)), outline=self.rgb_to_hex((255, 255, 255))
-                    )
                     item = {
                         "type": "qrcode",
-                        "id": item_id,
                         "coords": [event.x, event.y],
                         "data": data,
                         "module_size": module_size,
                         "fg_color": (0, 0, 0),
                         "bg_color": (255, 255, 255)
                     }
-                    self.canvas_items.append(item)
+                    item["id"] = self.create_qr_shape(item)
+                    self.add_item(item)
                     self.update_listbox()
         else:
             # For all other drawing tools, just set the start point
@@ -328,17 +602,31 @@ class ArduinoLCDController:
             pass
     
     def on_canvas_drag(self, event):
-        if self.current_tool == "select":
-            if self.resizing and self.selected_item:
-                self.resize_selected_item(event.x, event.y)
-            elif self.dragging and self.selected_item:
-                self.move_selected_item(event.x - self.last_x, event.y - self.last_y)
-                
-            self.last_x = event.x
-            self.last_y = event.y
+        # Motion events are coalesced and applied once per display frame
+        self.drag_coalescer.push(event)
+    
+    def apply_drag(self, event):
+        if self.current_tool != "select":
+            self.draw_temp_shape(event)
             return
         
-        elif self.current_tool in ["rect", "fillrect", "roundrect", "fillroundrect"]:
+        if self.resizing and self.selected_item:
+            self.resize_selected_item(event.x, event.y)
+        elif self.dragging and self.selected_item:
+            self.move_selected_item(event.x - self.last_x, event.y - self.last_y, ("drag", self.drag_serial))
+        elif self.marquee_start:
+            x0, y0 = self.marquee_start
+            if self.canvas.find_withtag("marquee"):
+                self.canvas.coords("marquee", x0, y0, event.x, event.y)
+            else:
+                self.canvas.create_rectangle(x0, y0, event.x, event.y, outline="#00FFFF",
+                                             dash=(4, 2), tags="marquee")
+            
+        self.last_x = event.x
+        self.last_y = event.y
+    
+    def draw_temp_shape(self, event):
+        if self.current_tool in ["rect", "fillrect", "roundrect", "fillroundrect"]:
             self.canvas.delete("temp")
             hex_color = self.rgb_to_hex(self.current_color)
             
@@ -392,10 +680,24 @@ class ArduinoLCDController:
             )
     
     def on_canvas_release(self, event):
+        self.drag_coalescer.flush()
+        if self.drag_coalescer.frames and (self.dragging or self.resizing):
+            self.status_var.set(self.drag_coalescer.summary())
+        self.drag_coalescer.reset()
         self.dragging = False
         self.resizing = False
         
         if self.current_tool == "select":
+            if self.marquee_start:
+                x0, y0 = self.marquee_start
+                self.marquee_start = None
+                self.canvas.delete("marquee")
+                rect = (min(x0, event.x), min(y0, event.y), max(x0, event.x), max(y0, event.y))
+                self.selected_items = self.spatial_index.items_in_rect(rect)
+                self.selected_item = self.selected_items[-1] if self.selected_items else None
+                self.highlight_selected_item()
+                if self.selected_items:
+                    self.status_var.set(f"Selected {len(self.selected_items)} item(s)")
             return
             
         self.canvas.delete("temp")
@@ -416,7 +718,7 @@ class ArduinoLCDController:
             else:  # fillrect
                 item_id = self.canvas.create_rectangle(x1, y1, x2, y2, fill=hex_color, outline=hex_color)
                 
-            self.canvas_items.append({
+            self.add_item({
                 "type": self.current_tool,
                 "id": item_id,
                 "coords": [x1, y1, x2, y2],
@@ -446,7 +748,7 @@ class ArduinoLCDController:
                 "coords": [x1, y1, x2, y2],
                 "color": self.current_color
             }
-            self.canvas_items.append(item)
+            item = self.add_item(item)
             
             # Now ask for radius
             radius = simpledialog.askinteger("Input", "Enter corner radius (pixels):", 
@@ -487,7 +789,7 @@ class ArduinoLCDController:
                     fill=hex_color, outline=hex_color
                 )
                 
-            self.canvas_items.append({
+            self.add_item({
                 "type": self.current_tool,
                 "id": item_id,
                 "coords": [self.start_x, self.start_y, int(radius)],
@@ -496,7 +798,7 @@ class ArduinoLCDController:
             
         elif self.current_tool == "line":
             item_id = self.canvas.create_line(self.start_x, self.start_y, event.x, event.y, fill=hex_color)
-            self.canvas_items.append({
+            self.add_item({
                 "type": "line",
                 "id": item_id,
                 "coords": [self.start_x, self.start_y, event.x, event.y],
@@ -505,171 +807,160 @@ class ArduinoLCDController:
             
         self.update_listbox()
     
+    def add_item(self, item):
+        """Append a new item on top of the design and return it as a typed item"""
+        item = as_item(item)
+        self.canvas_items.append(item)
+        self.spatial_index.insert(item)
+        self.item_costs.mark_changed(item)
+        self.history.record(InsertDelta([(len(self.canvas_items) - 1, item, self.spatial_index.z[item["uid"]])]))
+        return item
+    
+    def selection_shapes(self):
+        """Overlay shapes for the current selection as (kind, coords, options)"""
+        outline = {"outline": "#00FFFF", "width": 2, "dash": (2, 4)}
+        handle = {"fill": "#00FFFF"}
+        if len(self.selected_items) > 1:
+            shapes = []
+            for item in self.selected_items:
+                x1, y1, x2, y2 = pick_bounds(item)
+                shapes.append(("rectangle", (x1-2, y1-2, x2+2, y2+2), {"outline": "#00FFFF", "dash": (2, 4)}))
+            return shapes
+        if not self.selected_item:
+            return []
+        
+        item_type = self.selected_item["type"]
+        if item_type in ["rect", "fillrect", "roundrect", "fillroundrect"]:
+            x1, y1, x2, y2 = self.selected_item["coords"]
+            # Selection rectangle and resize handle
+            return [("rectangle", (x1-2, y1-2, x2+2, y2+2), outline),
+                    ("rectangle", (x2-5, y2-5, x2+5, y2+5), handle)]
+        elif item_type in ["circle", "fillcircle"]:
+            x, y, r = self.selected_item["coords"]
+            # Selection circle and resize handle
+            return [("oval", (x-r-2, y-r-2, x+r+2, y+r+2), outline),
+                    ("rectangle", (x+r-5, y-5, x+r+5, y+5), handle)]
+        elif item_type == "line":
+            x1, y1, x2, y2 = self.selected_item["coords"]
+            return [("line", (x1, y1, x2, y2), {"fill": "#00FFFF", "width": 3, "dash": (2, 4)})]
+        elif item_type == "text":
+            x, y = self.selected_item["coords"][:2]
+            x1, y1, x2, y2 = text_bounds(self.selected_item["text"], x, y, self.selected_item["size"],
+                                         self.selected_item.get("font"))
+            return [("rectangle", (x1-2, y1-2, x2+2, y2+2), outline)]
+        elif item_type == "qrcode":
+            x, y = self.selected_item["coords"]
+            size = qr_size(self.selected_item["data"], self.selected_item["module_size"])
+            return [("rectangle", (x-2, y-2, x+size+2, y+size+2), outline)]
+        return []
+    
     def highlight_selected_item(self):
+        shapes = self.selection_shapes()
+        kinds = [kind for kind, _, _ in shapes]
+        
+        # Same overlay layout as before: move the existing shapes in place
+        if kinds and kinds == self.selection_kinds and \
+                len(self.canvas.find_withtag("selection")) == len(self.selection_ids):
+            for item_id, (_, coords, _) in zip(self.selection_ids, shapes):
+                self.canvas.coords(item_id, *coords)
+            return
+        
         self.canvas.delete("selection")
-        if self.selected_item:
-            item_type = self.selected_item["type"]
-            if item_type in ["rect", "fillrect", "roundrect", "fillroundrect"]:
-                x1, y1, x2, y2 = self.selected_item["coords"]
-                # Draw selection rectangle
-                self.canvas.create_rectangle(
-                    x1-2, y1-2, x2+2, y2+2,
-                    outline="#00FFFF", width=2, dash=(2, 4), tags="selection"
-                )
-                # Draw resize handle
-                self.canvas.create_rectangle(
-                    x2-5, y2-5, x2+5, y2+5,
-                    fill="#00FFFF", tags="selection"
-                )
-                
-            elif item_type in ["circle", "fillcircle"]:
-                x, y, r = self.selected_item["coords"]
-                # Draw selection circle
-                self.canvas.create_oval(
-                    x-r-2, y-r-2, x+r+2, y+r+2,
-                    outline="#00FFFF", width=2, dash=(2, 4), tags="selection"
-                )
-                # Draw resize handle
-                self.canvas.create_rectangle(
-                    x+r-5, y-5, x+r+5, y+5,
-                    fill="#00FFFF", tags="selection"
-                )
-            elif item_type == "line":
-                x1, y1, x2, y2 = self.selected_item["coords"]
-                self.canvas.create_line(
-                    x1, y1, x2, y2,
-                    fill="#00FFFF", width=3, dash=(2, 4), tags="selection"
-                )
-            elif item_type == "text":
-                x, y = self.selected_item["coords"][:2]
-                text = self.selected_item["text"]
-                size = self.selected_item["size"]
-                # Adjust text bounds calculation for better accuracy
-                text_width = len(text) * 8 * size  # Increased from 6 to 8
-                text_height = 12 * size  # Increased from 8 to 12
-                self.canvas.create_rectangle(
-                    x-2, y-2, x+text_width+2, y+text_height+2,
-                    outline="#00FFFF", width=2, dash=(2, 4), tags="selection"
-                )
-            elif item_type == "qrcode":
-                x, y = self.selected_item["coords"]
-                size = self.selected_item["module_size"] * 25
-                self.canvas.create_rectangle(
-                    x-2, y-2, x+size+2, y+size+2,
-                    outline="#00FFFF", width=2, dash=(2, 4), tags="selection"
-                )
+        create = {"rectangle": self.canvas.create_rectangle, "oval": self.canvas.create_oval,
+                  "line": self.canvas.create_line}
+        self.selection_ids = [create[kind](*coords, tags="selection", **options)
+                              for kind, coords, options in shapes]
+        self.selection_kinds = kinds
+    
+    def submit_commands(self, name, commands):
+        try:
+            window = self.window_var.get()
+        except tk.TclError:
+            window = DEFAULT_WINDOW
+        return self.serial_worker.submit(name, commands, window=window, binary=self.binary_var.get())
     
     def send_command(self, cmd):
-        if self.connected and self.serial_conn:
-            try:
-                commands = cmd.split('\n')
-                responses = []
-                
-                for command in commands:
-                    if not command.strip():  # Skip empty commands
-                        continue
-                        
-                    self.serial_conn.write((command + '\n').encode())
-                    self.serial_conn.flush()  # Ensure command is sent
-                    time.sleep(0.1)  # Increased delay between commands
-                    
-                    # Read response
-                    response = self.serial_conn.readline().decode().strip()
-                    if not response:  # If no response, try reading again
-                        time.sleep(0.1)
-                        response = self.serial_conn.readline().decode().strip()
-                        
-                    responses.append(response)
-                    self.status_var.set(f"Sent: {command} - Response: {response}")
-                    
-                return responses[-1] if responses else None
-            except Exception as e:
-                messagebox.showerror("Serial Error", f"Failed to send command: {str(e)}")
-                self.status_var.set(f"Error sending command: {str(e)}")
-                return None
+        """Queue commands on the serial worker; the response shows up in the status bar"""
+        if self.connected and self.serial_worker:
+            return self.submit_commands("command", cmd.split('\n'))
         else:
             self.status_var.set("Not connected to Arduino")
             return None
     
-    def get_item_command(self, item):
-        item_type = item["type"]
-        
-        if item_type == "qrcode":
-            # QR codes use their own color settings
-            x, y = item["coords"]
-            module_size = item["module_size"]
-            data = item["data"]
-            fg_color = item.get("fg_color", (0, 0, 0))
-            bg_color = item.get("bg_color", (255, 255, 255))
-            commands = [f"drawQRCode|{data}|{x}|{y}|{module_size}|{bg_color[0]}|{bg_color[1]}|{bg_color[2]}|{fg_color[0]}|{fg_color[1]}|{fg_color[2]}"]
-            commands.append("flush")
-            return "\n".join(commands)
-        
-        # For all other items that use color
-        color = item["color"]
-        r, g, b = color
-        
-        # First set the color for the item
-        commands = [f"setColor|{r}|{g}|{b}"]
-        
-        if item_type == "rect":
-            x1, y1, x2, y2 = item["coords"]
-            commands.append(f"drawRect|{x1}|{y1}|{x2-x1}|{y2-y1}")
-        
-        elif item_type == "fillrect":
-            x1, y1, x2, y2 = item["coords"]
-            commands.append(f"drawFillRect|{x1}|{y1}|{x2-x1}|{y2-y1}")
-        
-        elif item_type == "roundrect":
-            x1, y1, x2, y2 = item["coords"]
-            radius = item["radius"]
-            commands.append(f"drawRoundRect|{x1}|{y1}|{x2-x1}|{y2-y1}|{radius}")
-        
-        elif item_type == "fillroundrect":
-            x1, y1, x2, y2 = item["coords"]
-            radius = item["radius"]
-            commands.append(f"drawFillRoundRect|{x1}|{y1}|{x2-x1}|{y2-y1}|{radius}")
-        
-        elif item_type == "circle":
-            x, y, radius = item["coords"]
-            commands.append(f"drawCircleOutline|{x}|{y}|{radius}")
-        
-        elif item_type == "fillcircle":
-            x, y, radius = item["coords"]
-            commands.append(f"drawFillCircle|{x}|{y}|{radius}")
-        
-        elif item_type == "line":
-            x1, y1, x2, y2 = item["coords"]
-            commands.append(f"drawLine|{x1}|{y1}|{x2}|{y2}")
+    def poll_serial_events(self):
+        """Apply events posted by the serial worker, then reschedule while connected"""
+        worker = self.serial_worker
+        if not worker:
+            return
         
-        elif item_type == "text":
-            x, y = item["coords"]
-            size = item["size"]
-            text = item["text"]
-            commands.append(f"prt|{text}|{x}|{y}|{size}")
+        progress = None
+        while True:
+            try:
+                event = worker.events.get_nowait()
+            except queue.Empty:
+                break
+            kind, job = event[0], event[1]
+            if kind == "progress":
+                progress = event  # Only the latest progress is worth a repaint
+            elif kind == "status":
+                self.status_var.set(event[2])
+            elif kind == "error":
+                progress = None
+                if job is self.upload_job:
+                    self.upload_job = None
+                    self.device_snapshot = None
+                messagebox.showerror("Serial Error", f"Failed to send {job.name}: {event[2]}")
+                self.status_var.set(f"Error sending {job.name}: {event[2]}")
+            elif kind == "cancelled":
+                progress = None
+                if job is self.upload_job:
+                    self.upload_job = None
+                    self.device_snapshot = None
+                    self.status_var.set(f"Upload cancelled after {event[2].commands} command(s)")
+            elif kind == "done":
+                progress = None
+                stats = event[2]
+                if job is self.upload_job:
+                    self.upload_job = None
+                    self.device_snapshot = None if stats.errors else self.upload_snapshot
+                    if stats.errors:
+                        self.status_var.set(f"Design sent with {stats.errors} rejected command(s): {stats.summary()}")
+                    else:
+                        self.status_var.set(f"Design sent to Arduino: {stats.summary()}")
+                        self.calibrate_costs(job, stats)
+                elif job.name == "command":
+                    self.status_var.set(f"Sent {stats.commands} command(s): {stats.summary()}")
+        
+        if progress:
+            _, job, acked, total, response = progress
+            if job is self.upload_job:
+                self.status_var.set(f"Sending command {acked}/{total}... ({response})")
+            else:
+                self.status_var.set(f"Sent command - Response: {response}")
         
-        commands.append("flush")
-        return "\n".join(commands)
+        self.root.after(50, self.poll_serial_events)
+    
+    def get_item_command(self, item):
+        return item_command(item)
     
     def save_design(self):
         file_path = filedialog.asksaveasfilename(
             defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            filetypes=[("JSON files", "*.json"), ("Binary design files", "*" + DESIGN_EXTENSION),
+                       ("All files", "*.*")]
         )
         
         if not file_path:
             return
         
-        save_data = []
-        for item in self.canvas_items:
-            # Create a copy of the item without the tkinter ID
-            save_item = item.copy()
-            save_item.pop('id', None)
-            save_data.append(save_item)
-        
         try:
-            with open(file_path, 'w') as f:
-                json.dump(save_data, f, indent=4)
+            if file_path.lower().endswith(DESIGN_EXTENSION):
+                write_design(file_path, self.canvas_items)
+            else:
+                # to_dict() leaves out the tkinter ID and the runtime uid
+                save_data = [item.to_dict() for item in self.canvas_items]
+                with open(file_path, 'w') as f:
+                    json.dump(save_data, f, indent=4)
             self.status_var.set(f"Design saved to {file_path}")
         except Exception as e:
             messagebox.showerror("Save Error", f"Failed to save design: {str(e)}")
@@ -678,78 +969,22 @@ class ArduinoLCDController:
     def load_design(self):
         file_path = filedialog.askopenfilename(
             defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            filetypes=[("Design files", "*.json *" + DESIGN_EXTENSION), ("JSON files", "*.json"),
+                       ("Binary design files", "*" + DESIGN_EXTENSION), ("All files", "*.*")]
         )
         
         if not file_path:
             return
         
         try:
-            with open(file_path, 'r') as f:
-                load_data = json.load(f)
-            
-            # Clear current canvas
-            self.canvas.delete("all")
-            self.canvas_items = []
-            
-            for item in load_data:
-                item_type = item["type"]
-                color = tuple(item["color"])
-                hex_color = self.rgb_to_hex(color)
-                
-                if item_type in ["rect", "fillrect"]:
-                    x1, y1, x2, y2 = item["coords"]
-                    if item_type == "rect":
-                        item_id = self.canvas.create_rectangle(x1, y1, x2, y2, outline=hex_color)
-                    else:  # fillrect
-                        item_id = self.canvas.create_rectangle(x1, y1, x2, y2, fill=hex_color, outline=hex_color)
-                
-                elif item_type in ["roundrect", "fillroundrect"]:
-                    x1, y1, x2, y2 = item["coords"]
-                    radius = item.get("radius", 20)
-                    if item_type == "roundrect":
-                        item_id = self.canvas.create_polygon(
-                            self.create_rounded_rect_points(x1, y1, x2, y2, radius),
-                            outline=hex_color, fill=""
-                        )
-                    else:  # fillroundrect
-                        item_id = self.canvas.create_polygon(
-                            self.create_rounded_rect_points(x1, y1, x2, y2, radius),
-                            fill=hex_color, outline=hex_color
-                        )
-                
-                elif item_type in ["circle", "fillcircle"]:
-                    x, y, r = item["coords"]
-                    if item_type == "circle":
-                        item_id = self.canvas.create_oval(x-r, y-r, x+r, y+r, outline=hex_color)
-                    else:  # fillcircle
-                        item_id = self.canvas.create_oval(x-r, y-r, x+r, y+r, fill=hex_color, outline=hex_color)
-                
-                elif item_type == "line":
-                    x1, y1, x2, y2 = item["coords"]
-                    item_id = self.canvas.create_line(x1, y1, x2, y2, fill=hex_color)
-                
-                elif item_type == "text":
-                    x, y = item["coords"]
-                    text = item["text"]
-                    size = item["size"]
-                    item_id = self.canvas.create_text(x, y, text=text, fill=hex_color, anchor="nw", 
-                                                  font=("Arial", 10 * size))
-                
-                elif item_type == "qrcode":
-                    x, y = item["coords"]
-                    module_size = item["module_size"]
-                    size = module_size * 25
-                    item_id = self.canvas.create_rectangle(
-                        x, y, x + size, y + size,
-                        fill=self.rgb_to_hex((0, 0, 0)), outline=self.rgb_to_hex((255, 255, 255))
-                    )
-                
-                # Add the item to canvas_items with the new ID
-                new_item = item.copy()
-                new_item["id"] = item_id
-                self.canvas_items.append(new_item)
-            
+            # Replace the design and rebuild the canvas from scratch
+            self.canvas_items = read_design(file_path)
+            self.history.clear()
+            self.item_costs.invalidate()
+            self.selected_item = None
+            self.selected_items = []
+            self.redraw_canvas()
+            self.update_listbox()
             self.status_var.set(f"Design loaded from {file_path}")
         except Exception as e:
             messagebox.showerror("Load Error", f"Failed to load design: {str(e)}")
@@ -760,23 +995,97 @@ class ArduinoLCDController:
             messagebox.showerror("Connection Error", "Not connected to Arduino")
             return
         
-        # First clear the screen
-        self.send_command("clear|0|0|0")
-        time.sleep(0.5)  # Give Arduino time to process
-        
-        # Send each item one by one
-        total_items = len(self.canvas_items)
-        for i, item in enumerate(self.canvas_items, 1):
-            cmd = self.get_item_command(item)
-            if cmd:
-                response = self.send_command(cmd)
-                self.status_var.set(f"Sending item {i}/{total_items}...")
-                if not response:
-                    messagebox.showerror("Communication Error", f"No response when sending item {i}")
-                    break
-                time.sleep(0.2)  # Longer delay between items
-        
-        self.status_var.set("Design sent to Arduino")
+        if self.upload_job:
+            messagebox.showinfo("Upload", "An upload is already in progress")
+            return
+        
+        # Only repaint the areas that changed since the last completed upload, as
+        # vector commands or pixel blits, whichever the mode allows and costs less
+        plan = plan_transfer(self.canvas_items, self.device_snapshot, self.upload_mode_var.get(),
+                             cull=self.cull_var.get(), clip=self.clip_var.get(),
+                             encoder=encode_command if self.binary_var.get() else encode_text,
+                             command_for=self.get_item_command)
+        if not plan.commands:
+            self.status_var.set("Display is already up to date")
+            return
+        
+        self.upload_snapshot = plan.snapshot
+        commands = expand_qr_codes(plan.commands) if self.qr_bitmaps else plan.commands
+        self.upload_job = self.submit_commands("design", commands)
+        estimate = self.cost_model.estimate(commands, *self.link_encoder())
+        self.status_var.set(f"Queued {plan.repainted}/{len(self.canvas_items)} items for upload, "
+                            f"{estimate.summary()}: {plan.summary()}")
+        if not self.named_fonts and any(item["type"] == "text" and item.get("font") for item in self.canvas_items):
+            self.status_var.set(self.status_var.get() + " (firmware prints every font as the built-in one)")
+    
+    def calibrate_costs(self, job, stats):
+        """Refine the cost model with the timing of a completed upload"""
+        # Repaired commands were timed together with their repair
+        if not stats.retransmits and self.cost_model.calibrate(job.commands, stats, *self.link_encoder()):
+            try:
+                self.cost_model.save()
+            except OSError:
+                pass  # Still calibrated for this session
+            self.reprice_items()
+    
+    def cancel_upload(self):
+        if self.serial_worker and self.upload_job:
+            self.serial_worker.cancel()
+            self.status_var.set("Cancelling upload...")
+        if self.fleet_upload:
+            self.fleet_upload.cancel()
+            self.status_var.set("Cancelling fleet upload...")
+    
+    def send_to_fleet(self):
+        """Upload the design to many panels at once, skipping those that already show it"""
+        if self.fleet_upload:
+            messagebox.showinfo("Fleet Upload", "A fleet upload is already in progress")
+            return
+        
+        # The connected port belongs to the serial worker
+        connected = self.port_combo.get() if self.connected else None
+        ports = [port for port in self.port_combo['values'] if port != connected]
+        answer = simpledialog.askstring("Send to Fleet", "Serial ports (comma separated):",
+                                        initialvalue=", ".join(ports), parent=self.root)
+        ports = [port.strip() for port in (answer or "").split(",") if port.strip()]
+        if not ports:
+            return
+        
+        plan = prepare_upload(self.canvas_items, cull=self.cull_var.get(), clip=self.clip_var.get(),
+                              command_for=self.get_item_command)
+        self.fleet_upload = FleetUpload(ports, plan.commands, int(self.baud_combo.get()),
+                                        binary=self.binary_var.get(), state=FleetState()).start()
+        self.fleet_progress = {}
+        self.status_var.set(f"Uploading to {len(ports)} panel(s)...")
+        self.poll_fleet_events()
+    
+    def poll_fleet_events(self):
+        fleet = self.fleet_upload
+        while True:
+            try:
+                kind, port, *rest = fleet.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                self.fleet_progress[port] = rest
+        
+        if fleet.running():
+            acked = sum(done for done, _ in self.fleet_progress.values())
+            total = sum(total for _, total in self.fleet_progress.values())
+            self.status_var.set(f"Fleet upload: {len(self.fleet_progress)} panel(s) sending, "
+                                f"{acked}/{total} commands")
+            self.root.after(100, self.poll_fleet_events)
+            return
+        
+        self.fleet_upload = None
+        try:
+            fleet.wait()
+            saved = ""
+        except OSError as e:
+            # The panels are provisioned anyway; they just get the design again next time
+            saved = f" (could not save the fleet state: {e})"
+        self.status_var.set(f"Fleet upload finished, {len(fleet.failed)} panel(s) failed{saved}")
+        messagebox.showinfo("Fleet Upload", fleet.summary())
     
     def export_commands(self):
         file_path = filedialog.asksaveasfilename(
@@ -789,154 +1098,150 @@ class ArduinoLCDController:
         
         try:
             with open(file_path, 'w') as f:
-                for item in self.canvas_items:
-                    cmd = self.get_item_command(item)
-                    if cmd:
-                        commands = cmd.split('\n')
-                        for command in commands:
-                            if not command.startswith('setColor') and not command == 'flush':
-                                parts = command.split('|')
-                                function = parts[0]
-                                args = parts[1:]
-                                
-                                # Map command names to Arduino function names
-                                function_map = {
-                                    "drawRect": "screen.drawRect",
-                                    "drawFillRect": "screen.fillRect",
-                                    "drawRoundRect": "screen.drawRoundRect",
-                                    "drawFillRoundRect": "screen.fillRoundRect",
-                                    "drawCircleOutline": "screen.drawCircle",
-                                    "drawFillCircle": "screen.fillCircle",
-                                    "drawLine": "screen.drawLine",
-                                    "prt": "screen.drawString",
-                                    "drawQRCode": "screen.qrcode"
-                                }
-                                
-                                arduino_function = function_map.get(function, function)
-                                arduino_command = f"{arduino_function}({','.join(args)});"
-                                f.write(f"{arduino_command}\n")
+                for line in arduino_code(self.canvas_items, self.get_item_command):
+                    f.write(f"{line}\n")
                 
                 self.status_var.set(f"Commands exported to {file_path}")
         except Exception as e:
             messagebox.showerror("Export Error", f"Failed to export commands: {str(e)}")
             self.status_var.set(f"Error exporting commands: {str(e)}")
     
+    def show_device_preview(self):
+        """Render the design exactly as the panel will show it"""
+        framebuffer = render_design(self.canvas_items)
+        rgb = framebuffer.to_rgb888()
+        height, width, _ = rgb.shape
+        
+        window = tk.Toplevel(self.root)
+        window.title("Device Preview (RGB565)")
+        image = tk.PhotoImage(data=b"P6 %d %d 255\n" % (width, height) + rgb.tobytes(), format="PPM")
+        label = ttk.Label(window, image=image)
+        label.image = image  # Keep a reference so Tk does not drop the image
+        label.pack(padx=5, pady=5)
+        
+        def save_png():
+            file_path = filedialog.asksaveasfilename(
+                defaultextension=".png",
+                filetypes=[("PNG files", "*.png"), ("All files", "*.*")]
+            )
+            if file_path:
+                framebuffer.save_png(file_path)
+                self.status_var.set(f"Preview saved to {file_path}")
+        
+        ttk.Button(window, text="Save PNG", command=save_png).pack(pady=5)
+        if framebuffer.font is None:
+            ttk.Label(window, text="Arduino_GFX glcdfont.h not found: text is drawn as blocks").pack(pady=2)
+    
     def is_point_in_item(self, x, y, item):
-        item_type = item["type"]
-        if item_type == "text":
-            text_x, text_y = item["coords"]
-            text_width = len(item["text"]) * 8 * item["size"]  # Match the new calculation
-            text_height = 12 * item["size"]  # Match the new calculation
-            return (text_x <= x <= text_x + text_width and 
-                    text_y <= y <= text_y + text_height)
-        elif item_type == "qrcode":
-            qr_x, qr_y = item["coords"]
-            size = item["module_size"] * 25
-            return (qr_x <= x <= qr_x + size and 
-                    qr_y <= y <= qr_y + size)
-        elif item_type in ["rect", "fillrect", "roundrect", "fillroundrect"]:
-            x1, y1, x2, y2 = item["coords"]
-            return x1 <= x <= x2 and y1 <= y <= y2
-        elif item_type in ["circle", "fillcircle"]:
-            cx, cy, r = item["coords"]
-            return (x - cx)**2 + (y - cy)**2 <= r**2
-        elif item_type == "line":
-            x1, y1, x2, y2 = item["coords"]
-            # Simple line hit detection
-            dist = abs((y2-y1)*x - (x2-x1)*y + x2*y1 - y2*x1) / ((y2-y1)**2 + (x2-x1)**2)**0.5
-            return dist < 5
-        # Add more hit detection for other shapes as needed
-        return False
+        return hit_test(item, x, y)
 
-    def move_selected_item(self, dx, dy):
+    def move_selected_item(self, dx, dy, coalesce=None):
+        """Move the selection; records with the same `coalesce` key become one undo step"""
         if not self.selected_item:
             return
-            
-        item_type = self.selected_item["type"]
-        
-        if item_type == "text":
-            x, y = self.selected_item["coords"]
-            new_coords = [x + dx, y + dy]
-            self.canvas.coords(self.selected_item["id"], *new_coords)
-            self.selected_item["coords"] = new_coords
-        
-        elif item_type == "qrcode":
-            x, y = self.selected_item["coords"]
-            size = self.selected_item["module_size"] * 25
-            new_coords = [x + dx, y + dy]
-            self.canvas.coords(self.selected_item["id"], 
-                             x + dx, y + dy, 
-                             x + dx + size, y + dy + size)
-            self.selected_item["coords"] = new_coords
-        
-        elif item_type in ["roundrect", "fillroundrect"]:
-            x1, y1, x2, y2 = self.selected_item["coords"]
-            radius = self.selected_item.get("radius", 20)
-            new_coords = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
-            
-            # Redraw the rounded rectangle at new position
-            hex_color = self.rgb_to_hex(self.selected_item["color"])
-            self.canvas.delete(self.selected_item["id"])
-            
-            points = self.create_rounded_rect_points(*new_coords, radius)
-            if item_type == "roundrect":
-                self.selected_item["id"] = self.canvas.create_polygon(
-                    points, outline=hex_color, fill="", smooth=True
-                )
-            else:  # fillroundrect
-                self.selected_item["id"] = self.canvas.create_polygon(
-                    points, fill=hex_color, outline=hex_color, smooth=True
-                )
-            
-            self.selected_item["coords"] = new_coords
         
-        # ... rest of existing move_selected_item code ...
-        elif item_type in ["rect", "fillrect"]:
-            x1, y1, x2, y2 = self.selected_item["coords"]
-            new_coords = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
-            self.canvas.coords(self.selected_item["id"], *new_coords)
-            self.selected_item["coords"] = new_coords
-            
-        elif item_type in ["circle", "fillcircle"]:
-            x, y, r = self.selected_item["coords"]
-            new_coords = [x + dx, y + dy, r]
-            self.canvas.coords(self.selected_item["id"], x + dx - r, y + dy - r, x + dx + r, y + dy + r)
-            self.selected_item["coords"] = new_coords
-            
-        elif item_type == "line":
-            x1, y1, x2, y2 = self.selected_item["coords"]
-            new_coords = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
-            self.canvas.coords(self.selected_item["id"], *new_coords)
-            self.selected_item["coords"] = new_coords
+        items = self.selected_items or [self.selected_item]
+        for item in items:
+            self.move_item(item, dx, dy)
+        if dx or dy:
+            self.history.record(MoveDelta(items, dx, dy), coalesce)
             
         self.highlight_selected_item()
         self.update_listbox()
 
+    def move_item(self, item, dx, dy):
+        item.move(dx, dy)
+        if item["type"] == "text":
+            # Text can wrap differently at the right edge, so place its glyphs again
+            self.update_text_shape(item)
+        else:
+            # Every other canvas shape keeps its form when moved, so translate it as is
+            self.canvas.move(item["id"], dx, dy)
+        self.spatial_index.update(item)
+        self.item_costs.mark_changed(item)
+
+    def set_item_fields(self, item, fields):
+        """Give an item the field values in `fields` and draw it again in its layer"""
+        for key, value in fields.items():
+            item[key] = value
+        old_id = item["id"]
+        self.redraw_item(item)
+        self.canvas.tag_raise(item["id"], old_id)
+        self.canvas.delete(old_id)
+        self.spatial_index.update(item)
+        self.item_costs.mark_changed(item)
+
+    def insert_items(self, entries):
+        """Put (index, item, stacking order) entries back into the design, lowest index first"""
+        for index, item, z in entries:
+            self.canvas_items.insert(index, item)
+            self.redraw_item(item)
+            if index > 0:
+                self.canvas.tag_raise(item["id"], self.canvas_items[index - 1]["id"])
+            else:
+                self.canvas.tag_lower(item["id"])
+            lower = self.canvas_items[index - 1] if index > 0 else None
+            upper = self.canvas_items[index + 1] if index + 1 < len(self.canvas_items) else None
+            if not self.spatial_index.insert_between(item, lower, upper, z):
+                self.spatial_index.reorder(self.canvas_items)
+            self.item_costs.mark_changed(item)
+
+    def remove_items(self, entries):
+        """Take (index, item, stacking order) entries out of the design"""
+        for index, item, _ in reversed(entries):
+            del self.canvas_items[index]
+            self.canvas.delete(item["id"])
+            self.spatial_index.remove(item)
+            self.item_costs.mark_removed(item)
+
+    def move_layer(self, old, new):
+        """Move the item at list position `old` to `new` and return it"""
+        item = self.canvas_items.pop(old)
+        self.canvas_items.insert(new, item)
+        self.restack_layers(min(old, new), max(old, new) + 1)
+        return item
+
+    def undo(self, event=None):
+        self.apply_history(self.history.undo(self), "undo", "Undid")
+
+    def redo(self, event=None):
+        self.apply_history(self.history.redo(self), "redo", "Redid")
+
+    def apply_history(self, result, action, verb):
+        if result is None:
+            self.status_var.set(f"Nothing to {action}")
+            return
+        description, items = result
+        self.selected_items = list(items)
+        self.selected_item = self.selected_items[0] if self.selected_items else None
+        if self.selected_item:
+            self.highlight_selected_item()
+        else:
+            self.canvas.delete("selection")
+        self.update_listbox()
+        self.status_var.set(f"{verb} {description}{self.history_note}")
+        self.history_note = ""
+
+    def screen_clear_undone(self):
+        """The items of a cleared screen are back, but the panel was cleared too"""
+        self.device_snapshot = None  # Repaint everything on the next upload
+        self.history_note = ", the panel stays blank until the design is sent again"
+
     def resize_selected_item(self, new_x, new_y):
         if not self.selected_item:
             return
             
         item_type = self.selected_item["type"]
+        old_coords = list(self.selected_item["coords"])
         
         if item_type in ["roundrect", "fillroundrect"]:
             x1, y1, x2, y2 = self.selected_item["coords"]
             radius = self.selected_item.get("radius", 20)
             new_coords = [x1, y1, new_x, new_y]
             
-            # Redraw with new size
-            hex_color = self.rgb_to_hex(self.selected_item["color"])
-            self.canvas.delete(self.selected_item["id"])
-            
+            # Reshape the existing polygon in place
             points = self.create_rounded_rect_points(*new_coords, radius)
-            if item_type == "roundrect":
-                self.selected_item["id"] = self.canvas.create_polygon(
-                    points, outline=hex_color, fill="", smooth=True
-                )
-            else:  # fillroundrect
-                self.selected_item["id"] = self.canvas.create_polygon(
-                    points, fill=hex_color, outline=hex_color, smooth=True
-                )
-            
+            self.canvas.coords(self.selected_item["id"], *points)
             self.selected_item["coords"] = new_coords
         
         elif item_type in ["rect", "fillrect"]:
@@ -951,7 +1256,13 @@ class ArduinoLCDController:
             new_coords = [x, y, r]
             self.canvas.coords(self.selected_item["id"], x - r, y - r, x + r, y + r)
             self.selected_item["coords"] = new_coords
-            
+        
+        if list(self.selected_item["coords"]) != old_coords:
+            self.history.record(FieldsDelta(self.selected_item, {"coords": old_coords},
+                                            {"coords": list(self.selected_item["coords"])}),
+                                ("drag", self.drag_serial))
+        self.spatial_index.update(self.selected_item)
+        self.item_costs.mark_changed(self.selected_item)
         self.highlight_selected_item()
 
     def is_over_resize_handle(self, x, y):
@@ -971,10 +1282,17 @@ class ArduinoLCDController:
 
     def delete_selected_item(self, event=None):
         if self.selected_item:
-            self.canvas.delete(self.selected_item["id"])
+            items = self.selected_items or [self.selected_item]
+            self.history.record(DeleteDelta([(self.canvas_items.index(item), item, self.spatial_index.z.get(item["uid"]))
+                                             for item in items]))
+            for item in items:
+                self.canvas.delete(item["id"])
+                self.canvas_items.remove(item)
+                self.spatial_index.remove(item)
+                self.item_costs.mark_removed(item)
             self.canvas.delete("selection")
-            self.canvas_items.remove(self.selected_item)
             self.selected_item = None
+            self.selected_items = []
             self.update_listbox()
 
     def move_selected_item_by_key(self, direction, step=1):
@@ -993,68 +1311,126 @@ class ArduinoLCDController:
         elif direction == 'down':
             dy = step
             
-        self.move_selected_item(dx, dy)
+        self.move_selected_item(dx, dy, ("keys",))
 
     def update_listbox(self):
-        self.layer_listbox.delete(0, tk.END)
-        for i, item in enumerate(self.canvas_items):
-            desc = f"{i+1}. {item['type']}"
-            
-            # Add details based on item type
-            if item['type'] == 'text':
-                desc += f" - '{item['text']}'"
-            elif item['type'] == 'qrcode':
-                desc += f" - '{item['data']}'"
-            
-            # Add coordinates for all types
-            coords_str = ', '.join(map(str, item['coords'][:2]))
-            desc += f" at ({coords_str})"
-            
-            self.layer_listbox.insert(tk.END, desc)
-            
-            if item == self.selected_item:
-                self.layer_listbox.selection_clear(0, tk.END)
-                self.layer_listbox.selection_set(i)
+        self.layer_list.render()
+        self.schedule_cost_refresh()
+    
+    def link_encoder(self):
+        """Encoder and baud rate uploads currently go out with"""
+        binary = self.binary_var.get() and (not self.serial_worker or self.serial_worker.binary_supported is not False)
+        try:
+            baud = int(self.baud_combo.get())
+        except ValueError:
+            baud = 115200
+        return (encode_command if binary else encode_text), baud
+    
+    def schedule_cost_refresh(self):
+        # Edits come in bursts (drags, key repeat); price them once they settle
+        if not self.cost_refresh_pending:
+            self.cost_refresh_pending = True
+            self.root.after_idle(self.refresh_costs)
+    
+    def reprice_items(self):
+        self.item_costs.configure(*self.link_encoder())
+        self.schedule_cost_refresh()
+    
+    def refresh_costs(self):
+        """Reprice the items that changed and update the estimate and overlay"""
+        self.cost_refresh_pending = False
+        changed, removed = self.item_costs.refresh(self.canvas_items)
+        calibrated = f", {self.cost_model.samples()} samples" if self.cost_model.samples() else ""
+        self.estimate_var.set(f"Estimate: ~{self.item_costs.total():.2f} s, "
+                              f"{self.item_costs.bytes / 1000:.1f} kB{calibrated}")
+        if self.heat_var.get():
+            self.update_heat_overlay(changed, removed)
+    
+    def update_heat_overlay(self, changed, removed):
+        for key in removed:
+            heat_id = self.heat_ids.pop(key, None)
+            if heat_id is not None:
+                self.canvas.delete(heat_id)
+        created = False
+        for item in changed:
+            x1, y1, x2, y2 = pick_bounds(item)
+            color = heat_color(self.item_costs.cost(item))
+            heat_id = self.heat_ids.get(item["uid"])
+            if heat_id is None:
+                self.heat_ids[item["uid"]] = self.canvas.create_rectangle(
+                    x1, y1, x2, y2, fill=color, outline=color, stipple="gray25", tags="heat")
+                created = True
+            else:
+                self.canvas.coords(heat_id, x1, y1, x2, y2)
+                self.canvas.itemconfig(heat_id, fill=color, outline=color)
+        if created:
+            self.canvas.tag_raise("heat")
+    
+    def draw_heat_overlay(self):
+        """Recreate the cost overlay for every item, or remove it when switched off"""
+        self.canvas.delete("heat")
+        self.heat_ids = {}
+        if self.heat_var.get():
+            self.item_costs.invalidate()
+            self.item_costs.refresh(self.canvas_items)
+            self.update_heat_overlay(self.canvas_items, [])
 
     def on_select_layer(self, event):
-        selection = self.layer_listbox.curselection()
-        if selection:
-            index = selection[0]
+        index = self.layer_list.selected_index()
+        if index is not None:
             self.selected_item = self.canvas_items[index]
+            self.selected_items = [self.selected_item]
             self.highlight_selected_item()
 
     def move_layer_up(self):
-        selection = self.layer_listbox.curselection()
-        if not selection or selection[0] == 0:
+        index = self.layer_list.selected_index()
+        if index is None or index == 0:
             return
             
-        index = selection[0]
         self.canvas_items[index], self.canvas_items[index-1] = \
             self.canvas_items[index-1], self.canvas_items[index]
-        self.redraw_canvas()
+        self.restack_layers(min(index, index-1), max(index, index-1) + 1)
+        self.history.record(LayerDelta(index, index-1))
         self.update_listbox()
-        self.layer_listbox.selection_clear(0, tk.END)
-        self.layer_listbox.selection_set(index-1)
+        self.layer_list.select(index-1)
 
     def move_layer_down(self):
-        selection = self.layer_listbox.curselection()
-        if not selection or selection[0] == len(self.canvas_items) - 1:
+        index = self.layer_list.selected_index()
+        if index is None or index == len(self.canvas_items) - 1:
             return
             
-        index = selection[0]
         self.canvas_items[index], self.canvas_items[index+1] = \
             self.canvas_items[index+1], self.canvas_items[index]
-        self.redraw_canvas()
+        self.restack_layers(min(index, index+1), max(index, index+1) + 1)
+        self.history.record(LayerDelta(index, index+1))
         self.update_listbox()
-        self.layer_listbox.selection_clear(0, tk.END)
-        self.layer_listbox.selection_set(index+1)
+        self.layer_list.select(index+1)
 
     def redraw_canvas(self):
+        """Recreate every canvas shape; only needed when the whole design is replaced"""
         self.canvas.delete("all")
         for item in self.canvas_items:
             self.redraw_item(item)
+        self.spatial_index.rebuild(self.canvas_items)
         if self.selected_item:
             self.highlight_selected_item()
+        self.draw_heat_overlay()
+
+    def restack_layers(self, start, stop):
+        """Bring the canvas stacking order of canvas_items[start:stop] in line with the list.
+
+        The existing shapes are raised in list order above the layer below
+        the range, so ids stay valid and the cost only depends on the size of
+        the range, not of the design.
+        """
+        below = self.canvas_items[start - 1]["id"] if start > 0 else None
+        for item in self.canvas_items[start:stop]:
+            if below is None:
+                self.canvas.tag_lower(item["id"])
+            else:
+                self.canvas.tag_raise(item["id"], below)
+            below = item["id"]
+        self.spatial_index.reorder(self.canvas_items, start, stop)
 
     def redraw_item(self, item):
         hex_color = self.rgb_to_hex(item["color"]) if "color" in item else "#FFFFFF"
@@ -1094,20 +1470,10 @@ class ArduinoLCDController:
             item["id"] = self.canvas.create_line(x1, y1, x2, y2, fill=hex_color)
         
         elif item["type"] == "text":
-            x, y = item["coords"]
-            text = item["text"]
-            size = item["size"]
-            item["id"] = self.canvas.create_text(x, y, text=text, fill=hex_color, anchor="nw",
-                                               font=("Arial", 10 * size))
+            item["id"] = self.create_text_shape(item)
         
         elif item["type"] == "qrcode":
-            x, y = item["coords"]
-            module_size = item["module_size"]
-            size = module_size * 25
-            item["id"] = self.canvas.create_rectangle(
-                x, y, x + size, y + size,
-                fill=self.rgb_to_hex((0, 0, 0)), outline=self.rgb_to_hex((255, 255, 255))
-            )
+            item["id"] = self.create_qr_shape(item)
 
     def create_rounded_rect_points(self, x1, y1, x2, y2, radius):
         """Create point list for rounded rectangle with proper corner arcs"""
@@ -1115,57 +1481,9 @@ class ArduinoLCDController:
         if x1 > x2: x1, x2 = x2, x1
         if y1 > y2: y1, y2 = y2, y1
         
-        # Limit radius to prevent overlap
-        radius = min(radius, (x2-x1)//2, (y2-y1)//2)
-        points = []
-        
-        # Add the points in sequence to form a complete shape
-        points.extend([x1 + radius, y1])  # Top left start
-        points.extend([x2 - radius, y1])  # Top edge
-        
-        # Top right corner
-        for i in range(0, 91, 5):
-            angle = i * math.pi / 180
-            points.extend([
-                x2 - radius + (radius * math.sin(angle)),
-                y1 + radius - (radius * math.cos(angle))
-            ])
-        
-        points.extend([x2, y1 + radius])  # Right edge start
-        points.extend([x2, y2 - radius])  # Right edge end
-        
-        # Bottom right corner
-        for i in range(0, 91, 5):
-            angle = i * math.pi / 180
-            points.extend([
-                x2 - radius + (radius * math.cos(angle)),
-                y2 - radius + (radius * math.sin(angle))
-            ])
-        
-        points.extend([x2 - radius, y2])  # Bottom edge start
-        points.extend([x1 + radius, y2])  # Bottom edge end
-        
-        # Bottom left corner
-        for i in range(0, 91, 5):
-            angle = i * math.pi / 180
-            points.extend([
-                x1 + radius - (radius * math.cos(angle)),
-                y2 - radius + (radius * math.sin(angle))
-            ])
-        
-        points.extend([x1, y2 - radius])  # Left edge start
-        points.extend([x1, y1 + radius])  # Left edge end
-        
-        # Top left corner
-        for i in range(0, 91, 5):
-            angle = i * math.pi / 180
-            points.extend([
-                x1 + radius - (radius * math.sin(angle)),
-                y1 + radius - (radius * math.cos(angle))
-            ])
-        
-        points.extend([x1 + radius, y1])  # Close the shape
-        return points
+        # The outline only depends on the size, so translate a cached copy
+        outline = rounded_rect_outline(x2 - x1, y2 - y1, radius)
+        return [value + (x1 if i % 2 == 0 else y1) for i, value in enumerate(outline)]
 
     def handle_key_movement(self, event):
         """Handle arrow key movement, preventing listbox from processing keys"""
@@ -1193,8 +1511,12 @@ class ArduinoLCDController:
                                         initialvalue=self.selected_item["text"],
                                         parent=self.root)
         if new_text:
+            self.history.record(FieldsDelta(self.selected_item, {"text": self.selected_item["text"]},
+                                            {"text": new_text}))
             self.selected_item["text"] = new_text
-            self.canvas.itemconfig(self.selected_item["id"], text=new_text)
+            self.item_costs.mark_changed(self.selected_item)
+            self.update_text_shape(self.selected_item)
+            self.spatial_index.update(self.selected_item)
             self.update_listbox()
     
     def edit_color(self):
@@ -1210,12 +1532,15 @@ class ArduinoLCDController:
             r = int(hex_color[1:3], 16)
             g = int(hex_color[3:5], 16)
             b = int(hex_color[5:7], 16)
+            self.history.record(FieldsDelta(self.selected_item, {"color": self.selected_item["color"]},
+                                            {"color": (r, g, b)}))
             self.selected_item["color"] = (r, g, b)
+            self.item_costs.mark_changed(self.selected_item)
             
             # Update the item's color
             item_type = self.selected_item["type"]
             if item_type == "text":
-                self.canvas.itemconfig(self.selected_item["id"], fill=hex_color)
+                self.update_text_shape(self.selected_item)
             elif item_type in ["rect", "roundrect", "line"]:
                 self.canvas.itemconfig(self.selected_item["id"], outline=hex_color)
             elif item_type in ["fillrect", "fillroundrect", "fillcircle"]:
@@ -1234,13 +1559,38 @@ class ArduinoLCDController:
                                           minvalue=1, maxvalue=5,
                                           parent=self.root)
         if new_size:
+            self.history.record(FieldsDelta(self.selected_item, {"size": self.selected_item["size"]},
+                                            {"size": new_size}))
             self.selected_item["size"] = new_size
-            self.canvas.itemconfig(
-                self.selected_item["id"], 
-                font=("Arial", 10 * new_size)
-            )
+            self.item_costs.mark_changed(self.selected_item)
+            self.update_text_shape(self.selected_item)
+            self.spatial_index.update(self.selected_item)
             self.update_listbox()
 
+    def edit_text_font(self):
+        if not self.selected_item or self.selected_item["type"] != "text":
+            return
+        
+        fonts = available_fonts()
+        new_font = simpledialog.askstring(
+            "Edit Text Font",
+            "GFXfont name, empty for the built-in font\n(found: " + (", ".join(fonts) or "none") + ")",
+            initialvalue=self.selected_item.get("font") or "",
+            parent=self.root)
+        if new_font is None:
+            return
+        new_font = new_font.strip() or None
+        if new_font and new_font not in fonts:
+            messagebox.showwarning("Edit Text Font", f"No header for {new_font}: previewing with the built-in font")
+        self.history.record(FieldsDelta(self.selected_item, {"font": self.selected_item.get("font")},
+                                        {"font": new_font}))
+        self.selected_item["font"] = new_font
+        self.item_costs.mark_changed(self.selected_item)
+        self.update_text_shape(self.selected_item)
+        self.spatial_index.update(self.selected_item)
+        self.highlight_selected_item()
+        self.update_listbox()
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = ArduinoLCDController(root)
@@ -0,0 +1,199 @@
+"""Upload benchmark for the designer's command pipeline.
+
+Generates synthetic designs, times command generation and upload planning,
+then uploads each design to a DeviceEmulator at several baud rates and
+prints the results as JSON:
+
+    python benchmark.py --sizes 10 100 1000 10000 --bauds 115200 921600 -o bench.json
+
+A baud rate of 0 runs the emulator unthrottled.
+"""
+
+import argparse
+import json
+import platform
+import random
+import string
+import subprocess
+import sys
+import time
+
+import serial
+
+from binary_protocol import encode_command
+from design_compiler import item_command
+from design_items import make_item
+from device_emulator import DeviceEmulator
+from item_geometry import SCREEN_WIDTH, SCREEN_HEIGHT
+from serial_link import PipelinedSender, DEFAULT_WINDOW, encode_text
+from upload_pipeline import prepare_upload
+
+# Relative frequency of each item type in generated designs
+DEFAULT_MIX = {
+    "rect": 2, "fillrect": 3, "roundrect": 1, "fillroundrect": 1,
+    "circle": 1, "fillcircle": 2, "line": 3, "text": 3, "qrcode": 0.2,
+}
+
+
+def _color(rng):
+    return (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+
+
+def _text(rng, length_range):
+    alphabet = string.ascii_letters + string.digits + " .,:-"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(*length_range)))
+
+
+def generate_design(count, mix=None, text_length=(4, 32), qr_length=(8, 120), max_size=120, seed=0):
+    """A reproducible random design of `count` items.
+
+    `mix` maps item types to relative weights; text and QR payload lengths
+    are drawn uniformly from the given (min, max) ranges.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    types = list(mix)
+    weights = [mix[t] for t in types]
+    items = []
+    for item_type in rng.choices(types, weights, k=count):
+        x = rng.randrange(SCREEN_WIDTH)
+        y = rng.randrange(SCREEN_HEIGHT)
+        w = rng.randint(4, max_size)
+        h = rng.randint(4, max_size)
+        item = {"type": item_type}
+        if item_type in ("rect", "fillrect", "roundrect", "fillroundrect"):
+            item["coords"] = [x, y, x + w, y + h]
+            if "round" in item_type:
+                item["radius"] = rng.randint(2, min(w, h) // 2)
+        elif item_type in ("circle", "fillcircle"):
+            item["coords"] = [x, y, rng.randint(2, max_size // 2)]
+        elif item_type == "line":
+            item["coords"] = [x, y, rng.randrange(SCREEN_WIDTH), rng.randrange(SCREEN_HEIGHT)]
+        elif item_type == "text":
+            item["coords"] = [x, y]
+            item["size"] = rng.randint(1, 3)
+            item["text"] = _text(rng, text_length)
+        elif item_type == "qrcode":
+            item["coords"] = [rng.randrange(SCREEN_WIDTH // 2), rng.randrange(SCREEN_HEIGHT // 2)]
+            item["module_size"] = rng.randint(1, 3)
+            item["data"] = _text(rng, qr_length)
+            item["fg_color"] = (0, 0, 0)
+            item["bg_color"] = (255, 255, 255)
+        if item_type != "qrcode":
+            item["color"] = _color(rng)
+        items.append(make_item(item))
+    return items
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_commands(items):
+    start = time.perf_counter()
+    commands = [item_command(item) for item in items]
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "items_per_second": len(items) / elapsed if elapsed > 0 else 0.0,
+        "bytes": sum(len(c.encode()) + 1 for c in commands),
+    }
+
+
+def bench_prepare(items, cull=True):
+    start = time.perf_counter()
+    plan = prepare_upload(items, cull=cull)
+    elapsed = time.perf_counter() - start
+    return plan, {
+        "seconds": elapsed,
+        "items_per_second": len(items) / elapsed if elapsed > 0 else 0.0,
+        "commands": len(plan.commands),
+        "bytes": plan.compile_stats.bytes_after,
+        "bytes_unoptimized": plan.compile_stats.bytes_before,
+    }
+
+
+def bench_upload(items, commands, baud, window=DEFAULT_WINDOW, binary=False, command_delay=0.0):
+    """Upload `commands` to a fresh emulator and measure the transfer"""
+    with DeviceEmulator(command_delay=command_delay, baudrate=baud or None, banner=False) as emulator:
+        conn = serial.Serial(emulator.port, baud or 115200, timeout=1)
+        try:
+            sender = PipelinedSender(conn, window, encoder=encode_command if binary else encode_text)
+            start = time.perf_counter()
+            stats = sender.send(commands)
+            wall = time.perf_counter() - start
+        finally:
+            conn.close()
+    return {
+        "baud": baud,
+        "binary": binary,
+        "window": window,
+        "commands": stats.commands,
+        "bytes": stats.bytes_sent,
+        "errors": stats.errors,
+        "wall_seconds": wall,
+        "items_per_second": len(items) / wall if wall > 0 else 0.0,
+        "commands_per_second": stats.commands_per_second,
+        "bytes_per_second": stats.bytes_per_second,
+        "rtt_p50_ms": stats.round_trip_percentile(50) * 1000,
+        "rtt_p99_ms": stats.round_trip_percentile(99) * 1000,
+    }
+
+
+def run_benchmarks(sizes, bauds, seed=0, window=DEFAULT_WINDOW, binary=False, cull=True, command_delay=0.0):
+    results = []
+    for size in sizes:
+        items = generate_design(size, seed=seed)
+        total_start = time.perf_counter()
+        plan, prepare = bench_prepare(items, cull)
+        result = {
+            "items": size,
+            "command_generation": bench_commands(items),
+            "prepare_upload": prepare,
+            "uploads": [bench_upload(items, plan.commands, baud, window, binary, command_delay)
+                        for baud in bauds],
+        }
+        result["total_wall_seconds"] = time.perf_counter() - total_start
+        results.append(result)
+        print(f"{size} items done in {result['total_wall_seconds']:.2f} s", file=sys.stderr)
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "cull": cull,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the designer upload pipeline against the device emulator")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--bauds", type=int, nargs="+", default=[115200, 921600, 0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("--binary", action="store_true", help="upload with binary frames")
+    parser.add_argument("--no-cull", action="store_true", help="upload hidden items too")
+    parser.add_argument("--command-delay", type=float, default=0.0, help="emulated seconds per command")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.bauds, args.seed, args.window, args.binary,
+                            not args.no_cull, args.command_delay)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
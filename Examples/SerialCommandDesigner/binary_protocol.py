@@ -0,0 +1,204 @@
+import struct
+import time
+
+# Compact framed encoding of the text commands understood by the sketch.
+#
+#   SYNC(0xA5) | opcode | fixed little-endian fields | [len | text] | CRC-8
+#
+# The field layout is implied by the opcode, so only commands carrying text
+# (prt, drawQRCode) need a length byte. The CRC covers everything after SYNC.
+# The sketch answers binary frames with the same response lines as text.
+# Blob commands (blit, drawBitmap) carry raw bytes instead of text; their text form
+# holds the same bytes hex encoded.
+#
+# prt naming a font has no frame; encode_command() sends it as a text line,
+# which the sketch accepts between frames.
+#
+# Sequenced frames put a sequence number (0-255) after a second sync byte:
+#
+#   SYNC_SEQ(0xA6) | seq | opcode | ... | CRC-8
+#
+# The CRC then covers seq too, and the sketch answers "ok <seq>" or
+# "err <seq> <code>" instead of the response line.
+
+FRAME_SYNC = 0xA5
+FRAME_SYNC_SEQ = 0xA6
+FRAME_MAX_TEXT = 255
+
+# command: (opcode, struct format of the numeric fields, argument indices of
+#           the numeric fields in the text command, argument index of the text)
+FRAME_SPECS = {
+    "prt": (0x01, "<hhB", (1, 2, 3), 0),
+    "clear": (0x02, "<BBB", (0, 1, 2), None),
+    "setColor": (0x03, "<BBB", (0, 1, 2), None),
+    "drawQRCode": (0x04, "<hhBBBBBBB", (1, 2, 3, 4, 5, 6, 7, 8, 9), 0),
+    "drawFillRect": (0x05, "<hhhh", (0, 1, 2, 3), None),
+    "drawRect": (0x06, "<hhhh", (0, 1, 2, 3), None),
+    "drawLine": (0x07, "<hhhh", (0, 1, 2, 3), None),
+    "drawFillCircle": (0x08, "<hhh", (0, 1, 2), None),
+    "drawCircleOutline": (0x09, "<hhh", (0, 1, 2), None),
+    "drawTriangle": (0x0A, "<hhhhhh", (0, 1, 2, 3, 4, 5), None),
+    "drawFillTriangle": (0x0B, "<hhhhhh", (0, 1, 2, 3, 4, 5), None),
+    "drawRoundRect": (0x0C, "<hhhhh", (0, 1, 2, 3, 4), None),
+    "drawFillRoundRect": (0x0D, "<hhhhh", (0, 1, 2, 3, 4), None),
+    "drawEllipse": (0x0E, "<hhhh", (0, 1, 2, 3), None),
+    "drawFillEllipse": (0x0F, "<hhhh", (0, 1, 2, 3), None),
+    "flush": (0x10, "", (), None),
+    "blit": (0x11, "<HHH", (0, 1, 2), 3),
+    "drawBitmap": (0x12, "<hhBB", (0, 1, 2, 3), 4),
+}
+
+BLOB_COMMANDS = {"blit", "drawBitmap"}
+
+OPCODES = {spec[0]: name for name, spec in FRAME_SPECS.items()}
+
+PROBE_COMMAND = "proto|bin"
+PROBE_RESPONSE = "Binary frames supported"
+
+
+def _make_crc8_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+_CRC8_TABLE = _make_crc8_table()
+
+
+def crc8(data, crc=0):
+    """CRC-8 with polynomial 0x07, as computed by crc8() in the sketch."""
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _to_field(value, fmt_char):
+    value = int(float(value))
+    if fmt_char == "B":
+        return max(0, min(255, value))
+    if fmt_char == "H":
+        return max(0, min(65535, value))
+    return max(-32768, min(32767, value))
+
+
+def encode_command(command, seq=None):
+    """Encode a `cmd|p1|p2|...` text command as a binary frame.
+
+    With a `seq` the frame is sequenced (see above).
+    """
+    parts = command.strip().split('|')
+    name, args = parts[0], parts[1:]
+    if name not in FRAME_SPECS:
+        raise ValueError(f"No binary encoding for command: {name}")
+    opcode, fmt, numeric_args, text_arg = FRAME_SPECS[name]
+
+    if name == "prt" and len(args) > 4 and args[4]:
+        prefix = f"#{seq}|" if seq is not None else ""
+        return (prefix + command.strip() + "\n").encode()
+    if name == "clear" and not args:
+        args = ["0", "0", "0"]
+    if len(args) < len(numeric_args) + (text_arg is not None):
+        raise ValueError(f"Incomplete command: {command}")
+
+    fields = [_to_field(args[i], fmt[n + 1]) for n, i in enumerate(numeric_args)]
+    body = bytes([opcode]) + struct.pack(fmt, *fields)
+    if name in BLOB_COMMANDS:
+        text = bytes.fromhex(args[text_arg])
+        if len(text) > FRAME_MAX_TEXT:
+            raise ValueError(f"Blob too long for one frame: {len(text)} bytes")
+        body += bytes([len(text)]) + text
+    elif text_arg is not None:
+        text = args[text_arg].encode()[:FRAME_MAX_TEXT]
+        body += bytes([len(text)]) + text
+    if seq is not None:
+        body = bytes([seq & 0xFF]) + body
+        return bytes([FRAME_SYNC_SEQ]) + body + bytes([crc8(body)])
+    return bytes([FRAME_SYNC]) + body + bytes([crc8(body)])
+
+
+def decode_frame(data):
+    """Decode one frame from the start of `data`.
+
+    Returns (command, frame_length) where command is the equivalent text
+    command, or (None, 0) if `data` does not hold a complete frame yet.
+    Raises ValueError for frames with a bad sync byte, opcode or CRC.
+    """
+    parts, length = decode_frame_parts(data)
+    if parts is None:
+        return None, 0
+    return "|".join(parts), length
+
+
+def decode_frame_parts(data):
+    """Like decode_frame() but returns the command as a list of parts.
+
+    Unlike the joined text command this keeps text arguments containing
+    '|' intact.
+    """
+    parts, length, _ = decode_frame_seq(data)
+    return parts, length
+
+
+def decode_frame_seq(data):
+    """Like decode_frame_parts() but also returns the sequence number.
+
+    Returns (parts, frame_length, seq) with seq None for unsequenced frames.
+    """
+    if not data:
+        return None, 0, None
+    if data[0] not in (FRAME_SYNC, FRAME_SYNC_SEQ):
+        raise ValueError("Bad frame sync")
+    seq = data[1] if data[0] == FRAME_SYNC_SEQ and len(data) > 1 else None
+    head = 1 if data[0] == FRAME_SYNC else 2  # Opcode position
+    if len(data) < head + 1:
+        return None, 0, None
+    name = OPCODES.get(data[head])
+    if name is None:
+        raise ValueError("Bad frame opcode")
+    opcode, fmt, numeric_args, text_arg = FRAME_SPECS[name]
+
+    end = head + 1 + struct.calcsize(fmt)
+    text = None
+    if text_arg is not None:
+        if len(data) < end + 1:
+            return None, 0, None
+        text_len = data[end]
+        if len(data) < end + 1 + text_len:
+            return None, 0, None
+        text = bytes(data[end + 1:end + 1 + text_len])
+        text = text.hex() if name in BLOB_COMMANDS else text.decode(errors="replace")
+        end += 1 + text_len
+    if len(data) < end + 1:
+        return None, 0, None
+    if crc8(data[1:end]) != data[end]:
+        raise ValueError("Bad frame CRC")
+
+    fields = struct.unpack(fmt, bytes(data[head + 1:head + 1 + struct.calcsize(fmt)]))
+    args = [None] * (len(numeric_args) + (text_arg is not None))
+    for value, i in zip(fields, numeric_args):
+        args[i] = str(value)
+    if text_arg is not None:
+        args[text_arg] = text
+    return [name] + args, end + 1, seq
+
+
+def probe_binary_support(serial_conn, timeout=2.0):
+    """Ask the sketch whether it accepts binary frames.
+
+    Older firmware answers the probe with "Unknown or incomplete command",
+    in which case the designer keeps using the text protocol.
+    """
+    serial_conn.write((PROBE_COMMAND + '\n').encode())
+    serial_conn.flush()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        line = serial_conn.readline().decode(errors="replace").strip()
+        if line == PROBE_RESPONSE:
+            return True
+        if line.startswith("Unknown or incomplete command"):
+            return False
+    return False
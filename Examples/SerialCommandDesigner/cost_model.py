@@ -0,0 +1,323 @@
+"""Upload time estimates for designs and single items.
+
+Every command costs its bytes on the wire at the link's baud rate and the
+time the sketch spends drawing it. Device time is modelled per command as
+
+    base + a * kilopixels + b * characters + c * kilomodules
+
+where kilopixels is the area (or length, for outlines) the command paints,
+characters the text or blit payload length and kilomodules the size of a
+QR symbol, which drives its encoding time. The pipelined sender overlaps
+transmission with drawing, so a command takes max(wire, device).
+
+The coefficients start from rough ESP32-S3 figures and are refitted from
+the ack timing of every completed upload (ridge least squares towards the
+defaults, so command types that were never measured keep them). The fit
+is kept as running sums and persisted in COST_MODEL_FILE.
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+
+from delta_sync import item_uid
+from design_compiler import item_command
+from gfx_font import text_bounds
+from item_geometry import SCREEN_WIDTH, SCREEN_HEIGHT, CHAR_WIDTH, CHAR_HEIGHT, clip_to_screen, rect_area
+from item_geometry import qr_version_for
+from serial_link import encode_text
+
+COST_MODEL_FILE = os.path.join(os.path.expanduser("~"), ".serial_command_designer_costs.json")
+
+BITS_PER_BYTE = 10  # 8N1 framing
+
+# Seconds per feature unit, measured loosely on an ESP32-S3 with the canvas in PSRAM
+DEFAULT_COEFFICIENTS = {
+    "setColor": (0.00008, 0.0, 0.0, 0.0),
+    "clear": (0.0002, 0.00005, 0.0, 0.0),
+    "flush": (0.0002, 0.0001, 0.0, 0.0),
+    "drawFillRect": (0.00015, 0.00005, 0.0, 0.0),
+    "drawFillRoundRect": (0.0002, 0.00006, 0.0, 0.0),
+    "drawFillCircle": (0.0002, 0.00006, 0.0, 0.0),
+    "drawFillEllipse": (0.0002, 0.00006, 0.0, 0.0),
+    "drawFillTriangle": (0.0002, 0.00006, 0.0, 0.0),
+    "drawRect": (0.00015, 0.0002, 0.0, 0.0),
+    "drawRoundRect": (0.0002, 0.0002, 0.0, 0.0),
+    "drawCircleOutline": (0.0002, 0.0002, 0.0, 0.0),
+    "drawEllipse": (0.0002, 0.0002, 0.0, 0.0),
+    "drawTriangle": (0.0002, 0.0002, 0.0, 0.0),
+    "drawLine": (0.00015, 0.0002, 0.0, 0.0),
+    "prt": (0.0002, 0.0002, 0.00003, 0.0),
+    "drawQRCode": (0.001, 0.0002, 0.0, 0.005),
+    "blit": (0.0002, 0.00005, 0.000001, 0.0),
+    "drawBitmap": (0.0002, 0.00005, 0.000002, 0.0),
+}
+FALLBACK_COEFFICIENTS = (0.0002, 0.0001, 0.0, 0.0)
+
+# Typical feature values; the prior counts as this many samples of them
+PRIOR_SCALE = np.array([1.0, 10.0, 20.0, 1.0])
+PRIOR_SAMPLES = 5.0
+
+# Per-item costs shown from green to red on a log scale between these
+HEAT_RANGE = (0.0002, 0.02)
+
+
+def command_features(command):
+    """(name, feature vector) of a text command; None for blank lines"""
+    command = command.strip()
+    if not command:
+        return None
+    parts = command.split("|")
+    name, args = parts[0], parts[1:]
+    pixels = characters = modules = 0.0
+    try:
+        if name in ("clear", "flush"):
+            pixels = SCREEN_WIDTH * SCREEN_HEIGHT
+        elif name in ("drawFillRect", "drawFillRoundRect"):
+            x, y, w, h = (float(v) for v in args[:4])
+            pixels = rect_area(clip_to_screen((x, y, x + w, y + h)))
+        elif name in ("drawRect", "drawRoundRect"):
+            w, h = (abs(float(v)) for v in args[2:4])
+            pixels = 2 * (w + h)
+        elif name == "drawFillCircle":
+            pixels = math.pi * float(args[2]) ** 2
+        elif name == "drawCircleOutline":
+            pixels = 2 * math.pi * float(args[2])
+        elif name == "drawFillEllipse":
+            pixels = math.pi * float(args[2]) * float(args[3])
+        elif name == "drawEllipse":
+            pixels = math.pi * (float(args[2]) + float(args[3]))
+        elif name in ("drawLine", "drawTriangle", "drawFillTriangle"):
+            values = [float(v) for v in args]
+            xs, ys = values[0::2], values[1::2]
+            pixels = max(max(xs) - min(xs), max(ys) - min(ys)) + 1
+            if name == "drawFillTriangle":
+                pixels = abs((xs[1] - xs[0]) * (ys[2] - ys[0]) - (xs[2] - xs[0]) * (ys[1] - ys[0])) / 2
+        elif name == "prt":
+            text, size = args[0], float(args[3])
+            characters = len(text)
+            if len(args) > 4 and args[4]:
+                pixels = rect_area(text_bounds(text, 0, 0, max(1, int(size)), args[4]))
+            else:
+                pixels = characters * CHAR_WIDTH * CHAR_HEIGHT * size * size
+        elif name == "drawQRCode":
+            side = qr_version_for(args[0]) * 4 + 17
+            modules = side * side
+            pixels = modules * float(args[3]) ** 2
+        elif name == "blit":
+            pixels = float(args[2])
+            characters = len(args[3]) / 2
+        elif name == "drawBitmap":
+            data = bytes.fromhex(args[4])
+            pixels = sum(bin(byte).count("1") for byte in data) * float(args[3]) ** 2
+            characters = len(data)
+    except (ValueError, IndexError):
+        pass
+    return name, np.array([1.0, pixels / 1000, characters, modules / 1000])
+
+
+def wire_time(size, baud):
+    return size * BITS_PER_BYTE / baud if baud > 0 else 0.0
+
+
+class CostModel:
+    """Device time per command type, refined from measured uploads"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.sums = {}  # command name -> [samples, XtX, Xty]
+        self.coefficients = {}
+        if path:
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                for name, (samples, xtx, xty) in data.get("sums", {}).items():
+                    self.sums[name] = [samples, np.array(xtx), np.array(xty)]
+            except (OSError, ValueError, TypeError):
+                self.sums = {}
+        for name in self.sums:
+            self._fit(name)
+
+    def coefficients_for(self, name):
+        if name in self.coefficients:
+            return self.coefficients[name]
+        return np.array(DEFAULT_COEFFICIENTS.get(name, FALLBACK_COEFFICIENTS))
+
+    def samples(self, name=None):
+        if name is not None:
+            return self.sums.get(name, [0])[0]
+        return sum(entry[0] for entry in self.sums.values())
+
+    def device_time(self, command):
+        features = command_features(command)
+        if features is None:
+            return 0.0
+        name, x = features
+        return max(0.0, float(self.coefficients_for(name) @ x))
+
+    def command_time(self, command, encoder=encode_text, baud=115200):
+        """(seconds, bytes) one command adds to an upload"""
+        size = len(encoder(command.strip()))
+        return max(wire_time(size, baud), self.device_time(command)), size
+
+    def estimate(self, commands, encoder=encode_text, baud=115200):
+        """Estimate for a command stream"""
+        estimate = Estimate()
+        for command in commands:
+            if command.strip():
+                seconds, size = self.command_time(command, encoder, baud)
+                estimate.add(seconds, size, self.device_time(command))
+        return estimate
+
+    def calibrate(self, commands, stats, encoder=encode_text, baud=115200):
+        """Fold the per-command timing of a completed upload into the model.
+
+        `commands` must be the stream `stats` was measured for. Returns the
+        number of samples used.
+        """
+        commands = [command for command in commands if command.strip()]
+        if len(stats.service_times) != len(commands):
+            return 0
+        touched = set()
+        used = 0
+        for command, measured in zip(commands, stats.service_times):
+            name, x = command_features(command)
+            # Bandwidth bound commands say little about drawing
+            if measured <= wire_time(len(encoder(command.strip())), baud) * 1.05:
+                continue
+            samples, xtx, xty = self.sums.setdefault(name, [0, np.zeros((4, 4)), np.zeros(4)])
+            self.sums[name][0] = samples + 1
+            xtx += np.outer(x, x)
+            xty += x * measured
+            touched.add(name)
+            used += 1
+        for name in touched:
+            self._fit(name)
+        return used
+
+    def _fit(self, name):
+        _, xtx, xty = self.sums[name]
+        prior = np.array(DEFAULT_COEFFICIENTS.get(name, FALLBACK_COEFFICIENTS))
+        ridge = np.diag(PRIOR_SAMPLES * PRIOR_SCALE ** 2)
+        fitted = np.linalg.solve(xtx + ridge, xty + ridge @ prior)
+        self.coefficients[name] = np.maximum(fitted, 0.0)
+
+    def save(self, path=None):
+        path = path or self.path
+        data = {"sums": {name: [samples, xtx.tolist(), xty.tolist()]
+                         for name, (samples, xtx, xty) in self.sums.items()}}
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+
+class Estimate:
+    def __init__(self):
+        self.seconds = 0.0
+        self.bytes = 0
+        self.device_seconds = 0.0
+        self.commands = 0
+
+    def add(self, seconds, size, device_seconds=0.0):
+        self.seconds += seconds
+        self.bytes += size
+        self.device_seconds += device_seconds
+        self.commands += 1
+
+    def summary(self):
+        return (f"~{self.seconds:.2f} s for {self.commands} commands, {self.bytes / 1000:.1f} kB "
+                f"(device {self.device_seconds:.2f} s)")
+
+
+class ItemCosts:
+    """Estimated upload time of every item of a design, kept up to date cheaply.
+
+    The designer marks the items it edits with mark_changed() and
+    mark_removed(), and refresh() only prices those, keeping the total as a
+    running sum. After invalidate() (a new link, a replaced design) the next
+    refresh() goes over every item once. Per-item flushes are left out: the
+    optimizer sends a single one at the end of the upload.
+    """
+
+    def __init__(self, model, encoder=encode_text, baud=115200, command_for=item_command):
+        self.model = model
+        self.command_for = command_for
+        self.configure(encoder, baud)
+
+    def configure(self, encoder, baud):
+        """Change the link the costs are for; everything is priced again"""
+        self.encoder = encoder
+        self.baud = baud
+        self.entries = {}  # item uid -> (item, commands, seconds, bytes)
+        self.seconds = 0.0
+        self.bytes = 0
+        self.invalidate()
+
+    def invalidate(self):
+        """Check every item on the next refresh instead of just the marked ones"""
+        self.stale = True
+        self.dirty = {}  # item uid -> item, or None once removed
+
+    def mark_changed(self, item):
+        self.dirty[item_uid(item)] = item
+
+    def mark_removed(self, item):
+        self.dirty[item_uid(item)] = None
+
+    def refresh(self, items):
+        """Reprice changed items of the design `items`; returns (changed items, uids of removed items)"""
+        if self.stale:
+            current = {item_uid(item): item for item in items}
+            removed = [uid for uid in self.entries if uid not in current]
+        else:
+            current = {uid: item for uid, item in self.dirty.items() if item is not None}
+            removed = [uid for uid, item in self.dirty.items() if item is None and uid in self.entries]
+        self.stale = False
+        self.dirty = {}
+        changed = [item for uid, item in current.items() if self._price(uid, item)]
+        for uid in removed:
+            _, _, seconds, size = self.entries.pop(uid)
+            self.seconds -= seconds
+            self.bytes -= size
+        return changed, removed
+
+    def _price(self, uid, item):
+        """Update the entry of an item; False if its commands did not change"""
+        commands = self.command_for(item)
+        entry = self.entries.get(uid)
+        if entry is not None and entry[0] is item and entry[1] == commands:
+            return False
+        if entry is not None:
+            self.seconds -= entry[2]
+            self.bytes -= entry[3]
+        seconds = size = 0
+        for command in commands.split("\n") if commands else ():
+            if command == "flush":
+                continue
+            command_seconds, command_size = self.model.command_time(command, self.encoder, self.baud)
+            seconds += command_seconds
+            size += command_size
+        self.entries[uid] = (item, commands, seconds, size)
+        self.seconds += seconds
+        self.bytes += size
+        return True
+
+    def cost(self, item):
+        entry = self.entries.get(item_uid(item))
+        return entry[2] if entry else 0.0
+
+    def total(self):
+        """Seconds for a full upload: clear, every item and a flush"""
+        extra = sum(self.model.command_time(command, self.encoder, self.baud)[0] for command in ("clear|0|0|0", "flush"))
+        return self.seconds + extra
+
+
+def heat_color(seconds):
+    """Overlay colour for an item cost, green (cheap) to red (expensive)"""
+    low, high = HEAT_RANGE
+    t = (math.log(max(seconds, low)) - math.log(low)) / (math.log(high) - math.log(low))
+    t = min(1.0, t)
+    r = int(255 * min(1.0, 2 * t))
+    g = int(255 * min(1.0, 2 * (1 - t)))
+    return f"#{r:02X}{g:02X}00"
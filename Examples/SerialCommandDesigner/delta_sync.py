@@ -0,0 +1,157 @@
+import hashlib
+import itertools
+import json
+
+from design_items import item_bounds
+from item_geometry import (SCREEN_WIDTH, SCREEN_HEIGHT, clip_to_screen,
+                           rect_area, rects_intersect, rect_union)
+
+# Above this share of the screen a full clear and redraw is cheaper
+FULL_REDRAW_AREA = 0.6
+
+_uids = itertools.count(1)
+
+
+def item_uid(item):
+    """Stable identity of an item for as long as the designer is running"""
+    if "uid" not in item:
+        item["uid"] = next(_uids)
+    return item["uid"]
+
+
+def item_fingerprint(item):
+    content = {key: value for key, value in item.items() if key not in ("id", "uid")}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class DeviceSnapshot:
+    """What the panel shows: uid -> (fingerprint, bounds, z-index)"""
+
+    def __init__(self, entries=None, background=(0, 0, 0)):
+        self.entries = entries or {}
+        self.background = background
+
+    @classmethod
+    def from_items(cls, items, background=(0, 0, 0)):
+        entries = {}
+        for z, item in enumerate(items):
+            entries[item_uid(item)] = (item_fingerprint(item), item_bounds(item), z)
+        return cls(entries, background)
+
+
+def _stable_order(old_positions):
+    """Indices of the longest increasing run of old z-positions (kept in order)"""
+    # Patience sorting for the longest increasing subsequence
+    tails, tails_idx, parents = [], [], [None] * len(old_positions)
+    for i, pos in enumerate(old_positions):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        parents[i] = tails_idx[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(pos)
+            tails_idx.append(i)
+        else:
+            tails[lo] = pos
+            tails_idx[lo] = i
+    keep = set()
+    i = tails_idx[-1] if tails_idx else None
+    while i is not None:
+        keep.add(i)
+        i = parents[i]
+    return keep
+
+
+def _merge_rects(rects):
+    merged = []
+    for rect in rects:
+        # Absorb every rectangle the new one touches until nothing overlaps
+        changed = True
+        while changed:
+            changed = False
+            for other in merged:
+                if rects_intersect(rect, other):
+                    merged.remove(other)
+                    rect = rect_union(rect, other)
+                    changed = True
+                    break
+        merged.append(rect)
+    return merged
+
+
+def dirty_regions(old, items, new):
+    """Screen areas whose content differs between the old and new snapshot"""
+    dirty = []
+    retained = []
+    for item in items:
+        uid = item["uid"]
+        fingerprint, bounds, _ = new.entries[uid]
+        previous = old.entries.get(uid)
+        if previous is None:
+            dirty.append(bounds)
+        elif previous[0] != fingerprint:
+            dirty.append(previous[1])
+            dirty.append(bounds)
+        else:
+            retained.append(uid)
+
+    for uid, (_, bounds, _) in old.entries.items():
+        if uid not in new.entries:
+            dirty.append(bounds)
+
+    # Unchanged items that moved in z-order relative to the others
+    keep = _stable_order([old.entries[uid][2] for uid in retained])
+    for i, uid in enumerate(retained):
+        if i not in keep:
+            dirty.append(new.entries[uid][1])
+
+    dirty = [clip_to_screen(rect) for rect in dirty]
+    return _merge_rects([rect for rect in dirty if rect_area(rect) > 0])
+
+
+def plan_upload(old, items, command_for, background=(0, 0, 0)):
+    """Commands that bring the panel from `old` to showing `items`.
+
+    `old` is the DeviceSnapshot of the last completed upload, or None when
+    the panel content is unknown. Returns (commands, snapshot, repainted)
+    where `snapshot` describes the panel after the commands ran and
+    `repainted` is the number of items drawn.
+    """
+    new = DeviceSnapshot.from_items(items, background)
+    r, g, b = background
+
+    regions = None
+    if old is not None and old.background == background:
+        regions = dirty_regions(old, items, new)
+        if sum(rect_area(rect) for rect in regions) > FULL_REDRAW_AREA * SCREEN_WIDTH * SCREEN_HEIGHT:
+            regions = None
+
+    if regions is None:
+        commands = [f"clear|{r}|{g}|{b}"]
+        to_paint = items
+    else:
+        commands = []
+        for x1, y1, x2, y2 in regions:
+            commands.append(f"setColor|{r}|{g}|{b}")
+            commands.append(f"drawFillRect|{x1}|{y1}|{x2 - x1}|{y2 - y1}")
+        # Repaint in z-order everything touching a cleared area. A repainted
+        # item may spill over items above it, so its bounds join the area.
+        painted = list(regions)
+        to_paint = []
+        for item in items:
+            bounds = new.entries[item["uid"]][1]
+            if any(rects_intersect(bounds, rect) for rect in painted):
+                to_paint.append(item)
+                painted.append(bounds)
+
+    for item in to_paint:
+        cmd = command_for(item)
+        if cmd:
+            commands.extend(line for line in cmd.split('\n') if line != "flush")
+    if commands:
+        commands.append("flush")
+    return commands, new, len(to_paint)
@@ -0,0 +1,419 @@
+from binary_protocol import FRAME_MAX_TEXT
+from design_items import as_item
+from gfx_font import text_bounds
+from item_geometry import (SCREEN_WIDTH, SCREEN_HEIGHT, BOUNDS_SLACK, device_rect, qr_size, qr_version_for,
+                           rect_area, rects_intersect)
+import qr_encoder
+
+SCREEN_RECT = (0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+# Commands that draw with the colour selected by setColor
+COLOR_COMMANDS = {
+    "prt", "drawFillRect", "drawRect", "drawLine", "drawFillCircle", "drawCircleOutline",
+    "drawTriangle", "drawFillTriangle", "drawRoundRect", "drawFillRoundRect",
+    "drawEllipse", "drawFillEllipse", "drawBitmap",
+}
+
+RECT_COMMANDS = {"drawFillRect", "drawRect", "drawRoundRect", "drawFillRoundRect"}
+
+
+def item_command(item):
+    """Device commands for one design item, newline separated"""
+    return as_item(item).command()
+
+
+def design_commands(items, background=(0, 0, 0)):
+    """Naive command stream for a whole design: clear, then every item as-is"""
+    r, g, b = background
+    commands = [f"clear|{r}|{g}|{b}"]
+    for item in items:
+        cmd = item_command(item)
+        if cmd:
+            commands.extend(cmd.split('\n'))
+    return commands
+
+
+# Library calls the exported sketch code uses for each command
+ARDUINO_FUNCTIONS = {
+    "drawRect": "screen.drawRect",
+    "drawFillRect": "screen.fillRect",
+    "drawRoundRect": "screen.drawRoundRect",
+    "drawFillRoundRect": "screen.fillRoundRect",
+    "drawCircleOutline": "screen.drawCircle",
+    "drawFillCircle": "screen.fillCircle",
+    "drawLine": "screen.drawLine",
+    "prt": "screen.drawString",
+    "drawQRCode": "screen.qrcode",
+}
+
+
+def arduino_code(items, command_for=item_command):
+    """C++ statements that draw `items`, one per line, as written by Export Commands"""
+    lines = []
+    for item in items:
+        cmd = command_for(item)
+        if not cmd:
+            continue
+        for command in cmd.split('\n'):
+            if command.startswith('setColor') or command == 'flush':
+                continue
+            parts = command.split('|')
+            function = ARDUINO_FUNCTIONS.get(parts[0], parts[0])
+            if parts[0] == "prt" and len(parts) > 5 and parts[5]:
+                lines.append(f"screen.setFont(&{parts[5]});")
+                lines.append(f"{function}({','.join(parts[1:5])});")
+                lines.append("screen.setFont(nullptr);")
+                continue
+            lines.append(f"{function}({','.join(parts[1:])});")
+    return lines
+
+
+def _int(value):
+    return int(float(value))
+
+
+def command_bounds(name, args):
+    """Screen area a drawing command can touch, or None if unknown"""
+    try:
+        if name in RECT_COMMANDS:
+            x, y, w, h = (_int(v) for v in args[:4])
+            if w <= 0 or h <= 0:
+                return None  # Leave degenerate rectangles to the device
+            return device_rect(x, y, w, h)
+        if name in ("drawFillCircle", "drawCircleOutline"):
+            x, y, r = (_int(v) for v in args[:3])
+            return (x - r - BOUNDS_SLACK, y - r - BOUNDS_SLACK, x + r + BOUNDS_SLACK + 1, y + r + BOUNDS_SLACK + 1)
+        if name in ("drawEllipse", "drawFillEllipse"):
+            x, y, rx, ry = (_int(v) for v in args[:4])
+            return (x - rx - BOUNDS_SLACK, y - ry - BOUNDS_SLACK, x + rx + BOUNDS_SLACK + 1, y + ry + BOUNDS_SLACK + 1)
+        if name in ("drawLine", "drawTriangle", "drawFillTriangle"):
+            values = [_int(v) for v in args]
+            xs, ys = values[0::2], values[1::2]
+            return (min(xs) - BOUNDS_SLACK, min(ys) - BOUNDS_SLACK, max(xs) + BOUNDS_SLACK + 1, max(ys) + BOUNDS_SLACK + 1)
+        if name == "prt":
+            return text_bounds(args[0], _int(args[1]), _int(args[2]), _int(args[3]), args[4] if len(args) > 4 else None)
+        if name == "drawQRCode":
+            x, y, module_size = _int(args[1]), _int(args[2]), _int(args[3])
+            if x < 0 or y < 0:
+                return None  # Passed as uint16_t, so negative positions wrap around
+            size = qr_size(args[0], module_size)
+            return device_rect(x, y, size, size)
+        if name == "drawBitmap":
+            x, y, width, scale = (_int(v) for v in args[:4])
+            rows = len(args[4]) // 2 // max(1, (width + 7) // 8)
+            return device_rect(x, y, width * scale, rows * scale)
+        if name == "blit":
+            # A run of `count` pixels along physical canvas row y, starting at column x
+            x, y, count = (_int(v) for v in args[:3])
+            return (y, SCREEN_HEIGHT - x - count, y + 1, SCREEN_HEIGHT - x)
+    except (ValueError, IndexError):
+        return None
+    return None
+
+
+def is_offscreen(name, args):
+    bounds = command_bounds(name, args)
+    return bounds is not None and (rect_area(bounds) == 0 or not rects_intersect(bounds, SCREEN_RECT))
+
+
+def _on_screen(x, y, w, h):
+    return device_rect(x, y, w, h) == (x, y, x + w, y + h)
+
+
+def _merge_fill_rects(a, b):
+    """Union of two fill rects if it is exactly a rectangle, else None"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    if min(aw, ah, bw, bh) <= 0 or not (_on_screen(*a) and _on_screen(*b)):
+        return None
+    if ay == by and ah == bh and max(ax, bx) <= min(ax + aw, bx + bw):
+        x = min(ax, bx)
+        return (x, ay, max(ax + aw, bx + bw) - x, ah)
+    if ax == bx and aw == bw and max(ay, by) <= min(ay + ah, by + bh):
+        y = min(ay, by)
+        return (ax, y, aw, max(ay + ah, by + bh) - y)
+    return None
+
+
+def _merge_lines(a, b):
+    """Merge two collinear lines sharing or touching a span.
+
+    Only horizontal, vertical and 45 degree lines are merged: for those the
+    Bresenham pixels of the merged line are exactly the union of both lines.
+    """
+    (ax0, ay0, ax1, ay1), (bx0, by0, bx1, by1) = a, b
+    dax, day = ax1 - ax0, ay1 - ay0
+    dbx, dby = bx1 - bx0, by1 - by0
+    if dax == 0 and day == 0 or dbx == 0 and dby == 0:
+        return None
+    if day == 0 and dby == 0 and ay0 == by0:
+        lo_a, hi_a = sorted((ax0, ax1))
+        lo_b, hi_b = sorted((bx0, bx1))
+        if max(lo_a, lo_b) <= min(hi_a, hi_b) + 1:
+            return (min(lo_a, lo_b), ay0, max(hi_a, hi_b), ay0)
+    elif dax == 0 and dbx == 0 and ax0 == bx0:
+        lo_a, hi_a = sorted((ay0, ay1))
+        lo_b, hi_b = sorted((by0, by1))
+        if max(lo_a, lo_b) <= min(hi_a, hi_b) + 1:
+            return (ax0, min(lo_a, lo_b), ax0, max(hi_a, hi_b))
+    elif abs(dax) == abs(day) and abs(dbx) == abs(dby):
+        # Normalise both diagonals to run left to right
+        if ax0 > ax1:
+            ax0, ay0, ax1, ay1 = ax1, ay1, ax0, ay0
+        if bx0 > bx1:
+            bx0, by0, bx1, by1 = bx1, by1, bx0, by0
+        slope_a = 1 if ay1 > ay0 else -1
+        slope_b = 1 if by1 > by0 else -1
+        if slope_a != slope_b or (by0 - ay0) != slope_a * (bx0 - ax0):
+            return None
+        if max(ax0, bx0) <= min(ax1, bx1) + 1:
+            if ax0 <= bx0:
+                x0, y0 = ax0, ay0
+            else:
+                x0, y0 = bx0, by0
+            x1 = max(ax1, bx1)
+            return (x0, y0, x1, y0 + slope_a * (x1 - x0))
+    return None
+
+
+def _try_merge(last, name, args):
+    """Merge a drawing command into the previous one (same colour), in place"""
+    if last[0] != name or name not in ("drawFillRect", "drawLine"):
+        return False
+    try:
+        a = tuple(_int(v) for v in last[1:5])
+        b = tuple(_int(v) for v in args[:4])
+    except (ValueError, IndexError):
+        return False
+    merged = _merge_fill_rects(a, b) if name == "drawFillRect" else _merge_lines(a, b)
+    if merged is None:
+        return False
+    last[1:] = [str(v) for v in merged]
+    return True
+
+
+class CompileStats:
+    def __init__(self):
+        self.commands_before = 0
+        self.bytes_before = 0
+        self.commands_after = 0
+        self.bytes_after = 0
+        self.colors_dropped = 0
+        self.flushes_dropped = 0
+        self.culled = 0
+        self.merged = 0
+
+    def summary(self):
+        return (f"{self.commands_before} -> {self.commands_after} commands, "
+                f"{self.bytes_before} -> {self.bytes_after} bytes "
+                f"({self.colors_dropped} colour changes and {self.flushes_dropped} flushes dropped, "
+                f"{self.culled} off-screen culled, {self.merged} merged)")
+
+
+def _stream_bytes(commands):
+    return sum(len(command.encode()) + 1 for command in commands)
+
+
+def optimize_commands(commands):
+    """Rewrite a command stream into a cheaper one with the same result on screen.
+
+    Tracks the device colour to drop redundant setColor commands, drops
+    commands that draw nothing on the 480x320 screen, merges consecutive
+    same-colour fill rects and collinear lines and replaces every flush
+    with a single trailing one. Returns (commands, CompileStats).
+    """
+    stats = CompileStats()
+    stats.commands_before = len(commands)
+    stats.bytes_before = _stream_bytes(commands)
+
+    out = []
+    device_color = None   # Colour the device currently draws with
+    stream_color = None   # Colour the stream asked for last
+    last = None           # Last emitted drawing command that may absorb the next one
+    flush = False
+
+    for command in commands:
+        command = command.strip()
+        if not command:
+            continue
+        parts = command.split('|')
+        name, args = parts[0], parts[1:]
+
+        if name == "setColor":
+            stream_color = tuple(_int(v) for v in args[:3]) if len(args) >= 3 else stream_color
+            continue
+        if name == "flush":
+            flush = True
+            continue
+
+        if name in COLOR_COMMANDS:
+            if is_offscreen(name, args):
+                stats.culled += 1
+                continue
+            if stream_color is not None and stream_color != device_color:
+                out.append(["setColor"] + [str(v) for v in stream_color])
+                device_color = stream_color
+                last = None
+            if last is not None and _try_merge(last, name, args):
+                stats.merged += 1
+                continue
+            out.append(parts)
+            last = out[-1]
+        elif name == "drawQRCode":
+            if is_offscreen(name, args):
+                stats.culled += 1
+                continue
+            out.append(parts)
+            last = None
+            # drawQRCode leaves the device colour set to the QR foreground
+            try:
+                device_color = tuple(_int(v) for v in args[7:10])
+            except ValueError:
+                device_color = None
+        else:
+            out.append(parts)
+            last = None
+
+    if flush:
+        out.append(["flush"])
+
+    result = ["|".join(parts) for parts in out]
+    stats.commands_after = len(result)
+    stats.bytes_after = _stream_bytes(result)
+    set_colors_before = sum(1 for c in commands if c.startswith("setColor"))
+    set_colors_after = sum(1 for c in result if c.startswith("setColor"))
+    stats.colors_dropped = set_colors_before - set_colors_after
+    stats.flushes_dropped = sum(1 for c in commands if c.strip() == "flush") - (1 if flush else 0)
+    return result, stats
+
+
+def _color_after(name, args, color):
+    """Device colour after a command that started with `color`"""
+    try:
+        if name == "setColor":
+            return tuple(_int(v) for v in args[:3])
+        if name == "drawQRCode":
+            # drawQRCode leaves the device colour set to the QR foreground
+            return tuple(_int(v) for v in args[7:10])
+    except ValueError:
+        return None
+    return color
+
+
+def redraw_commands(commands, index, end):
+    """Commands that put right what a lost commands[index] should have drawn.
+
+    For when commands[index + 1:end] already ran on the device. Redraws the
+    command with the colour it was meant to use, then every later command
+    drawn over the area that touches (and, for a lost setColor, the ones
+    that drew with its colour), a flush if one already ran, and finally
+    selects the colour commands[end] expects. A later clear paints over
+    whatever came before it, so nothing before it is redrawn.
+    """
+    colors = [None]  # Device colour before each command
+    for command in commands[:end]:
+        parts = command.split('|')
+        colors.append(_color_after(parts[0], parts[1:], colors[-1]))
+
+    parts = commands[index].split('|')
+    if parts[0] == "flush":
+        return ["flush"]
+    recolor = parts[0] in ("setColor", "drawQRCode")  # Later commands used the wrong colour
+    redo = []
+    region = []  # Areas redrawn so far, None for the whole screen
+    flushed = False
+    for k in range(index, end):
+        parts = commands[k].split('|')
+        name, args = parts[0], parts[1:]
+        if name == "flush":
+            flushed = True
+            continue
+        if name == "setColor":
+            recolor = k == index
+            continue
+        if name == "clear" and k > index:
+            redo, region = [], []
+            continue
+        bounds = None if name == "clear" else command_bounds(name, args)
+        if k > index and not (recolor and name in COLOR_COMMANDS) and region is not None:
+            if bounds is not None and not any(rects_intersect(bounds, rect) for rect in region):
+                continue
+        redo.append(k)
+        if name == "drawQRCode" and k > index:
+            recolor = False
+        if region is not None:
+            region = None if bounds is None else region + [bounds]
+
+    out = []
+    device_color = None
+    for k in redo:
+        parts = commands[k].split('|')
+        if parts[0] in COLOR_COMMANDS and colors[k] is not None and colors[k] != device_color:
+            out.append("setColor|" + "|".join(str(v) for v in colors[k]))
+            device_color = colors[k]
+        out.append(commands[k])
+        device_color = _color_after(parts[0], parts[1:], device_color)
+    if flushed and out:
+        out.append("flush")
+    anchor = commands[index].split('|')[0]
+    if colors[end] is not None and colors[end] != device_color and (
+            device_color is not None or anchor in ("setColor", "drawQRCode")):
+        out.append("setColor|" + "|".join(str(v) for v in colors[end]))
+    return out
+
+
+def qr_bitmap_commands(args):
+    """drawBitmap commands that draw like drawQRCode with `args`, or None if they would not.
+
+    The symbol comes from qr_encoder's cache and is split into bitmaps that
+    fit one binary frame. QR codes that do not fit the sketch's version
+    table or are not entirely on screen (where drawQRCode's uint16_t
+    position and clamped fills behave differently) are left alone.
+    """
+    try:
+        data = args[0]
+        x, y, module_size = (_int(v) for v in args[1:4])
+        bg, fg = args[4:7], args[7:10]
+        if len(fg) < 3:
+            return None
+    except (ValueError, IndexError):
+        return None
+    matrix = qr_encoder.matrix_for(data, qr_version_for(data))
+    if matrix is None or module_size <= 0:
+        return None
+    size = matrix.size * module_size
+    if x < 0 or y < 0 or not _on_screen(x, y, size, size):
+        return None
+
+    commands = ["setColor|" + "|".join(bg), f"drawFillRect|{x}|{y}|{size}|{size}", "setColor|" + "|".join(fg)]
+    stride = (matrix.size + 7) // 8
+    rows = FRAME_MAX_TEXT // stride
+    packed = matrix.packed_rows()
+    for row in range(0, matrix.size, rows):
+        chunk = packed[row * stride:(row + rows) * stride]
+        if any(chunk):
+            commands.append(f"drawBitmap|{x}|{y + row * module_size}|{matrix.size}|{module_size}|{chunk.hex()}")
+    return commands
+
+
+def expand_qr_codes(commands):
+    """Replace drawQRCode commands with host encoded drawBitmap commands where possible.
+
+    For firmware with drawBitmap: the sketch no longer encodes the symbol
+    and fills runs of modules instead of single modules. The device colour
+    ends up at the QR foreground either way.
+    """
+    out = []
+    for command in commands:
+        parts = command.split('|')
+        bitmap = qr_bitmap_commands(parts[1:]) if parts[0] == "drawQRCode" else None
+        if bitmap:
+            out.extend(bitmap)
+        else:
+            out.append(command)
+    return out
+
+
+def compile_design(items, background=(0, 0, 0)):
+    """Optimized command stream that draws a whole design from a cleared screen"""
+    return optimize_commands(design_commands(items, background))
@@ -0,0 +1,278 @@
+"""Binary design files.
+
+A compact alternative to the indented JSON list written by save_design.
+All integers are little-endian:
+
+    header   MAGIC | version u16 | record size u16 | count u32
+             | record table offset u32 | heap offset u32 | heap size u32
+    records  one fixed-size record per item, bottom layer first
+    heap     UTF-8 strings and JSON blobs referenced by (offset, length)
+
+Items whose keys and values fit the record layout store their numbers in the
+record and their text or QR data in the heap; identical strings are stored
+once. Anything else (unknown types, floats, missing or extra keys) is kept
+as its JSON dict in the heap, so JSON -> binary -> JSON is lossless.
+
+Every record also stores the pick bounds of its item. DesignFile
+memory-maps a file and decodes records as they are indexed; read_design()
+decodes all of them, since the editor and the compiler need every item.
+
+    python design_file.py design.json design.scd    # and the other way round
+"""
+
+import json
+import math
+import mmap
+import struct
+import sys
+
+from design_items import ITEM_TYPES, make_item, as_item
+
+DESIGN_EXTENSION = ".scd"
+MAGIC = b"SCDB"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIII")
+# type code, reserved, pick bounds (x1, y1, x2, y2), four coords, color,
+# second color, numeric parameter, heap offset, heap length
+RECORD = struct.Struct("<BBhhhhiiii3s3siII")
+
+TYPE_CODES = ("rect", "fillrect", "roundrect", "fillroundrect", "circle", "fillcircle", "line", "text", "qrcode")
+JSON_RECORD = 0xFF
+
+COORD_COUNTS = {"circle": 3, "fillcircle": 3, "text": 2, "qrcode": 2}
+
+# Record slot holding each design file key
+KEY_SLOTS = {
+    "coords": "coords",
+    "color": "color", "fg_color": "color",
+    "bg_color": "color2",
+    "radius": "param", "size": "param", "module_size": "param",
+    "text": "string", "data": "string",
+}
+
+_INT32 = (-2**31, 2**31 - 1)
+_INT16 = (-2**15, 2**15 - 1)
+
+
+def _is_int(value, limits=_INT32):
+    return type(value) is int and limits[0] <= value <= limits[1]
+
+
+def _is_color(value):
+    return isinstance(value, (list, tuple)) and len(value) == 3 and all(_is_int(c, (0, 255)) for c in value)
+
+
+def _item_data(item):
+    """Design file dict of an item or of a dict in the same format"""
+    if hasattr(item, "to_dict"):
+        return item.to_dict()
+    return {key: value for key, value in item.items() if key not in ("id", "uid")}
+
+
+def _pick_bounds(data):
+    try:
+        x1, y1, x2, y2 = as_item(data).pick_bounds()
+        bounds = (math.floor(x1), math.floor(y1), math.ceil(x2), math.ceil(y2))
+    except Exception:
+        return (_INT16[0], _INT16[0], _INT16[1], _INT16[1])
+    return tuple(max(_INT16[0], min(_INT16[1], v)) for v in bounds)
+
+
+def _slotted_fields(item_type):
+    """Keys of an item type that have a record slot; the others force a JSON record"""
+    return [key for key in ITEM_TYPES[item_type].FIELDS if key in KEY_SLOTS]
+
+
+def _compact_slots(data):
+    """Record slots for `data`, or None if it has to be stored as JSON"""
+    item_type = data.get("type")
+    if item_type not in TYPE_CODES:
+        return None
+    fields = _slotted_fields(item_type)
+    if list(data) != ["type", *fields]:
+        return None
+    slots = {}
+    for key in fields:
+        slot, value = KEY_SLOTS[key], data[key]
+        if slot == "coords":
+            if not isinstance(value, (list, tuple)) or len(value) != COORD_COUNTS.get(item_type, 4) \
+                    or not all(_is_int(v) for v in value):
+                return None
+        elif slot in ("color", "color2"):
+            if not _is_color(value):
+                return None
+            value = bytes(value)
+        elif slot == "param":
+            if not _is_int(value):
+                return None
+        elif not isinstance(value, str):
+            return None
+        slots[slot] = value
+    return slots
+
+
+def encode_design(items):
+    """Bytes of a binary design file holding `items`"""
+    records = []
+    heap = bytearray()
+    strings = {}
+
+    def heap_string(data):
+        if data not in strings:
+            strings[data] = len(heap)
+            heap.extend(data)
+        return strings[data], len(data)
+
+    for item in items:
+        data = _item_data(item)
+        slots = _compact_slots(data)
+        if slots is None:
+            code = JSON_RECORD
+            slots = {"string": json.dumps(data, separators=(",", ":"))}
+        else:
+            code = TYPE_CODES.index(data["type"])
+        coords = list(slots.get("coords", ()))
+        coords += [0] * (4 - len(coords))
+        offset, length = heap_string(slots["string"].encode()) if "string" in slots else (0, 0)
+        records.append(RECORD.pack(code, 0, *_pick_bounds(data), *coords,
+                                   slots.get("color", b"\0\0\0"), slots.get("color2", b"\0\0\0"),
+                                   slots.get("param", 0), offset, length))
+
+    table = HEADER.size
+    heap_offset = table + RECORD.size * len(records)
+    header = HEADER.pack(MAGIC, VERSION, RECORD.size, len(records), table, heap_offset, len(heap))
+    return header + b"".join(records) + bytes(heap)
+
+
+def write_design(path, items):
+    with open(path, "wb") as f:
+        f.write(encode_design(items))
+
+
+class DesignFile:
+    """A memory-mapped binary design file.
+
+    Indexing returns design items, decoded on first access and cached.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            self._file.close()
+            raise ValueError(f"Not a design file: {path}")
+        try:
+            self._read_header(path)
+        except ValueError:
+            self.close()
+            raise
+        self._cache = {}
+
+    def _read_header(self, path):
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"Not a design file: {path}")
+        magic, version, record_size, count, table, heap, heap_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a design file: {path}")
+        if version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"Unsupported design file version {version}: {path}")
+        if table + record_size * count > heap or heap + heap_size > len(self._map):
+            raise ValueError(f"Truncated design file: {path}")
+        self._count = count
+        self._table = table
+        self._heap = heap
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("design item index out of range")
+        item = self._cache.get(index)
+        if item is None:
+            item = self._cache[index] = make_item(self.record_data(index))
+        return item
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def _record(self, index):
+        return RECORD.unpack_from(self._map, self._table + index * RECORD.size)
+
+    def _string(self, offset, length):
+        start = self._heap + offset
+        return self._map[start:start + length].decode()
+
+    def record_data(self, index):
+        """The item at `index` as a fresh dict in the JSON design format"""
+        code, _, _, _, _, _, c1, c2, c3, c4, color, color2, param, offset, length = self._record(index)
+        if code == JSON_RECORD:
+            return json.loads(self._string(offset, length))
+        item_type = TYPE_CODES[code]
+        values = {
+            "coords": [c1, c2, c3, c4][:COORD_COUNTS.get(item_type, 4)],
+            "color": list(color),
+            "color2": list(color2),
+            "param": param,
+        }
+        data = {"type": item_type}
+        for key in _slotted_fields(item_type):
+            slot = KEY_SLOTS[key]
+            data[key] = self._string(offset, length) if slot == "string" else values[slot]
+        return data
+
+    def items(self):
+        return list(self)
+
+    def to_json_data(self):
+        return [self.record_data(index) for index in range(self._count)]
+
+
+def read_design(path):
+    """Items of a design file in either format"""
+    if path.lower().endswith(DESIGN_EXTENSION):
+        with DesignFile(path) as design:
+            return design.items()
+    with open(path, "r") as f:
+        return [make_item(data) for data in json.load(f)]
+
+
+def convert(source, target):
+    """Convert between the JSON and the binary design format, chosen by file extension"""
+    if source.lower().endswith(DESIGN_EXTENSION):
+        with DesignFile(source) as design:
+            data = design.to_json_data()
+    else:
+        with open(source, "r") as f:
+            data = json.load(f)
+    if target.lower().endswith(DESIGN_EXTENSION):
+        write_design(target, data)
+    else:
+        with open(target, "w") as f:
+            json.dump(data, f, indent=4)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(f"usage: {sys.argv[0]} SOURCE TARGET  (.json <-> {DESIGN_EXTENSION})", file=sys.stderr)
+        sys.exit(2)
+    convert(sys.argv[1], sys.argv[2])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""Typed design items.
+
+Each primitive is a small __slots__ class registered under the `type` name
+used in design files. Items still answer item["coords"], item.get(...) and
+friends like the plain dicts older code used, and to_dict()/make_item()
+convert to and from the JSON schema written by save_design.
+"""
+
+from gfx_font import text_bounds
+from item_geometry import BOUNDS_SLACK, device_rect, qr_size
+
+# Distance in pixels within which a click selects a line
+LINE_TOLERANCE = 5
+
+ITEM_TYPES = {}
+
+
+def register_item(cls):
+    ITEM_TYPES[cls.type] = cls
+    return cls
+
+
+def make_item(data):
+    """Item for a dict in the design file format"""
+    try:
+        cls = ITEM_TYPES[data["type"]]
+    except KeyError:
+        raise ValueError(f"Unknown item type: {data.get('type')}")
+    return cls.from_dict(data)
+
+
+def as_item(item):
+    return item if isinstance(item, Item) else make_item(item)
+
+
+class Item:
+    """Base class: Tk canvas id, runtime uid and unknown keys kept for round trips"""
+
+    __slots__ = ("id", "uid", "extra")
+    type = None
+    FIELDS = ()     # Keys stored in the design file, in file order
+    DEFAULTS = {}
+    COMMAND = None  # Device command drawing the item, followed by its coords
+
+    def __init__(self, **fields):
+        self.id = None
+        self.uid = None
+        self.extra = None
+        for key in self.FIELDS:
+            setattr(self, key, fields.pop(key, None))
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{key: value for key, value in data.items() if key != "type"})
+
+    def to_dict(self):
+        """Plain dict in the design file format, without id and uid"""
+        data = {"type": self.type}
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def copy(self):
+        item = self.__class__.__new__(self.__class__)
+        item.id = self.id
+        item.uid = self.uid
+        item.extra = dict(self.extra) if self.extra else None
+        for key in self.FIELDS:
+            setattr(item, key, getattr(self, key))
+        return item
+
+    # Mapping access, so code written for dict items keeps working
+
+    def _is_field(self, key):
+        return key in ("id", "uid") or key in self.FIELDS
+
+    def __getitem__(self, key):
+        if key == "type":
+            return self.type
+        if self._is_field(key):
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "type":
+            raise ValueError("Item type cannot be changed")
+        if self._is_field(key):
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return self.DEFAULTS.get(key, default)
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        if self._is_field(key):
+            setattr(self, key, None)
+        elif self.extra:
+            self.extra.pop(key, None)
+        return value
+
+    def keys(self):
+        keys = ["type"] + [key for key in ("id",) + self.FIELDS + ("uid",) if getattr(self, key) is not None]
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    # Per-type behaviour
+
+    def bounds(self):
+        """Bounding box (x1, y1, x2, y2) of the pixels drawn on the device, x2/y2 exclusive"""
+        return (0, 0, 0, 0)
+
+    def pick_bounds(self):
+        """Box around the clickable area on the editor canvas, by default the drawn pixels"""
+        return self.bounds()
+
+    def hit_test(self, x, y):
+        x1, y1, x2, y2 = self.pick_bounds()
+        return x1 <= x <= x2 and y1 <= y <= y2
+
+    def move(self, dx, dy):
+        coords = list(self.coords)
+        coords[0] += dx
+        coords[1] += dy
+        self.coords = coords
+
+    def color_command(self):
+        """Command selecting the drawing colour, None if draw_command() passes its own colours"""
+        r, g, b = self.color
+        return f"setColor|{r}|{g}|{b}"
+
+    def draw_command(self):
+        return "|".join([self.COMMAND] + [str(value) for value in self.coords])
+
+    def command(self):
+        """Device commands for the item, newline separated"""
+        color = self.color_command()
+        commands = [self.draw_command(), "flush"]
+        return "\n".join([color] + commands if color else commands)
+
+
+class BoxItem(Item):
+    __slots__ = ("coords", "color")
+    FIELDS = ("coords", "color")
+
+    def bounds(self):
+        x1, y1, x2, y2 = self.coords
+        if x2 > x1 and y2 > y1:
+            return device_rect(x1, y1, x2 - x1, y2 - y1)
+        return (min(x1, x2), min(y1, y2), max(x1, x2) + 1, max(y1, y2) + 1)
+
+    def pick_bounds(self):
+        x1, y1, x2, y2 = self.coords
+        return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+    def move(self, dx, dy):
+        x1, y1, x2, y2 = self.coords
+        self.coords = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
+
+    def draw_command(self):
+        x1, y1, x2, y2 = self.coords
+        return f"{self.COMMAND}|{x1}|{y1}|{x2-x1}|{y2-y1}"
+
+
+@register_item
+class RectItem(BoxItem):
+    __slots__ = ()
+    type = "rect"
+    COMMAND = "drawRect"
+
+
+@register_item
+class FillRectItem(BoxItem):
+    __slots__ = ()
+    type = "fillrect"
+    COMMAND = "drawFillRect"
+
+
+class RoundBoxItem(BoxItem):
+    __slots__ = ("radius",)
+    FIELDS = ("coords", "color", "radius")
+    DEFAULTS = {"radius": 20}
+
+    def draw_command(self):
+        return f"{super().draw_command()}|{self.get('radius')}"
+
+
+@register_item
+class RoundRectItem(RoundBoxItem):
+    __slots__ = ()
+    type = "roundrect"
+    COMMAND = "drawRoundRect"
+
+
+@register_item
+class FillRoundRectItem(RoundBoxItem):
+    __slots__ = ()
+    type = "fillroundrect"
+    COMMAND = "drawFillRoundRect"
+
+
+class CircleBase(Item):
+    __slots__ = ("coords", "color")
+    FIELDS = ("coords", "color")
+
+    def bounds(self):
+        x, y, r = self.coords
+        r = int(r)
+        return (x - r - BOUNDS_SLACK, y - r - BOUNDS_SLACK,
+                x + r + BOUNDS_SLACK + 1, y + r + BOUNDS_SLACK + 1)
+
+    def pick_bounds(self):
+        x, y, r = self.coords
+        return (x - r, y - r, x + r, y + r)
+
+    def hit_test(self, x, y):
+        cx, cy, r = self.coords
+        return (x - cx)**2 + (y - cy)**2 <= r**2
+
+
+@register_item
+class CircleItem(CircleBase):
+    __slots__ = ()
+    type = "circle"
+    COMMAND = "drawCircleOutline"
+
+
+@register_item
+class FillCircleItem(CircleBase):
+    __slots__ = ()
+    type = "fillcircle"
+    COMMAND = "drawFillCircle"
+
+
+@register_item
+class LineItem(Item):
+    __slots__ = ("coords", "color")
+    type = "line"
+    FIELDS = ("coords", "color")
+    COMMAND = "drawLine"
+
+    def bounds(self):
+        x1, y1, x2, y2 = self.coords
+        return (min(x1, x2) - BOUNDS_SLACK, min(y1, y2) - BOUNDS_SLACK,
+                max(x1, x2) + BOUNDS_SLACK + 1, max(y1, y2) + BOUNDS_SLACK + 1)
+
+    def pick_bounds(self):
+        x1, y1, x2, y2 = self.coords
+        t = LINE_TOLERANCE
+        return (min(x1, x2) - t, min(y1, y2) - t, max(x1, x2) + t, max(y1, y2) + t)
+
+    def hit_test(self, x, y):
+        if not Item.hit_test(self, x, y):
+            return False
+        x1, y1, x2, y2 = self.coords
+        dx, dy = x2 - x1, y2 - y1
+        length2 = dx * dx + dy * dy
+        # Squared distance to the segment; a zero-length line is a point
+        t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length2))
+        px, py = x1 + t * dx - x, y1 + t * dy - y
+        return px * px + py * py < LINE_TOLERANCE * LINE_TOLERANCE
+
+    def move(self, dx, dy):
+        x1, y1, x2, y2 = self.coords
+        self.coords = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
+
+
+@register_item
+class TextItem(Item):
+    __slots__ = ("coords", "color", "text", "size", "font")
+    type = "text"
+    FIELDS = ("coords", "color", "text", "size", "font")  # font: GFXfont name, None for the built-in font
+
+    def bounds(self):
+        x, y = self.coords
+        return text_bounds(self.text, x, y, self.size, self.font)
+
+    def pick_bounds(self):
+        # The preview shows the real glyphs; pad so thin text stays easy to click
+        x1, y1, x2, y2 = self.bounds()
+        return (x1 - BOUNDS_SLACK, y1 - BOUNDS_SLACK, x2 + BOUNDS_SLACK, y2 + BOUNDS_SLACK)
+
+    def draw_command(self):
+        x, y = self.coords
+        command = f"prt|{self.text}|{x}|{y}|{self.size}"
+        return command + f"|{self.font}" if self.font else command
+
+
+@register_item
+class QRCodeItem(Item):
+    __slots__ = ("coords", "data", "module_size", "fg_color", "bg_color")
+    type = "qrcode"
+    FIELDS = ("coords", "data", "module_size", "fg_color", "bg_color")
+    DEFAULTS = {"fg_color": (0, 0, 0), "bg_color": (255, 255, 255)}
+
+    def bounds(self):
+        x, y = self.coords
+        size = qr_size(self.data, self.module_size)
+        return device_rect(x, y, size, size)
+
+    def pick_bounds(self):
+        # The preview shows the real symbol
+        x, y = self.coords
+        size = qr_size(self.data, self.module_size)
+        return (x, y, x + size, y + size)
+
+    def color_command(self):
+        # QR codes pass their own colours with the draw command
+        return None
+
+    def draw_command(self):
+        x, y = self.coords
+        fg_color = self.get("fg_color")
+        bg_color = self.get("bg_color")
+        return (f"drawQRCode|{self.data}|{x}|{y}|{self.module_size}|{bg_color[0]}|{bg_color[1]}|{bg_color[2]}"
+                f"|{fg_color[0]}|{fg_color[1]}|{fg_color[2]}")
+
+
+def item_bounds(item):
+    """Bounding box (x1, y1, x2, y2) of the pixels an item covers, x2/y2 exclusive"""
+    return as_item(item).bounds()
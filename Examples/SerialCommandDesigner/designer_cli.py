@@ -0,0 +1,248 @@
+"""Headless designer: compile saved designs and flash them without Tk.
+
+    python designer_cli.py compile designs/ -o build/ --jobs 8
+    python designer_cli.py compile panel.json --format arduino
+    python designer_cli.py flash panel.json --port /dev/ttyUSB0 --baud 115200
+    python designer_cli.py fleet panel.json --ports /dev/ttyUSB0 /dev/ttyUSB1 /dev/ttyUSB2
+
+`compile` accepts design files (.json or .scd) and directories of them and
+writes one command stream per design, compiling in parallel worker
+processes. With a single design and no -o the stream goes to stdout.
+`flash` compiles one design and streams it to a serial port, `fleet`
+streams it to many ports at once. All of them exit with status 1 if any
+design or panel failed, so they can gate CI jobs.
+"""
+
+import argparse
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from binary_protocol import encode_command, probe_binary_support
+from cost_model import CostModel, COST_MODEL_FILE
+from design_compiler import arduino_code, expand_qr_codes
+from design_file import DESIGN_EXTENSION, read_design
+from serial_link import DEFAULT_WINDOW, encode_text
+from raster_upload import UPLOAD_MODES, plan_transfer
+
+DESIGN_SUFFIXES = (".json", DESIGN_EXTENSION)
+OUTPUT_SUFFIXES = {"stream": ".txt", "arduino": ".ino.txt"}
+
+
+def find_designs(paths):
+    """Design files named by `paths`, expanding directories (not recursively)"""
+    designs = []
+    for path in paths:
+        if os.path.isdir(path):
+            designs.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                  if name.lower().endswith(DESIGN_SUFFIXES)))
+        else:
+            designs.append(path)
+    return designs
+
+
+def compile_design_file(path, fmt="stream", cull=True, clip=False, background=(0, 0, 0), mode="vector",
+                        encoder=encode_text):
+    """Load a design file and return (output lines, summary).
+
+    `mode` and `encoder` choose between vector commands and raster blits as
+    in raster_upload.plan_transfer().
+    """
+    items = read_design(path)
+    if fmt == "arduino":
+        lines = arduino_code(items)
+        return lines, f"{len(items)} items -> {len(lines)} statements"
+    plan = plan_transfer(items, mode=mode, cull=cull, clip=clip, background=background, encoder=encoder)
+    if plan.mode == "vector":
+        return plan.commands, f"{len(items)} items -> {plan.vector_plan.summary()}"
+    return plan.commands, f"{len(items)} items -> {plan.summary()}"
+
+
+def output_path(source, target, fmt):
+    stem = os.path.basename(source)
+    for suffix in DESIGN_SUFFIXES:
+        if stem.lower().endswith(suffix):
+            stem = stem[:-len(suffix)]
+    return os.path.join(target, stem + OUTPUT_SUFFIXES[fmt])
+
+
+def _compile_job(source, target, fmt, cull, clip, background, mode):
+    """Process pool entry point; returns (source, summary or None, error or None)"""
+    start = time.perf_counter()
+    try:
+        lines, summary = compile_design_file(source, fmt, cull, clip, background, mode)
+        with open(target, "w") as f:
+            f.writelines(line + "\n" for line in lines)
+    except Exception as e:
+        return source, None, str(e)
+    return source, f"{summary} in {time.perf_counter() - start:.2f} s", None
+
+
+def compile_command(args):
+    sources = find_designs(args.designs)
+    if not sources:
+        print("No designs found", file=sys.stderr)
+        return 1
+    background = tuple(args.background)
+
+    # A single design without an output path goes to stdout
+    if len(sources) == 1 and not args.output:
+        try:
+            lines, summary = compile_design_file(sources[0], args.format, not args.no_cull, args.clip, background,
+                                                 args.mode)
+        except Exception as e:
+            print(f"{sources[0]}: error: {e}", file=sys.stderr)
+            return 1
+        sys.stdout.writelines(line + "\n" for line in lines)
+        print(f"{sources[0]}: {summary}", file=sys.stderr)
+        return 0
+
+    if len(sources) == 1 and not os.path.isdir(args.output) and not args.output.endswith(os.sep):
+        targets = [args.output]
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        targets = [output_path(source, args.output, args.format) for source in sources]
+
+    jobs = [(source, target, args.format, not args.no_cull, args.clip, background, args.mode)
+            for source, target in zip(sources, targets)]
+    start = time.perf_counter()
+    if args.jobs == 1 or len(jobs) == 1:
+        results = [_compile_job(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(_compile_job, *zip(*jobs)))
+
+    failed = 0
+    for source, summary, error in results:
+        if error:
+            failed += 1
+            print(f"{source}: error: {error}", file=sys.stderr)
+        else:
+            print(f"{source}: {summary}", file=sys.stderr)
+    print(f"Compiled {len(results) - failed}/{len(results)} designs in {time.perf_counter() - start:.2f} s",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+def flash_command(args):
+    from link_setup import LinkSettings, link_sender, open_link, reset_link  # Only needed for flashing
+
+    # Blits are priced as the frames they will be sent in
+    lines, summary = compile_design_file(args.design, "stream", not args.no_cull, args.clip, tuple(args.background),
+                                         args.mode, encode_command if args.binary else encode_text)
+    print(f"{args.design}: {summary}", file=sys.stderr)
+
+    conn, link = open_link(args.port, args.baud, args.ready_timeout, LinkSettings())
+    print(f"Link: {link.summary()}, {link.device.summary()}", file=sys.stderr)
+    try:
+        if link.device.supports("bitmap"):
+            lines = expand_qr_codes(lines)
+        encoder = encode_text
+        if args.binary:
+            binary = link.device.supports("bin")
+            if binary if binary is not None else probe_binary_support(conn):
+                encoder = encode_command
+            else:
+                print("Firmware has no binary protocol, using text commands", file=sys.stderr)
+        model = CostModel(COST_MODEL_FILE)
+        print(f"Estimated {model.estimate(lines, encoder, link.baud).summary()}", file=sys.stderr)
+
+        def progress(acked, total, response):
+            if acked == total or acked % 100 == 0:
+                print(f"\r{acked}/{total} commands", end="", file=sys.stderr)
+
+        stats = link_sender(conn, link, args.window, encoder).send(lines, progress)
+        print(file=sys.stderr)
+    finally:
+        reset_link(conn)
+        conn.close()
+
+    print(f"Sent {stats.summary()}, {stats.errors} errors", file=sys.stderr)
+    # Repaired commands were timed together with their repair
+    if not stats.errors and not stats.retransmits and model.calibrate(lines, stats, encoder, link.baud):
+        try:
+            model.save()
+        except OSError as e:
+            print(f"Could not save the cost model: {e}", file=sys.stderr)
+    return 1 if stats.errors else 0
+
+
+def fleet_command(args):
+    from fleet import FleetUpload, FleetState, FLEET_STATE  # Only needed for flashing
+
+    lines, summary = compile_design_file(args.design, "stream", not args.no_cull, args.clip, tuple(args.background),
+                                         args.mode, encode_command if args.binary else encode_text)
+    print(f"{args.design}: {summary}", file=sys.stderr)
+
+    fleet = FleetUpload(args.ports, lines, args.baud, args.window, args.binary, args.retries,
+                        args.ready_timeout, FleetState(args.state or FLEET_STATE), args.force).start()
+    while fleet.running() or not fleet.events.empty():
+        try:
+            kind, port, *rest = fleet.events.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if kind == "retry":
+            print(f"{port}: attempt {rest[0]} failed ({rest[1]}), retrying", file=sys.stderr)
+        elif kind == "failed":
+            print(f"{port}: failed: {rest[0]}", file=sys.stderr)
+        elif kind in ("done", "skipped"):
+            print(f"{port}: {kind}", file=sys.stderr)
+    try:
+        fleet.wait()
+    except OSError as e:
+        print(f"Could not save the fleet state: {e}", file=sys.stderr)
+    print(fleet.summary(), file=sys.stderr)
+    return 1 if fleet.failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile and flash SerialCommandDesigner designs without a display")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_compile_options(sub):
+        sub.add_argument("--no-cull", action="store_true", help="keep items hidden behind others")
+        sub.add_argument("--clip", action="store_true", help="clip partly hidden rectangles")
+        sub.add_argument("--background", type=int, nargs=3, default=[0, 0, 0], metavar=("R", "G", "B"))
+        sub.add_argument("--mode", choices=UPLOAD_MODES, default="vector",
+                         help="vector commands, raster blits (needs blit firmware) or the cheaper of them (auto)")
+
+    sub = commands.add_parser("compile", help="write the command stream of designs to files")
+    sub.add_argument("designs", nargs="+", help="design files or directories of designs")
+    sub.add_argument("-o", "--output", help="output file (one design) or directory")
+    sub.add_argument("--format", choices=sorted(OUTPUT_SUFFIXES), default="stream",
+                     help="device command stream or exported sketch code")
+    sub.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    add_compile_options(sub)
+    sub.set_defaults(handler=compile_command)
+
+    sub = commands.add_parser("flash", help="stream a design to a panel")
+    sub.add_argument("design")
+    sub.add_argument("--port", required=True)
+    sub.add_argument("--baud", type=int, default=115200, help="negotiated with the sketch if not 115200")
+    sub.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    sub.add_argument("--binary", action="store_true", help="use binary frames if the firmware supports them")
+    sub.add_argument("--ready-timeout", type=float, default=5.0, help="seconds to wait for the sketch to answer")
+    add_compile_options(sub)
+    sub.set_defaults(handler=flash_command)
+
+    sub = commands.add_parser("fleet", help="stream a design to many panels concurrently")
+    sub.add_argument("design")
+    sub.add_argument("--ports", nargs="+", required=True)
+    sub.add_argument("--baud", type=int, default=115200, help="negotiated with the sketch if not 115200")
+    sub.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    sub.add_argument("--binary", action="store_true", help="use binary frames if the firmware supports them")
+    sub.add_argument("--ready-timeout", type=float, default=5.0, help="seconds to wait for each sketch to answer")
+    sub.add_argument("--retries", type=int, default=2, help="extra attempts per panel")
+    sub.add_argument("--state", help="file remembering what each panel shows (default: in the home directory)")
+    sub.add_argument("--force", action="store_true", help="also upload to panels that already show the design")
+    add_compile_options(sub)
+    sub.set_defaults(handler=fleet_command)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""Emulates the SerialCommandDesigner sketch on a pseudo-terminal.
+
+Speaks the same text and binary protocol as SerialCommandDesigner.ino,
+answers with the same response lines and renders into a rasterizer
+Framebuffer, so the designer and the upload code can be exercised without
+an ESP32. POSIX only (uses the pty module). Every GFXfont header that
+gfx_font.py finds counts as built into the emulated sketch.
+
+    python device_emulator.py --baud 115200 --command-delay 0.2
+
+then connect the designer to the printed port (or EMULATOR_PORT).
+"""
+
+import argparse
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+from binary_protocol import FRAME_SPECS, FRAME_SYNC, FRAME_SYNC_SEQ, OPCODES, decode_frame_seq
+from item_geometry import qr_version_for
+from rasterizer import Framebuffer, split_command
+from serial_link import ACK_RESPONSES, EMULATOR_PORT, ERR_UNKNOWN, ERR_FORMAT, ERR_FRAME, ERR_DATA
+
+BANNER = [
+    "Serial command interface ready!",
+    "Available commands (format: command|param1|param2|...):",
+    "  prt|text|x|y|size[|font]  (font: name of a GFXfont built into the sketch)",
+    "  clear|r|g|b",
+    "  setColor|r|g|b",
+    "  drawQRCode|data|x|y|moduleSize|bgR|bgG|bgB|fgR|fgG|fgB",
+    "  drawFillRect|x|y|w|h",
+    "  drawRect|x|y|w|h",
+    "  drawLine|x0|y0|x1|y1",
+    "  drawFillCircle|x|y|radius",
+    "  drawCircleOutline|x|y|radius",
+    "  drawTriangle|x0|y0|x1|y1|x2|y2",
+    "  drawFillTriangle|x0|y0|x1|y1|x2|y2",
+    "  drawRoundRect|x|y|w|h|radius",
+    "  drawFillRoundRect|x|y|w|h|radius",
+    "  drawEllipse|x|y|rx|ry",
+    "  drawFillEllipse|x|y|rx|ry",
+    "  flush",
+    "  blit|x|y|count|hexdata  (RLE pixels into one physical canvas row)",
+    "  drawBitmap|x|y|width|scale|hexdata  (1-bpp rows, set bits in the current color)",
+    "  proto|bin  (binary frames starting with 0xA5 are accepted at any time)",
+    "  link|baud  (switch the serial rate, confirm with link|confirm at the new rate)",
+    "  ping|payload",
+    "  version",
+    "  #seq|command  (answered with ok seq or err seq code)",
+]
+
+FIRMWARE_VERSION = "1.6"
+FIRMWARE_CAPABILITIES = "bin,blit,bitmap,font,link,ping,seq"
+
+# Answers to commands whose data the sketch rejects
+DATA_ERRORS = {"drawBitmap": "Bad bitmap data", "prt": "Unknown font"}
+
+# Stream::setTimeout() default used by readStringUntil() and readBytes()
+STREAM_TIMEOUT = 1.0
+
+# Link negotiation constants of the sketch
+MAX_LINK_BAUD = 2000000
+RX_BUFFER_SIZE = 1024
+LINK_CONFIRM_TIMEOUT = 0.3
+
+
+class DeviceEmulator:
+    """The sketch's processSerialCommand() loop on the master side of a pty.
+
+    `command_delay` and `flush_delay` (seconds) are added after every
+    command and every flush to model drawing time. With `baudrate` set,
+    both directions are throttled to 10 bits per byte at that rate, which
+    follows "link|<baud>" switches. Rates above `max_link_baud` model a
+    cable that cannot carry them: input arrives garbled until the sketch
+    falls back to the previous rate. `boot_delay` models a board that resets
+    when the port is opened: input is lost until the banner is printed.
+    `corrupt_rate` is the chance that a chunk of input gets one byte
+    flipped, to exercise recovery from line noise.
+    """
+
+    def __init__(self, command_delay=0.0, flush_delay=0.0, baudrate=None, link=None,
+                 banner=True, framebuffer=None, max_link_baud=MAX_LINK_BAUD, boot_delay=0.0,
+                 corrupt_rate=0.0, seed=None):
+        self.command_delay = command_delay
+        self.flush_delay = flush_delay
+        self.baudrate = baudrate
+        self.max_link_baud = max_link_baud
+        self.boot_delay = boot_delay
+        self.link_baud = None  # Rate set by "link", None while at the boot rate
+        self._link_switch = None  # (previous rate, previous throttle, deadline) until confirmed
+        self._garbled = False
+        self.corrupt_rate = corrupt_rate
+        self._random = random.Random(seed)
+        self._seq = None  # Sequence number of the command being processed
+        self.link = link
+        self.banner = banner
+        self.framebuffer = framebuffer or Framebuffer()
+        self.commands = 0
+        self.errors = 0
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self._buffer = bytearray()
+        self._waiting_since = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.link:
+            if os.path.islink(self.link):
+                os.unlink(self.link)
+            os.symlink(self.port, self.link)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _throttle(self, nbytes):
+        if self.baudrate:
+            time.sleep(nbytes * 10 / self.baudrate)
+
+    def _write_line(self, line):
+        data = (line + "\r\n").encode()
+        self._throttle(len(data))
+        os.write(self.master_fd, data)
+
+    def _boot(self):
+        booted = time.perf_counter() + self.boot_delay
+        while time.perf_counter() < booted and not self._stop.is_set():
+            ready, _, _ = select.select([self.master_fd], [], [], 0.01)
+            if ready:
+                os.read(self.master_fd, 4096)  # Nobody is listening yet
+        if self.banner:
+            for line in BANNER:
+                self._write_line(line)
+
+    def _run(self):
+        self._boot()
+        # Read in small chunks when throttled so the host sees back-pressure
+        chunk = 64 if self.baudrate else 4096
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master_fd], [], [], 0.05)
+            if ready:
+                try:
+                    data = os.read(self.master_fd, chunk)
+                except OSError:
+                    continue
+                self._throttle(len(data))
+                if self._garbled:
+                    data = bytes(byte ^ 0x5A for byte in data)
+                elif data and self._random.random() < self.corrupt_rate:
+                    data = bytearray(data)
+                    data[self._random.randrange(len(data))] ^= 1 << self._random.randrange(8)
+                self._buffer += data
+            if self._link_switch and time.perf_counter() > self._link_switch[2]:
+                self._revert_link()
+            self._process()
+
+    def _process(self):
+        while self._buffer:
+            if self._buffer[0] in (FRAME_SYNC, FRAME_SYNC_SEQ):
+                done = self._process_frame()
+            else:
+                done = self._process_line()
+            if not done:
+                return
+            self._waiting_since = None
+
+    def _reply(self, text):
+        self._write_line(text if self._seq is None else f"ok {self._seq}")
+
+    def _reply_error(self, code, text):
+        self.errors += 1
+        self._write_line(text if self._seq is None else f"err {self._seq} {code}")
+
+    def _timed_out(self):
+        """True once incomplete input has waited longer than the Stream timeout"""
+        now = time.perf_counter()
+        if self._waiting_since is None:
+            self._waiting_since = now
+        return now - self._waiting_since >= STREAM_TIMEOUT
+
+    def _process_line(self):
+        end = self._buffer.find(b"\n")
+        if end == -1:
+            if not self._timed_out():
+                return False
+            end = len(self._buffer)
+        line = bytes(self._buffer[:end]).decode(errors="replace")
+        del self._buffer[:end + 1]
+        if self._link_switch:
+            self._confirm_link(line.strip())
+            return True
+        self._seq = None
+        line = line.strip()
+        if line.startswith("#"):
+            seq, separator, line = line[1:].partition("|")
+            if not separator:
+                self._reply_error(ERR_FORMAT, "Invalid command format")
+                return True
+            # String::toInt() reads the leading digits, 0 if there are none
+            digits = len(seq) - len(seq.lstrip("0123456789"))
+            self._seq = int(seq[:digits] or 0) & 0xFF
+        self._respond(split_command(line))
+        return True
+
+    def _switch_link(self, value):
+        try:
+            baud = int(value)
+        except ValueError:
+            baud = 0
+        if not 9600 <= baud <= MAX_LINK_BAUD:
+            self._write_line("Link refused")
+            return
+        self._write_line(f"Link switching|{baud}|{RX_BUFFER_SIZE}")
+        self._link_switch = (self.link_baud, self.baudrate, time.perf_counter() + LINK_CONFIRM_TIMEOUT)
+        self.link_baud = baud
+        if self.baudrate:
+            self.baudrate = baud
+        self._garbled = baud > self.max_link_baud
+
+    def _confirm_link(self, line):
+        if line == "link|confirm" and not self._garbled:
+            self._link_switch = None
+            self._write_line("Link confirmed")
+        else:
+            self._revert_link()
+
+    def _revert_link(self):
+        self.link_baud, self.baudrate, _ = self._link_switch
+        self._link_switch = None
+        self._garbled = False
+
+    def _skip_to_next_frame(self):
+        starts = [start for start in (self._buffer.find(bytes([sync])) for sync in (FRAME_SYNC, FRAME_SYNC_SEQ))
+                  if start != -1]
+        del self._buffer[:min(starts) if starts else len(self._buffer)]
+
+    def _process_frame(self):
+        head = 2 if self._buffer[0] == FRAME_SYNC_SEQ else 1  # Opcode position
+        self._seq = self._buffer[1] if head == 2 and len(self._buffer) > 1 else None
+        try:
+            parts, length, _ = decode_frame_seq(self._buffer)
+        except ValueError as e:
+            if str(e) == "Bad frame opcode":
+                del self._buffer[:head + 1]
+            else:
+                # The whole frame was read before its CRC was checked
+                del self._buffer[:self._frame_length(head)]
+            self._reply_error(ERR_FRAME, str(e))
+            self._skip_to_next_frame()
+            return True
+        if parts is None:
+            if not self._timed_out():
+                return False
+            self._buffer.clear()
+            self._reply_error(ERR_FRAME, "Bad frame: truncated")
+            return True
+        del self._buffer[:length]
+        self._respond(parts)
+        return True
+
+    def _frame_length(self, head=1):
+        _, fmt, _, text_arg = FRAME_SPECS[OPCODES[self._buffer[head]]]
+        end = head + 1 + struct.calcsize(fmt)
+        if text_arg is not None:
+            end += 1 + self._buffer[end]
+        return end + 1
+
+    def _respond(self, parts):
+        if not parts:
+            self._reply_error(ERR_FORMAT, "Invalid command format")
+            return
+        cmd = parts[0]
+        if cmd == "drawQRCode" and len(parts) >= 11:
+            # Logged by JC3248W535EN::drawQRCode before it draws
+            version = qr_version_for(parts[1])
+            size = version * 4 + 17
+            self._write_line(f"QR code version {version}, size: {size}x{size}")
+        try:
+            executed = self.framebuffer.execute_parts(parts)
+        except ValueError:  # Only raised by blit, drawBitmap and prt with an unknown font
+            self._reply_error(ERR_DATA, DATA_ERRORS.get(cmd, "Bad blit data"))
+            return
+        if executed:
+            self.commands += 1
+            if self.command_delay:
+                time.sleep(self.command_delay)
+            if cmd == "flush" and self.flush_delay:
+                time.sleep(self.flush_delay)
+            response = ACK_RESPONSES[cmd]
+            self._reply(response + parts[1] if cmd == "prt" else response)
+        elif cmd == "proto" and len(parts) >= 2 and parts[1] == "bin":
+            self._reply("Binary frames supported")
+        elif cmd == "link" and len(parts) >= 2:
+            self._switch_link(parts[1])
+        elif cmd == "version":
+            self._write_line(f"Version {FIRMWARE_VERSION}|{FIRMWARE_CAPABILITIES}")
+        elif cmd == "ping":
+            self._reply(f"Pong {len(parts[1]) if len(parts) >= 2 else 0}")
+        else:
+            self._reply_error(ERR_UNKNOWN, "Unknown or incomplete command: " + cmd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate a JC3248W535EN running SerialCommandDesigner.ino")
+    parser.add_argument("--baud", type=int, default=None, help="throttle the link to this baud rate")
+    parser.add_argument("--command-delay", type=float, default=0.0, help="seconds added per command")
+    parser.add_argument("--boot-delay", type=float, default=0.0, help="seconds before the banner, input is lost")
+    parser.add_argument("--flush-delay", type=float, default=0.0, help="seconds added per flush")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="chance of a flipped bit per input chunk")
+    parser.add_argument("--link", default=EMULATOR_PORT, help="symlink pointing at the pty")
+    parser.add_argument("--png", help="save the framebuffer to this PNG file on exit")
+    args = parser.parse_args()
+
+    emulator = DeviceEmulator(args.command_delay, args.flush_delay, args.baud, args.link,
+                              boot_delay=args.boot_delay, corrupt_rate=args.corrupt_rate).start()
+    print(f"Emulating SerialCommandDesigner on {emulator.port} (linked as {args.link})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+        print(f"{emulator.commands} commands, {emulator.errors} errors")
+        if args.png:
+            emulator.framebuffer.save_png(args.png)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Undo/redo history of design edits, kept as compact deltas.
+
+Instead of copying the design on every edit, each edit is recorded as the
+smallest description that can be replayed both ways:
+
+    MoveDelta     items moved by (dx, dy)
+    FieldsDelta   fields of one item before and after (recolour, text, resize)
+    InsertDelta   items added at their list positions
+    DeleteDelta   items removed from their list positions
+    ClearDelta    the whole design removed by clearing the screen
+    LayerDelta    one item moved to another list position
+
+Deltas act on a target (the designer) through its move_item(),
+set_item_fields(), insert_items(), remove_items() and move_layer() methods,
+so undoing costs time in proportion to the edit, not to the design.
+Undoing a ClearDelta whose clear also went to the panel calls the target's
+screen_clear_undone(), as the panel stays blank until the next upload.
+Records with the same coalesce key (one mouse drag, a run of arrow key
+presses) merge into the previous entry when they touch the same items.
+
+The history holds at most max_bytes of estimated delta size, undo and redo
+stacks together; the oldest entries go first, but the newest entry always
+stays undoable.
+"""
+
+import sys
+from collections import deque
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+_REF_BYTES = 8  # One object reference
+_DELTA_BYTES = 64  # A delta object and its history entry
+
+
+def _value_bytes(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(v) for v in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + _value_bytes(v) for k, v in value.items())
+    return size
+
+
+def item_bytes(item):
+    """Rough memory held by an item that only the history keeps alive"""
+    size = sys.getsizeof(item) + sum(_value_bytes(getattr(item, key)) for key in item.FIELDS)
+    return size + (_value_bytes(item.extra) if item.extra else 0)
+
+
+class MoveDelta:
+    __slots__ = ("items", "dx", "dy")
+
+    def __init__(self, items, dx, dy):
+        self.items = tuple(items)
+        self.dx = dx
+        self.dy = dy
+
+    def undo(self, target):
+        for item in self.items:
+            target.move_item(item, -self.dx, -self.dy)
+        return self.items
+
+    def redo(self, target):
+        for item in self.items:
+            target.move_item(item, self.dx, self.dy)
+        return self.items
+
+    def merge(self, other):
+        """Fold a later delta into this one; False if they cannot be combined"""
+        if type(other) is not MoveDelta or len(other.items) != len(self.items):
+            return False
+        if any(a is not b for a, b in zip(self.items, other.items)):
+            return False
+        self.dx += other.dx
+        self.dy += other.dy
+        return True
+
+    def nbytes(self):
+        return _DELTA_BYTES + _REF_BYTES * len(self.items)
+
+    def describe(self):
+        return f"move of {len(self.items)} item(s)"
+
+
+class FieldsDelta:
+    __slots__ = ("item", "before", "after")
+
+    def __init__(self, item, before, after):
+        self.item = item
+        self.before = before  # {field: value} as it was
+        self.after = after
+
+    def undo(self, target):
+        target.set_item_fields(self.item, self.before)
+        return (self.item,)
+
+    def redo(self, target):
+        target.set_item_fields(self.item, self.after)
+        return (self.item,)
+
+    def merge(self, other):
+        if type(other) is not FieldsDelta or other.item is not self.item or other.after.keys() != self.after.keys():
+            return False
+        self.after = other.after
+        return True
+
+    def nbytes(self):
+        return _DELTA_BYTES + _value_bytes(self.before) + _value_bytes(self.after)
+
+    def describe(self):
+        return f"{', '.join(self.after)} change"
+
+
+class InsertDelta:
+    __slots__ = ("entries",)
+
+    def __init__(self, entries):
+        # (list index, item, stacking order) sorted by index
+        self.entries = sorted(entries, key=lambda entry: entry[0])
+
+    def undo(self, target):
+        target.remove_items(self.entries)
+        return ()
+
+    def redo(self, target):
+        target.insert_items(self.entries)
+        return tuple(item for _, item, _ in self.entries)
+
+    def merge(self, other):
+        return False
+
+    def nbytes(self):
+        return _DELTA_BYTES + sum(_REF_BYTES * 3 + item_bytes(item) for _, item, _ in self.entries)
+
+    def describe(self):
+        return f"insertion of {len(self.entries)} item(s)"
+
+
+class DeleteDelta(InsertDelta):
+    __slots__ = ()
+
+    def undo(self, target):
+        return InsertDelta.redo(self, target)
+
+    def redo(self, target):
+        return InsertDelta.undo(self, target)
+
+    def describe(self):
+        return f"deletion of {len(self.entries)} item(s)"
+
+
+class ClearDelta(DeleteDelta):
+    __slots__ = ("panel_cleared",)
+
+    def __init__(self, entries, panel_cleared):
+        DeleteDelta.__init__(self, entries)
+        self.panel_cleared = panel_cleared  # "clear" was sent to the panel as well
+
+    def undo(self, target):
+        items = DeleteDelta.undo(self, target)
+        if self.panel_cleared:
+            target.screen_clear_undone()
+        return items
+
+    def describe(self):
+        return f"screen clear of {len(self.entries)} item(s)"
+
+
+class LayerDelta:
+    __slots__ = ("old", "new")
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+
+    def undo(self, target):
+        return (target.move_layer(self.new, self.old),)
+
+    def redo(self, target):
+        return (target.move_layer(self.old, self.new),)
+
+    def merge(self, other):
+        return False
+
+    def nbytes(self):
+        return _DELTA_BYTES
+
+    def describe(self):
+        return "layer change"
+
+
+class _Entry:
+    __slots__ = ("delta", "key", "nbytes")
+
+    def __init__(self, delta, key):
+        self.delta = delta
+        self.key = key
+        self.nbytes = delta.nbytes()
+
+
+class EditHistory:
+    """Undo and redo stacks of deltas with a memory cap"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+        self.evicted = 0  # Entries dropped to stay under the cap
+        self._sealed = False  # The last entry may not absorb further records
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def record(self, delta, coalesce=None):
+        """Add an edit that has already been applied.
+
+        With a `coalesce` key equal to the one of the newest entry the delta
+        is merged into that entry if it touches the same items.
+        """
+        for entry in self.redo_stack:
+            self.nbytes -= entry.nbytes
+        self.redo_stack = []
+        if coalesce is not None and self.undo_stack and not self._sealed:
+            last = self.undo_stack[-1]
+            if last.key == coalesce and last.delta.merge(delta):
+                self.nbytes -= last.nbytes
+                last.nbytes = last.delta.nbytes()
+                self.nbytes += last.nbytes
+                self._evict()
+                return
+        entry = _Entry(delta, coalesce)
+        self.undo_stack.append(entry)
+        self.nbytes += entry.nbytes
+        self._sealed = False
+        self._evict()
+
+    def undo(self, target):
+        """Revert the newest edit on `target`; returns (description, items touched) or None"""
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        items = entry.delta.undo(target)
+        self.redo_stack.append(entry)
+        self._sealed = True
+        return entry.delta.describe(), items
+
+    def redo(self, target):
+        """Apply the newest undone edit again; returns (description, items touched) or None"""
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        items = entry.delta.redo(target)
+        self.undo_stack.append(entry)
+        self._sealed = True
+        return entry.delta.describe(), items
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.nbytes = 0
+        self._sealed = False
+
+    def _evict(self):
+        while len(self.undo_stack) > 1 and (
+                self.nbytes > self.max_bytes or (self.max_entries and len(self.undo_stack) > self.max_entries)):
+            self.nbytes -= self.undo_stack.popleft().nbytes
+            self.evicted += 1
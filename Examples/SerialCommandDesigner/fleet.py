@@ -0,0 +1,202 @@
+"""Push one compiled design to many panels at once.
+
+Every port gets its own thread, serial connection, retries and stats, so
+provisioning a rack takes about as long as the slowest panel. The hash of
+the command stream last completed on each port is kept in a small JSON
+state file; panels that already show the design are skipped.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from binary_protocol import encode_command, probe_binary_support
+from design_compiler import expand_qr_codes
+from link_setup import READY_TIMEOUT, link_sender, open_link, reset_link
+from serial_link import DEFAULT_WINDOW, TransferCancelled, encode_text
+
+FLEET_STATE = os.path.join(os.path.expanduser("~"), ".serial_command_designer_fleet.json")
+
+
+def design_hash(commands):
+    """Content hash of a command stream"""
+    digest = hashlib.sha1()
+    for command in commands:
+        digest.update(command.strip().encode() + b"\n")
+    return digest.hexdigest()
+
+
+class FleetState:
+    """Port -> hash of the design it was last provisioned with, persisted as JSON"""
+
+    def __init__(self, path=FLEET_STATE):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self.panels = json.load(f)
+        except (OSError, ValueError):
+            self.panels = {}
+
+    def shows(self, port, digest):
+        return self.panels.get(port, {}).get("design") == digest
+
+    def record(self, port, digest):
+        with self.lock:
+            if digest is None:
+                self.panels.pop(port, None)
+            else:
+                self.panels[port] = {"design": digest, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+    def save(self):
+        with self.lock:
+            with open(self.path, "w") as f:
+                json.dump(self.panels, f, indent=4)
+
+
+class PanelUpload(threading.Thread):
+    """Uploads the command stream to one port, retrying the whole transfer on failure.
+
+    Posts ("progress", port, acked, total), ("retry", port, attempt, message),
+    ("done", port, stats) and ("failed", port, message) on `events`.
+    """
+
+    def __init__(self, port, commands, events, baud=115200, window=DEFAULT_WINDOW, binary=False,
+                 retries=2, ready_timeout=READY_TIMEOUT, cancel=None):
+        super().__init__(daemon=True)
+        self.port = port
+        self.commands = commands
+        self.events = events
+        self.baud = baud
+        self.window = window
+        self.binary = binary
+        self.retries = retries
+        self.ready_timeout = ready_timeout
+        self.cancel = cancel or threading.Event()
+        self.status = "pending"
+        self.attempts = 0
+        self.stats = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def run(self):
+        start = time.perf_counter()
+        self.status = "running"
+        while not self.cancel.is_set():
+            self.attempts += 1
+            try:
+                self.stats = self._upload()
+            except TransferCancelled:
+                self.status, self.error = "cancelled", "Cancelled"
+                self.events.put(("failed", self.port, self.error))
+                break
+            except Exception as e:
+                self.error = str(e)
+                if self.attempts > self.retries or self.cancel.is_set():
+                    self.status = "failed"
+                    self.events.put(("failed", self.port, self.error))
+                    break
+                self.events.put(("retry", self.port, self.attempts, self.error))
+                self.cancel.wait(min(0.5 * 2 ** (self.attempts - 1), 5.0))
+            else:
+                self.status = "failed" if self.stats.errors else "done"
+                self.events.put(("done", self.port, self.stats))
+                break
+        else:
+            self.status, self.error = "cancelled", "Cancelled"
+            self.events.put(("failed", self.port, self.error))
+        self.elapsed = time.perf_counter() - start
+
+    def _upload(self):
+        conn, link = open_link(self.port, self.baud, self.ready_timeout)
+        try:
+            encoder = encode_text
+            binary = link.device.supports("bin")
+            if self.binary and (binary if binary is not None else probe_binary_support(conn)):
+                encoder = encode_command
+
+            def progress(acked, total, response):
+                self.events.put(("progress", self.port, acked, total))
+
+            commands = expand_qr_codes(self.commands) if link.device.supports("bitmap") else self.commands
+            sender = link_sender(conn, link, self.window, encoder)
+            return sender.send(commands, progress, self.cancel)
+        finally:
+            reset_link(conn)
+            conn.close()
+
+    def summary(self):
+        if self.status == "skipped":
+            return f"{self.port}: already up to date"
+        if self.stats is not None and self.status == "done":
+            return (f"{self.port}: done in {self.elapsed:.2f} s, {self.attempts} attempt(s), "
+                    f"{self.stats.summary()}, p99 ack {self.stats.round_trip_percentile(99) * 1000:.1f} ms")
+        if self.stats is not None:
+            return f"{self.port}: {self.stats.errors} rejected command(s), {self.stats.summary()}"
+        return f"{self.port}: {self.status} after {self.attempts} attempt(s): {self.error}"
+
+
+class FleetUpload:
+    """Fans one command stream out to many ports concurrently.
+
+    start() launches a PanelUpload per port that does not already show the
+    design; wait() joins them, records the panels that succeeded in the
+    fleet state and returns the uploads in port order.
+    """
+
+    def __init__(self, ports, commands, baud=115200, window=DEFAULT_WINDOW, binary=False,
+                 retries=2, ready_timeout=READY_TIMEOUT, state=None, force=False):
+        self.commands = list(commands)
+        self.digest = design_hash(self.commands)
+        self.state = state
+        self.force = force
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.uploads = [PanelUpload(port, self.commands, self.events, baud, window, binary,
+                                    retries, ready_timeout, self.cancel_event) for port in ports]
+        self.elapsed = 0.0
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        for upload in self.uploads:
+            if not self.force and self.state is not None and self.state.shows(upload.port, self.digest):
+                upload.status = "skipped"
+                self.events.put(("skipped", upload.port, None))
+            else:
+                upload.start()
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def running(self):
+        return any(upload.is_alive() for upload in self.uploads)
+
+    def wait(self):
+        for upload in self.uploads:
+            if upload.status != "skipped":
+                upload.join()
+        self.elapsed = time.perf_counter() - self._start
+        if self.state is not None:
+            for upload in self.uploads:
+                if upload.status == "done":
+                    self.state.record(upload.port, self.digest)
+                elif upload.status != "skipped":
+                    self.state.record(upload.port, None)  # Panel content unknown now
+            self.state.save()
+        return self.uploads
+
+    @property
+    def failed(self):
+        return [upload for upload in self.uploads if upload.status not in ("done", "skipped")]
+
+    def summary(self):
+        lines = [upload.summary() for upload in self.uploads]
+        slowest = max((upload.elapsed for upload in self.uploads), default=0.0)
+        lines.append(f"{len(self.uploads) - len(self.failed)}/{len(self.uploads)} panels provisioned in "
+                     f"{self.elapsed:.2f} s (slowest panel {slowest:.2f} s)")
+        return "\n".join(lines)
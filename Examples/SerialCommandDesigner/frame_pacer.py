@@ -0,0 +1,61 @@
+import time
+
+from serial_link import percentile
+
+# One update per frame of a 60 Hz display
+FRAME_INTERVAL_MS = 16
+
+
+class MotionCoalescer:
+    """Collapses bursts of motion events into at most one update per frame.
+
+    push() only remembers the latest event; `handler` runs with it once per
+    frame interval, after which the widget is painted. The time from the
+    first event of a frame to the end of that paint is recorded in
+    `latencies` (seconds).
+    """
+
+    def __init__(self, widget, handler, interval_ms=FRAME_INTERVAL_MS):
+        self.widget = widget
+        self.handler = handler
+        self.interval = interval_ms / 1000
+        self.pending = None
+        self.pending_since = None
+        self.after_id = None
+        self.last_frame = 0.0
+        self.reset()
+
+    def reset(self):
+        self.events = 0
+        self.frames = 0
+        self.latencies = []
+
+    def push(self, event):
+        now = time.perf_counter()
+        self.events += 1
+        if self.pending is None:
+            self.pending_since = now
+        self.pending = event
+        if self.after_id is None:
+            delay = max(0.0, self.last_frame + self.interval - now)
+            self.after_id = self.widget.after(int(delay * 1000), self.flush)
+
+    def flush(self):
+        """Apply the pending event now, e.g. before the button is released"""
+        if self.after_id is not None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+        if self.pending is None:
+            return
+        event, since = self.pending, self.pending_since
+        self.pending = None
+        self.handler(event)
+        self.widget.update_idletasks()  # Paint now so the latency includes the redraw
+        self.last_frame = time.perf_counter()
+        self.latencies.append(self.last_frame - since)
+        self.frames += 1
+
+    def summary(self):
+        return (f"{self.events} motion events in {self.frames} frames, event-to-paint latency "
+                f"p50 {percentile(self.latencies, 50) * 1000:.1f} ms, "
+                f"p99 {percentile(self.latencies, 99) * 1000:.1f} ms")
@@ -0,0 +1,344 @@
+"""Adafruit GFX fonts for exact text preview and bounds.
+
+The sketch prints with Arduino_GFX: the classic 5x7 font from glcdfont.h,
+or a GFXfont header made with fontconvert or truetype2gfx (for example
+Examples/CustomFonts/Roboto_Regular16pt7b.h) when a text item names one.
+Both load into GFXFont objects that lay text out like Arduino_GFX::write(),
+wrapping at the right edge included, so the designer can draw text pixel
+for pixel and give it a tight bounding box.
+
+A font is named after its GFXfont variable, which is also the header's
+file name; <name>.h is looked up in the folders of GFXFONT_PATH and then
+in FONT_DIRS. Parsing a large header is slow, so parsed fonts are kept in
+FONT_CACHE and only re-read when the header changes. Scaled glyph masks
+are kept per font and text size in the font's atlas.
+"""
+
+import glob
+import json
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from item_geometry import SCREEN_WIDTH, CHAR_WIDTH, CHAR_HEIGHT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FONT_DIRS = [HERE, os.path.join(HERE, "..", "CustomFonts")]
+FONT_CACHE = os.path.join(os.path.expanduser("~"), ".serial_command_designer_fonts.json")
+
+GLCDFONT_CANDIDATES = [
+    "~/Arduino/libraries/GFX_Library_for_Arduino/src/font/glcdfont.h",
+    "~/Documents/Arduino/libraries/GFX_Library_for_Arduino/src/font/glcdfont.h",
+    "~/Arduino/libraries/*/src/font/glcdfont.h",
+    "~/Documents/Arduino/libraries/*/src/font/glcdfont.h",
+]
+
+_COMMENTS = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_NUMBER = re.compile(r"[+-]?(?:0[xX][0-9a-fA-F]+|\d+)")
+
+
+def _c_int(text):
+    """Value of a C integer literal (decimal or hex)"""
+    text = text.strip()
+    sign = -1 if text.startswith("-") else 1
+    text = text.lstrip("+-")
+    return sign * (int(text, 16) if text[:2] in ("0x", "0X") else int(text))
+
+
+def load_classic_font(path=None):
+    """Glyph bytes (5 per character) of the classic GFX font, or None"""
+    candidates = [path] if path else [os.environ.get("GLCDFONT_PATH")] + GLCDFONT_CANDIDATES
+    for candidate in candidates:
+        if not candidate:
+            continue
+        for file_path in glob.glob(os.path.expanduser(candidate)):
+            with open(file_path) as f:
+                source = f.read()
+            match = re.search(r"font\[\]\s*(?:PROGMEM)?\s*=\s*\{(.*?)\};", source, re.S)
+            if match:
+                body = _COMMENTS.sub("", match.group(1))
+                values = [_c_int(v) for v in _NUMBER.findall(body)]
+                if len(values) >= 256 * 5:
+                    return bytes(values[:256 * 5])
+    return None
+
+
+class Glyph:
+    __slots__ = ("offset", "width", "height", "x_advance", "x_offset", "y_offset")
+
+    def __init__(self, offset, width, height, x_advance, x_offset, y_offset):
+        self.offset = offset  # First byte of the glyph in the font bitmap
+        self.width = width
+        self.height = height
+        self.x_advance = x_advance
+        self.x_offset = x_offset  # From the cursor to the glyph's top left
+        self.y_offset = y_offset
+
+
+class GFXFont:
+    """Glyph tables of one font, laid out the way Arduino_GFX prints.
+
+    `bitmap` holds the glyph bits packed row after row without padding, as
+    in GFXfont headers. The classic font is stored the same way; its cursor
+    is the top left of the character cell instead of a point on the baseline.
+    """
+
+    def __init__(self, name, bitmap, glyphs, first, last, y_advance, classic=False, placeholder=False):
+        self.name = name
+        self.bitmap = bytes(bitmap)
+        self.glyphs = [glyph if isinstance(glyph, Glyph) else Glyph(*glyph) for glyph in glyphs]
+        self.first = first
+        self.last = last
+        self.y_advance = y_advance
+        self.classic = classic
+        self.placeholder = placeholder  # Classic font without glcdfont.h: glyphs are blocks
+        self._masks = {}  # Glyph index -> unscaled mask
+        self._atlas = {}  # (glyph index, size) -> scaled mask
+        self._ink = {}  # Glyph index -> box of the set bits, None if blank
+
+    @classmethod
+    def classic_glyphs(cls, font_bytes=None):
+        """The classic font from glcdfont.h bytes; without them every glyph but space is a 5x7 block"""
+        columns = np.zeros((256, 5), dtype=np.uint8)
+        if font_bytes is not None:
+            columns[:] = np.frombuffer(font_bytes[:256 * 5], dtype=np.uint8).reshape(256, 5)
+        else:
+            columns[:] = 0x7F
+            columns[ord(' ')] = 0
+        # Columns hold the rows as bits, lowest bit on top
+        rows = (columns[:, None, :] >> np.arange(8, dtype=np.uint8)[None, :, None]) & 1
+        bitmap = np.packbits(rows.reshape(256, 40), axis=1).tobytes()
+        glyphs = [(code * 5, 5, 8, CHAR_WIDTH, 0, 0) for code in range(256)]
+        return cls("", bitmap, glyphs, 0, 255, CHAR_HEIGHT, classic=True, placeholder=font_bytes is None)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], bytes.fromhex(data["bitmap"]), data["glyphs"], data["first"], data["last"],
+                   data["y_advance"])
+
+    def to_dict(self):
+        glyphs = [[g.offset, g.width, g.height, g.x_advance, g.x_offset, g.y_offset] for g in self.glyphs]
+        return {"name": self.name, "bitmap": self.bitmap.hex(), "glyphs": glyphs, "first": self.first,
+                "last": self.last, "y_advance": self.y_advance}
+
+    def glyph_index(self, code):
+        """Index of the glyph Arduino_GFX draws for byte `code`, or None"""
+        if self.classic:
+            return (code + 1) % 256 if code >= 176 else code  # cp437 compatibility is off
+        if self.first <= code <= self.last:
+            return code - self.first
+        return None
+
+    def mask(self, index):
+        """Boolean height x width array of a glyph"""
+        mask = self._masks.get(index)
+        if mask is None:
+            glyph = self.glyphs[index]
+            count = glyph.width * glyph.height
+            bits = np.unpackbits(np.frombuffer(self.bitmap, dtype=np.uint8, count=(count + 7) // 8,
+                                               offset=glyph.offset))
+            mask = self._masks[index] = bits[:count].reshape(glyph.height, glyph.width).astype(bool)
+        return mask
+
+    def scaled_mask(self, index, size):
+        """Glyph mask blown up to text size `size`, from the atlas"""
+        mask = self._atlas.get((index, size))
+        if mask is None:
+            mask = self.mask(index)
+            if size > 1:
+                mask = np.kron(mask, np.ones((size, size), dtype=bool))
+            self._atlas[(index, size)] = mask
+        return mask
+
+    def ink(self, index):
+        """(x1, y1, x2, y2) of the set bits of a glyph relative to its top left, None if blank"""
+        if index not in self._ink:
+            glyph = self.glyphs[index]
+            mask = self.mask(index) if glyph.width and glyph.height else np.zeros((0, 0), dtype=bool)
+            if mask.any():
+                rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+                self._ink[index] = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+            else:
+                self._ink[index] = None
+        return self._ink[index]
+
+    def layout(self, text, x, y, size, width=SCREEN_WIDTH):
+        """(glyph index, left, top) of every glyph println(text) draws from cursor (x, y)"""
+        size = size if size > 0 else 1
+        placed = []
+        cursor_x, cursor_y = x, y
+        for c in text.encode():
+            if c == ord('\n'):
+                cursor_x, cursor_y = 0, cursor_y + self.y_advance * size
+                continue
+            if c == ord('\r'):
+                continue
+            index = self.glyph_index(c)
+            if index is None:
+                continue
+            glyph = self.glyphs[index]
+            if self.classic:
+                if cursor_x + CHAR_WIDTH * size > width:
+                    cursor_x, cursor_y = 0, cursor_y + CHAR_HEIGHT * size
+                placed.append((index, cursor_x, cursor_y))
+            elif glyph.width and glyph.height:
+                if cursor_x + (glyph.x_offset + glyph.width) * size > width:
+                    cursor_x, cursor_y = 0, cursor_y + self.y_advance * size
+                placed.append((index, cursor_x + glyph.x_offset * size, cursor_y + glyph.y_offset * size))
+            cursor_x += glyph.x_advance * size
+        return placed
+
+    def text_bounds(self, text, x, y, size, width=SCREEN_WIDTH):
+        """Tight box (x1, y1, x2, y2) of the pixels printed, empty at (x, y) for blank text"""
+        size = size if size > 0 else 1
+        box = None
+        for index, left, top in self.layout(text, x, y, size, width):
+            ink = self.ink(index)
+            if ink is None:
+                continue
+            glyph_box = (left + ink[0] * size, top + ink[1] * size, left + ink[2] * size, top + ink[3] * size)
+            box = glyph_box if box is None else (min(box[0], glyph_box[0]), min(box[1], glyph_box[1]),
+                                                 max(box[2], glyph_box[2]), max(box[3], glyph_box[3]))
+        return box or (x, y, x, y)
+
+    def render(self, text, x, y, size, width=SCREEN_WIDTH):
+        """((x1, y1), mask) of the printed pixels, mask covering text_bounds()"""
+        size = size if size > 0 else 1
+        x1, y1, x2, y2 = self.text_bounds(text, x, y, size, width)
+        mask = np.zeros((y2 - y1, x2 - x1), dtype=bool)
+        for index, left, top in self.layout(text, x, y, size, width):
+            ink = self.ink(index)
+            if ink is None:
+                continue
+            glyph = self.scaled_mask(index, size)[ink[1] * size:ink[3] * size, ink[0] * size:ink[2] * size]
+            top, left = top + ink[1] * size - y1, left + ink[0] * size - x1
+            mask[top:top + glyph.shape[0], left:left + glyph.shape[1]] |= glyph
+        return (x1, y1), mask
+
+
+def parse_gfxfont(source, name=None):
+    """GFXFont from the C source of a font header; the first GFXfont unless `name` is given.
+
+    Raises ValueError if the tables are missing or do not match.
+    """
+    source = _COMMENTS.sub("", source)
+    fonts = re.findall(r"GFXfont\s+(\w+)\s*(?:PROGMEM\s*)?=\s*\{(.*?)\}\s*;", source, re.S)
+    fonts = [(font_name, body) for font_name, body in fonts if name is None or font_name == name]
+    if not fonts:
+        raise ValueError(f"No GFXfont {name} in font header" if name else "No GFXfont in font header")
+    font_name, body = fonts[0]
+    # (uint8_t *)Bitmaps, (GFXglyph *)Glyphs, first, last, yAdvance
+    fields = [field.strip() for field in re.sub(r"\([^()]*\*\s*\)", "", body).split(",") if field.strip()]
+    if len(fields) < 5:
+        raise ValueError(f"Incomplete GFXfont {font_name}")
+    bitmap_name, glyphs_name = (re.sub(r"[&\s]|\[\s*0\s*\]", "", field) for field in fields[:2])
+    first, last, y_advance = (_c_int(field) for field in fields[2:5])
+
+    bitmap_match = re.search(r"uint8_t\s+" + re.escape(bitmap_name) + r"\s*\[\s*\]\s*(?:PROGMEM\s*)?=\s*\{(.*?)\}\s*;",
+                             source, re.S)
+    glyphs_match = re.search(r"GFXglyph\s+" + re.escape(glyphs_name) + r"\s*\[\s*\]\s*(?:PROGMEM\s*)?=\s*\{(.*?)\}\s*;",
+                             source, re.S)
+    if bitmap_match is None or glyphs_match is None:
+        raise ValueError(f"Tables of GFXfont {font_name} not found")
+    bitmap = bytes(_c_int(v) & 0xFF for v in _NUMBER.findall(bitmap_match.group(1)))
+    glyphs = [[_c_int(v) for v in _NUMBER.findall(entry)]
+              for entry in re.findall(r"\{([^{}]*)\}", glyphs_match.group(1))]
+    if len(glyphs) != last - first + 1 or any(len(glyph) != 6 for glyph in glyphs):
+        raise ValueError(f"Glyph table of GFXfont {font_name} does not match its character range")
+    for glyph in glyphs:
+        if glyph[0] + (glyph[1] * glyph[2] + 7) // 8 > len(bitmap):
+            raise ValueError(f"Glyph bitmap of GFXfont {font_name} out of range")
+    return GFXFont(font_name, bitmap, glyphs, first, last, y_advance)
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_font_file(path, name=None, cache_path=FONT_CACHE):
+    """parse_gfxfont() of a header file, through the on-disk cache"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = f"{name or ''}:{stat.st_size}:{stat.st_mtime_ns}"
+    cache = _read_cache(cache_path) if cache_path else {}
+    entry = cache.get(path)
+    if entry and entry.get("key") == key:
+        try:
+            return GFXFont.from_dict(entry["font"])
+        except (KeyError, TypeError, ValueError):
+            pass  # Written by something else, parse again
+    with open(path, "r", errors="replace") as f:
+        font = parse_gfxfont(f.read(), name)
+    if cache_path:
+        cache[path] = {"key": key, "font": font.to_dict()}
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(cache, f)
+        except OSError:
+            pass  # Only saves parsing next time
+    return font
+
+
+def font_dirs():
+    return [d for d in os.environ.get("GFXFONT_PATH", "").split(os.pathsep) if d] + FONT_DIRS
+
+
+def available_fonts():
+    """Names of the font headers found in font_dirs(), sorted"""
+    names = set()
+    for folder in font_dirs():
+        for file_path in glob.glob(os.path.join(os.path.expanduser(folder), "*.h")):
+            names.add(os.path.splitext(os.path.basename(file_path))[0])
+    return sorted(names)
+
+
+@lru_cache(maxsize=None)
+def find_font(name):
+    """GFXFont for the GFXfont variable `name`, or None if no readable header defines it"""
+    for folder in font_dirs():
+        file_path = os.path.join(os.path.expanduser(folder), name + ".h")
+        if os.path.isfile(file_path):
+            try:
+                return load_font_file(file_path, name)
+            except (OSError, ValueError):
+                continue
+    return None
+
+
+@lru_cache(maxsize=None)
+def classic_font():
+    """The font the sketch prints with when no font is named"""
+    return GFXFont.classic_glyphs(load_classic_font())
+
+
+def font_for(name):
+    """Font a text item with font `name` is previewed with; the classic font if it is unknown"""
+    return (find_font(name) if name else None) or classic_font()
+
+
+def text_bounds(text, x, y, size, font=None):
+    """Area touched by screen.prt() with `font` (a GFXfont name), including wrapping at the right edge"""
+    return font_for(font).text_bounds(text, x, y, size)
+
+
+def mask_rectangles(mask):
+    """(x1, y1, x2, y2) rectangles covering the set pixels of a mask: row runs, stacked over equal rows"""
+    rects = []
+    padded = np.pad(mask.astype(np.int8), ((0, 0), (1, 1)))
+    height = mask.shape[0]
+    y = 0
+    while y < height:
+        end = y + 1
+        while end < height and np.array_equal(mask[end], mask[y]):
+            end += 1
+        edges = np.diff(padded[y])
+        starts, stops = np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]
+        rects.extend((int(x1), y, int(x2), end) for x1, x2 in zip(starts, stops))
+        y = end
+    return rects
@@ -0,0 +1,69 @@
+SCREEN_WIDTH = 480
+SCREEN_HEIGHT = 320
+
+# Default Adafruit GFX font cell, scaled by the text size
+CHAR_WIDTH = 6
+CHAR_HEIGHT = 8
+
+# Shapes drawn through the rotated coordinate transform in the library can
+# land one pixel off their nominal position, so bounds are padded a little.
+BOUNDS_SLACK = 2
+
+
+def qr_version_for(data):
+    """QR version picked by JC3248W535EN::drawQRCode for this payload"""
+    length = len(data.encode())
+    if length > 195:
+        return 8
+    if length > 154:
+        return 6
+    if length > 114:
+        return 5
+    if length > 65:
+        return 4
+    return 3
+
+
+def qr_size(data, module_size):
+    return (qr_version_for(data) * 4 + 17) * module_size
+
+
+def device_rect(x, y, w, h):
+    """Area really covered by drawFillRect() and friends.
+
+    The library clamps the rotated rectangle by moving its origin instead of
+    shrinking it, so a rectangle hanging off the bottom or left edge is pushed
+    back onto the screen. Returns (x1, y1, x2, y2), x2/y2 exclusive; the result
+    is empty when the device draws nothing.
+    """
+    px = SCREEN_HEIGHT - (y + h)
+    py = x
+    pw = h
+    ph = w
+    if px < 0:
+        px = 0
+    if py < 0:
+        py = 0
+    if px + pw > SCREEN_HEIGHT:
+        pw = SCREEN_HEIGHT - px
+    if py + ph > SCREEN_WIDTH:
+        ph = SCREEN_WIDTH - py
+    return (py, SCREEN_HEIGHT - (px + pw), py + ph, SCREEN_HEIGHT - px)
+
+
+def clip_to_screen(rect):
+    x1, y1, x2, y2 = rect
+    return (max(0, x1), max(0, y1), min(SCREEN_WIDTH, x2), min(SCREEN_HEIGHT, y2))
+
+
+def rect_area(rect):
+    x1, y1, x2, y2 = rect
+    return max(0, x2 - x1) * max(0, y2 - y1)
+
+
+def rects_intersect(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def rect_union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
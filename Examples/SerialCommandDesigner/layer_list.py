@@ -0,0 +1,117 @@
+import tkinter as tk
+import tkinter.font as tkfont
+
+
+def describe_item(index, item):
+    desc = f"{index+1}. {item['type']}"
+
+    # Add details based on item type
+    if item['type'] == 'text':
+        desc += f" - '{item['text']}'"
+    elif item['type'] == 'qrcode':
+        desc += f" - '{item['data']}'"
+
+    # Add coordinates for all types
+    coords_str = ', '.join(map(str, item['coords'][:2]))
+    desc += f" at ({coords_str})"
+    return desc
+
+
+class LayerList:
+    """Virtualized layer list on top of a Listbox.
+
+    Only the rows that fit into the listbox exist as Tk items; scrolling
+    moves that window over the design. render() compares the window with
+    what is on screen and rewrites only the rows that changed, so updating
+    the list during a drag costs the same for 10 or 10,000 items.
+    `items` and `selected` are callables returning the item list and the
+    selected item.
+    """
+
+    def __init__(self, listbox, scrollbar, items, selected):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.items = items
+        self.selected = selected
+        self.offset = 0
+        self.rows = int(listbox.cget("height"))
+        self.texts = []  # Text of the rows currently in the listbox
+        self.row_height = tkfont.Font(font=listbox.cget("font")).metrics("linespace") + 1
+
+        scrollbar.config(command=self.yview)
+        listbox.bind("<Configure>", self.on_configure)
+        listbox.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        listbox.bind("<Button-4>", lambda e: self.scroll(-1))
+        listbox.bind("<Button-5>", lambda e: self.scroll(1))
+
+    def on_configure(self, event):
+        rows = max(1, event.height // self.row_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.render()
+
+    def index_of_row(self, row):
+        return self.offset + row
+
+    def selected_index(self):
+        """Design index of the selected row, or None"""
+        selection = self.listbox.curselection()
+        return self.index_of_row(selection[0]) if selection else None
+
+    def see(self, index):
+        """Scroll so the item at `index` is visible"""
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.rows:
+            self.offset = index - self.rows + 1
+        self.render()
+
+    def select(self, index):
+        self.see(index)
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(index - self.offset)
+
+    def scroll(self, rows):
+        self.offset += rows
+        self.render()
+        return "break"
+
+    def yview(self, *args):
+        """Scrollbar command: ("moveto", fraction) or ("scroll", n, "units"|"pages")"""
+        total = len(self.items())
+        if args[0] == "moveto":
+            self.offset = int(round(float(args[1]) * total))
+        elif args[0] == "scroll":
+            step = int(args[1]) * (self.rows if args[2] == "pages" else 1)
+            self.offset += step
+        self.render()
+
+    def render(self):
+        items = self.items()
+        total = len(items)
+        self.offset = max(0, min(self.offset, total - self.rows))
+        window = items[self.offset:self.offset + self.rows]
+        texts = [describe_item(self.offset + i, item) for i, item in enumerate(window)]
+
+        # Rewrite only the rows whose text changed
+        for row, text in enumerate(texts):
+            if row < len(self.texts):
+                if self.texts[row] == text:
+                    continue
+                self.listbox.delete(row)
+            self.listbox.insert(row, text)
+        if len(self.texts) > len(texts):
+            self.listbox.delete(len(texts), tk.END)
+        self.texts = texts
+
+        self.listbox.selection_clear(0, tk.END)
+        selected = self.selected()
+        for row, item in enumerate(window):
+            if item is selected:
+                self.listbox.selection_set(row)
+                break
+
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + len(window)) / total)
+        else:
+            self.scrollbar.set(0, 1)
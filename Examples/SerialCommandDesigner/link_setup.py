@@ -0,0 +1,296 @@
+"""Serial link setup with the sketch: readiness handshake and negotiation.
+
+wait_ready() replaces a fixed sleep after opening the port. It keeps asking
+"version" until the sketch answers, skipping the help banner setup() prints
+after a reset, so it returns within milliseconds when the board did not
+reset and right after boot when it did. The answer names the firmware
+version and its optional features as "Version <version>|<feature>,...",
+taken from FIRMWARE_VERSION and FIRMWARE_CAPABILITIES in the sketch;
+older sketches answer with an unknown command error instead.
+
+The sketch boots at BOOT_BAUD. "link|<baud>" makes it answer with
+"Link switching|<baud>|<rx buffer size>" and change rate; the host then
+switches too and sends "link|confirm", which the sketch must see within
+LINK_CONFIRM_TIMEOUT at the new rate or it goes back to the previous one.
+A short burst of pings measures the throughput actually reached, and the
+sketch's receive buffer size sets how many bytes the sender may keep in
+flight.
+
+negotiate_link() walks down from the requested rate until a rate confirms
+and passes the probe. The best working setting of every port is kept in
+LINK_STATE, so the next connection can ask for it straight away.
+"""
+
+import json
+import os
+import threading
+import time
+
+import serial
+
+from serial_link import (PipelinedSender, SequencedSender, SerialLinkError, DEFAULT_MAX_INFLIGHT_BYTES,
+                         DEFAULT_WINDOW, encode_text)
+
+READY_BANNER = "Serial command interface ready!"
+READY_TIMEOUT = 5.0
+VERSION_RETRY = 0.25
+QUIET_TIME = 0.1
+
+BOOT_BAUD = 115200
+LINK_SPEEDS = (9600, 19200, 38400, 57600, 115200, 230400, 460800, 921600, 1000000, 1500000, 2000000)
+LINK_CONFIRM_TIMEOUT = 0.3
+LINK_STATE = os.path.join(os.path.expanduser("~"), ".serial_command_designer_links.json")
+
+PROBE_PAYLOAD = 100
+PROBE_BYTES = 4096
+# Room left in the sketch's receive buffer for a command still being parsed
+RX_MARGIN = 64
+
+
+class LinkUnsupported(SerialLinkError):
+    pass
+
+
+class DeviceInfo:
+    def __init__(self, version=None, capabilities=(), reset=False, elapsed=0.0):
+        self.version = version  # None for sketches without the version command
+        self.capabilities = set(capabilities)
+        self.reset = reset  # The banner showed up, so the board (re)booted
+        self.elapsed = elapsed
+
+    def supports(self, capability):
+        """True or False for firmware that reports its features, None if unknown"""
+        if self.version is None:
+            return None
+        return capability in self.capabilities
+
+    def summary(self):
+        firmware = f"firmware {self.version}" if self.version else "older firmware"
+        return f"{firmware}, ready in {self.elapsed * 1000:.0f} ms" + (" after reset" if self.reset else "")
+
+
+class LinkResult:
+    def __init__(self, baud=BOOT_BAUD, max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES, throughput=None,
+                 negotiated=False, device=None):
+        self.baud = baud
+        self.max_inflight_bytes = max_inflight_bytes
+        self.throughput = throughput  # Measured bytes per second, None if not probed
+        self.negotiated = negotiated
+        self.device = device or DeviceInfo()
+
+    def summary(self):
+        if not self.negotiated:
+            return f"{self.baud} baud (firmware cannot change the link)"
+        return (f"{self.baud} baud, {self.max_inflight_bytes} bytes in flight, "
+                f"{self.throughput / 1000:.1f} kB/s measured")
+
+
+class LinkSettings:
+    """Port -> best link setting that worked on it, persisted as JSON"""
+
+    def __init__(self, path=LINK_STATE):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self.ports = json.load(f)
+        except (OSError, ValueError):
+            self.ports = {}
+
+    def best(self, port):
+        """The remembered LinkResult of `port`, or None"""
+        entry = self.ports.get(port)
+        if not entry:
+            return None
+        return LinkResult(entry["baud"], entry["max_inflight_bytes"], entry["throughput"], negotiated=True)
+
+    def record(self, port, link):
+        with self.lock:
+            self.ports[port] = {"baud": link.baud, "max_inflight_bytes": link.max_inflight_bytes,
+                                "throughput": round(link.throughput or 0),
+                                "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+    def save(self):
+        with self.lock:
+            with open(self.path, "w") as f:
+                json.dump(self.ports, f, indent=4)
+
+
+def _read_reply(conn, prefixes, timeout):
+    """First line starting with one of `prefixes`, or None on timeout"""
+    deadline = time.perf_counter() + timeout
+    read_timeout = conn.timeout
+    try:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            conn.timeout = min(remaining, read_timeout)
+            line = conn.readline().decode(errors="replace").strip()
+            if line.startswith(prefixes):
+                return line
+    finally:
+        conn.timeout = read_timeout
+
+
+def _drain(conn, quiet=QUIET_TIME):
+    """Discard input until the line has been quiet for `quiet` seconds"""
+    read_timeout = conn.timeout
+    conn.timeout = quiet
+    try:
+        while conn.read(4096):
+            pass
+    finally:
+        conn.timeout = read_timeout
+
+
+def wait_ready(conn, timeout=READY_TIMEOUT):
+    """Wait until the sketch answers commands; returns a DeviceInfo.
+
+    Raises SerialLinkError if nothing answers within `timeout` seconds.
+    """
+    start = time.perf_counter()
+    deadline = start + timeout
+    next_probe = start
+    probes = 0
+    reset = False
+    read_timeout = conn.timeout
+    try:
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                raise SerialLinkError("Device did not answer; is the sketch running?")
+            if now >= next_probe:
+                conn.write(b"version\n")
+                conn.flush()
+                probes += 1
+                next_probe = now + VERSION_RETRY
+            conn.timeout = max(0.01, min(next_probe, deadline) - now)
+            line = conn.readline().decode(errors="replace").strip()
+            if line == READY_BANNER:
+                # Probes sent while the board booted are gone, ask again
+                reset = True
+                next_probe = time.perf_counter()
+            elif line.startswith("Version "):
+                version, _, capabilities = line[len("Version "):].partition("|")
+                info = DeviceInfo(version, [c for c in capabilities.split(",") if c], reset)
+                break
+            elif line.startswith("Unknown or incomplete command: version"):
+                info = DeviceInfo(reset=reset)
+                break
+    finally:
+        conn.timeout = read_timeout
+    if reset or probes > 1:
+        _drain(conn)  # The rest of the banner and the answers to repeated probes
+    info.elapsed = time.perf_counter() - start
+    return info
+
+
+def request_link(conn, baud, timeout=1.0):
+    """Switch both ends to `baud`; returns the sketch's receive buffer size or None.
+
+    On failure both ends are back at the previous rate. Raises
+    LinkUnsupported if the firmware does not know the link command.
+    """
+    previous = conn.baudrate
+    conn.write(f"link|{baud}\n".encode())
+    conn.flush()
+    reply = _read_reply(conn, ("Link switching|", "Link refused", "Unknown or incomplete command"), timeout)
+    if reply is None or reply.startswith("Unknown"):
+        raise LinkUnsupported("Firmware does not support link negotiation")
+    if reply == "Link refused":
+        return None
+    rx_buffer = int(reply.split("|")[2])
+
+    conn.baudrate = baud
+    conn.reset_input_buffer()
+    conn.write(b"link|confirm\n")
+    conn.flush()
+    if _read_reply(conn, ("Link confirmed",), LINK_CONFIRM_TIMEOUT) is not None:
+        return rx_buffer
+
+    # Let the sketch give up on the confirmation, then clear what the wrong rate left behind
+    conn.baudrate = previous
+    time.sleep(LINK_CONFIRM_TIMEOUT)
+    conn.write(b"\n")
+    conn.flush()
+    time.sleep(0.1)
+    conn.reset_input_buffer()
+    return None
+
+
+def probe_throughput(conn, max_inflight_bytes, total=PROBE_BYTES):
+    """Bytes per second reached by a burst of pings; raises SerialLinkError if any got mangled"""
+    commands = ["ping|" + "x" * PROBE_PAYLOAD] * max(1, total // (PROBE_PAYLOAD + 6))
+    sender = PipelinedSender(conn, window=len(commands), max_inflight_bytes=max_inflight_bytes, ack_timeout=1.0)
+    stats = sender.send(commands)
+    if stats.errors or any(response != f"Pong {PROBE_PAYLOAD}" for response in sender.responses):
+        raise SerialLinkError("Throughput probe failed")
+    return stats.bytes_per_second
+
+
+def negotiate_link(conn, target, known=None):
+    """Fastest working link at or below `target` baud, as a LinkResult.
+
+    A `known` LinkResult for this port at `target` skips the throughput
+    probe when the rate still confirms.
+    """
+    candidates = [target] + [baud for baud in reversed(LINK_SPEEDS) if BOOT_BAUD <= baud < target]
+    for baud in candidates:
+        try:
+            rx_buffer = request_link(conn, baud)
+        except LinkUnsupported:
+            return LinkResult(conn.baudrate)
+        if rx_buffer is None:
+            continue
+        if known is not None and known.baud == baud:
+            return known
+        max_inflight = max(DEFAULT_MAX_INFLIGHT_BYTES, rx_buffer - RX_MARGIN)
+        try:
+            throughput = probe_throughput(conn, max_inflight)
+        except SerialLinkError:
+            # Confirmed but unreliable: go back to the boot rate before trying slower ones
+            request_link(conn, BOOT_BAUD)
+            continue
+        return LinkResult(baud, max_inflight, throughput, negotiated=True)
+    return LinkResult(conn.baudrate)
+
+
+def open_link(port, baud=BOOT_BAUD, ready_timeout=READY_TIMEOUT, settings=None):
+    """Open `port` at the boot rate, wait for the sketch and negotiate up to `baud`.
+
+    Returns (connection, LinkResult).
+    """
+    conn = serial.Serial(port, BOOT_BAUD, timeout=1)
+    try:
+        device = wait_ready(conn, ready_timeout)
+        if device.supports("link") is False:
+            link = LinkResult()
+        else:
+            link = negotiate_link(conn, baud, settings.best(port) if settings is not None else None)
+        link.device = device
+    except Exception:
+        conn.close()
+        raise
+    if settings is not None and link.negotiated:
+        settings.record(port, link)
+        try:
+            settings.save()
+        except OSError:
+            pass  # Only a hint for the next connection
+    return conn, link
+
+
+def link_sender(conn, link, window=DEFAULT_WINDOW, encoder=encode_text):
+    """Sender for a connection from open_link(), sequenced if the firmware answers that way"""
+    sender = SequencedSender if link.device.supports("seq") else PipelinedSender
+    return sender(conn, window, link.max_inflight_bytes, encoder=encoder)
+
+
+def reset_link(conn):
+    """Put both ends back to the boot rate so the next connection finds the sketch there"""
+    if conn.baudrate != BOOT_BAUD:
+        try:
+            request_link(conn, BOOT_BAUD)
+        except (SerialLinkError, serial.SerialException, OSError):
+            pass
@@ -0,0 +1,163 @@
+import math
+
+import qr_encoder
+from item_geometry import (device_rect, clip_to_screen, rect_area, qr_size,
+                           qr_version_for)
+from design_compiler import item_command
+from design_items import item_bounds
+from delta_sync import item_uid
+
+GRID_CELL = 32
+
+
+def opaque_rects(item):
+    """Rectangles an item paints completely, in screen coordinates.
+
+    These are exact for fill rects and QR codes (background square), the
+    straight cross of a filled rounded rectangle and a slightly shrunken
+    inscribed square for filled circles.
+    """
+    item_type = item["type"]
+    if item_type in ("fillrect", "fillroundrect"):
+        x1, y1, x2, y2 = item["coords"]
+        if x2 <= x1 or y2 <= y1:
+            return []
+        rect = device_rect(x1, y1, x2 - x1, y2 - y1)
+        if item_type == "fillrect":
+            return [rect]
+        rx1, ry1, rx2, ry2 = rect
+        radius = min(int(item.get("radius", 20)), (rx2 - rx1) // 2, (ry2 - ry1) // 2)
+        return [(rx1, ry1 + radius, rx2, ry2 - radius), (rx1 + radius, ry1, rx2 - radius, ry2)]
+    if item_type == "fillcircle":
+        x, y, r = item["coords"]
+        # Circles land one pixel higher than their nominal centre on the device
+        half = int(r / math.sqrt(2)) - 1
+        if half < 0:
+            return []
+        return [(x - half, y - 1 - half, x + half + 1, y + half)]
+    if item_type == "qrcode":
+        x, y = item["coords"]
+        if x < 0 or y < 0:
+            return []
+        if not qr_encoder.fits(item["data"], qr_version_for(item["data"])):
+            return []  # Too long for the symbol: the sketch draws nothing
+        size = qr_size(item["data"], item["module_size"])
+        return [device_rect(x, y, size, size)]
+    return []
+
+
+def subtract_rect(rect, cut):
+    """Parts of `rect` outside `cut`, as up to four rectangles"""
+    x1, y1, x2, y2 = rect
+    cx1, cy1, cx2, cy2 = cut
+    if cx1 >= x2 or cx2 <= x1 or cy1 >= y2 or cy2 <= y1:
+        return [rect]
+    pieces = []
+    if cy1 > y1:
+        pieces.append((x1, y1, x2, cy1))
+    if cy2 < y2:
+        pieces.append((x1, cy2, x2, y2))
+    top, bottom = max(y1, cy1), min(y2, cy2)
+    if cx1 > x1:
+        pieces.append((x1, top, cx1, bottom))
+    if cx2 < x2:
+        pieces.append((cx2, top, x2, bottom))
+    return pieces
+
+
+class OccluderGrid:
+    """Uniform grid of opaque rectangles for fast coverage queries"""
+
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.cells = {}
+        self.rects = []
+
+    def _cell_range(self, rect):
+        x1, y1, x2, y2 = rect
+        c = self.cell
+        return range(x1 // c, (x2 - 1) // c + 1), range(y1 // c, (y2 - 1) // c + 1)
+
+    def add(self, rect):
+        if rect_area(rect) == 0:
+            return
+        index = len(self.rects)
+        self.rects.append(rect)
+        cols, rows = self._cell_range(rect)
+        for cx in cols:
+            for cy in rows:
+                self.cells.setdefault((cx, cy), []).append(index)
+
+    def candidates(self, rect):
+        found = set()
+        cols, rows = self._cell_range(rect)
+        for cx in cols:
+            for cy in rows:
+                found.update(self.cells.get((cx, cy), ()))
+        return [self.rects[i] for i in sorted(found)]
+
+    def uncovered(self, rect):
+        """Parts of `rect` not hidden by any rectangle in the grid"""
+        remaining = [rect]
+        for cut in self.candidates(rect):
+            remaining = [piece for part in remaining for piece in subtract_rect(part, cut)]
+            if not remaining:
+                break
+        return remaining
+
+
+class OcclusionStats:
+    def __init__(self):
+        self.hidden = 0
+        self.clipped = 0
+        self.pixels_saved = 0
+        self.bytes_saved = 0
+
+    def summary(self):
+        return (f"{self.hidden} hidden item(s) dropped, {self.clipped} clipped, "
+                f"{self.pixels_saved} pixels and {self.bytes_saved} bytes saved")
+
+
+def _command_bytes(item):
+    cmd = item_command(item)
+    return len(cmd.encode()) + 1 if cmd else 0
+
+
+def cull_hidden_items(items, clip=False):
+    """Drop items completely covered by opaque items above them.
+
+    Walks the design from the top layer down, collecting the opaque area of
+    every filled shape in an OccluderGrid. With `clip` enabled, partially
+    covered fill rects are shrunk to their visible part when that part is a
+    single rectangle. Returns (visible items in z-order, OcclusionStats);
+    clipped items are copies, the input items are never modified.
+    """
+    stats = OcclusionStats()
+    grid = OccluderGrid()
+    visible = []
+
+    for item in reversed(items):
+        item_uid(item)  # Copies made below must keep the item's identity
+        bounds = clip_to_screen(item_bounds(item))
+        if rect_area(bounds) > 0:
+            remaining = grid.uncovered(bounds)
+            if not remaining:
+                stats.hidden += 1
+                stats.pixels_saved += rect_area(bounds)
+                stats.bytes_saved += _command_bytes(item)
+                continue
+            if clip and item["type"] == "fillrect" and len(remaining) == 1 and remaining[0] != bounds:
+                x1, y1, x2, y2 = item["coords"]
+                if bounds == (x1, y1, x2, y2):  # Leave rects the device clamps alone
+                    clipped = item.copy()
+                    clipped["coords"] = list(remaining[0])
+                    stats.clipped += 1
+                    stats.pixels_saved += rect_area(bounds) - rect_area(remaining[0])
+                    stats.bytes_saved += _command_bytes(item) - _command_bytes(clipped)
+                    item = clipped
+        visible.append(item)
+        for rect in opaque_rects(item):
+            grid.add(clip_to_screen(rect))
+
+    visible.reverse()
+    return visible, stats
@@ -0,0 +1,456 @@
+"""Python port of the QR encoder in src/qrcode_helper.c (ricmoo/QRCode).
+
+It produces the same module matrix as the sketch for the same data,
+version and error correction level, so previews and host-side rendering
+match what JC3248W535EN::drawQRCode draws.
+
+matrix_for() keeps recently encoded symbols in an LRU cache, so previews,
+rendering and uploads of the same QR code only encode it once.
+"""
+
+from functools import lru_cache
+
+ECC_LOW = 0
+ECC_MEDIUM = 1
+ECC_QUARTILE = 2
+ECC_HIGH = 3
+
+MODE_NUMERIC = 0
+MODE_ALPHANUMERIC = 1
+MODE_BYTE = 2
+
+# Indexed by format bits (Medium, Low, High, Quartile), then version - 1
+NUM_ERROR_CORRECTION_CODEWORDS = [
+    [10, 16, 26, 36, 48, 64, 72, 88, 110, 130, 150, 176, 198, 216, 240, 280, 308, 338, 364, 416,
+     442, 476, 504, 560, 588, 644, 700, 728, 784, 812, 868, 924, 980, 1036, 1064, 1120, 1204, 1260, 1316, 1372],
+    [7, 10, 15, 20, 26, 36, 40, 48, 60, 72, 80, 96, 104, 120, 132, 144, 168, 180, 196, 224,
+     224, 252, 270, 300, 312, 336, 360, 390, 420, 450, 480, 510, 540, 570, 570, 600, 630, 660, 720, 750],
+    [17, 28, 44, 64, 88, 112, 130, 156, 192, 224, 264, 308, 352, 384, 432, 480, 532, 588, 650, 700,
+     750, 816, 900, 960, 1050, 1110, 1200, 1260, 1350, 1440, 1530, 1620, 1710, 1800, 1890, 1980, 2100, 2220, 2310, 2430],
+    [13, 22, 36, 52, 72, 96, 108, 132, 160, 192, 224, 260, 288, 320, 360, 408, 448, 504, 546, 600,
+     644, 690, 750, 810, 870, 952, 1020, 1050, 1140, 1200, 1290, 1350, 1440, 1530, 1590, 1680, 1770, 1860, 1950, 2040],
+]
+
+NUM_ERROR_CORRECTION_BLOCKS = [
+    [1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+     17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49],
+    [1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+     8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25],
+    [1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+     25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81],
+    [1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+     23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68],
+]
+
+NUM_RAW_DATA_MODULES = [
+    208, 359, 567, 807, 1079, 1383, 1568, 1936, 2336, 2768, 3232, 3728, 4256, 4651, 5243, 5867, 6523,
+    7211, 7931, 8683, 9252, 10068, 10916, 11796, 12708, 13652, 14628, 15371, 16411, 17483, 18587,
+    19723, 20891, 22091, 23008, 24272, 25568, 26896, 28256, 29648,
+]
+
+# Format bits for ECC_LOW, ECC_MEDIUM, ECC_QUARTILE, ECC_HIGH
+ECC_FORMAT_BITS = [1, 0, 3, 2]
+
+ALPHANUMERIC = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+
+MATRIX_CACHE_SIZE = 256
+
+
+class QRMatrix:
+    def __init__(self, version, ecc, mode, mask, modules):
+        self.version = version
+        self.size = version * 4 + 17
+        self.ecc = ecc
+        self.mode = mode
+        self.mask = mask
+        self.modules = modules  # list of rows of bools, True = dark
+        self._packed = None
+
+    def get_module(self, x, y):
+        if 0 <= x < self.size and 0 <= y < self.size:
+            return self.modules[y][x]
+        return False
+
+    def packed_rows(self):
+        """The matrix as a 1-bpp bitmap: (size + 7) // 8 bytes per row, leftmost module in the top bit"""
+        if self._packed is None:
+            data = bytearray()
+            for row in self.modules:
+                for start in range(0, self.size, 8):
+                    byte = 0
+                    for bit, dark in enumerate(row[start:start + 8]):
+                        byte |= dark << (7 - bit)
+                    data.append(byte)
+            self._packed = bytes(data)
+        return self._packed
+
+    def row_runs(self):
+        """(row, first module, length) of every horizontal run of dark modules"""
+        runs = []
+        for y, row in enumerate(self.modules):
+            x = 0
+            while x < self.size:
+                if row[x]:
+                    start = x
+                    while x < self.size and row[x]:
+                        x += 1
+                    runs.append((y, start, x - start))
+                else:
+                    x += 1
+        return runs
+
+
+class _BitBuffer:
+    def __init__(self):
+        self.bits = []
+
+    def append(self, value, length):
+        for i in range(length - 1, -1, -1):
+            self.bits.append((value >> i) & 1)
+
+    def to_bytes(self):
+        data = bytearray((len(self.bits) + 7) // 8)
+        for i, bit in enumerate(self.bits):
+            if bit:
+                data[i >> 3] |= 1 << (7 - (i & 7))
+        return data
+
+
+def _mode_bits(version, mode):
+    if version <= 9:
+        return (10, 9, 8)[mode]
+    if version <= 26:
+        return (12, 11, 16)[mode]
+    return (14, 13, 16)[mode]
+
+
+def _encode_data(buffer, data, version):
+    text = data.decode("latin-1")
+    if all('0' <= c <= '9' for c in text):
+        buffer.append(1 << MODE_NUMERIC, 4)
+        buffer.append(len(data), _mode_bits(version, MODE_NUMERIC))
+        for i in range(0, len(text), 3):
+            chunk = text[i:i + 3]
+            buffer.append(int(chunk), len(chunk) * 3 + 1)
+        return MODE_NUMERIC
+    if all(c in ALPHANUMERIC for c in text):
+        buffer.append(1 << MODE_ALPHANUMERIC, 4)
+        buffer.append(len(data), _mode_bits(version, MODE_ALPHANUMERIC))
+        for i in range(0, len(text) - 1, 2):
+            buffer.append(ALPHANUMERIC.index(text[i]) * 45 + ALPHANUMERIC.index(text[i + 1]), 11)
+        if len(text) % 2:
+            buffer.append(ALPHANUMERIC.index(text[-1]), 6)
+        return MODE_ALPHANUMERIC
+    buffer.append(1 << MODE_BYTE, 4)
+    buffer.append(len(data), _mode_bits(version, MODE_BYTE))
+    for byte in data:
+        buffer.append(byte, 8)
+    return MODE_BYTE
+
+
+def _rs_multiply(x, y):
+    z = 0
+    for i in range(7, -1, -1):
+        z = ((z << 1) ^ ((z >> 7) * 0x11D)) & 0xFFFF
+        z ^= ((y >> i) & 1) * x
+    return z & 0xFF
+
+
+def _rs_generator(degree):
+    coeff = [0] * degree
+    coeff[degree - 1] = 1
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            coeff[j] = _rs_multiply(coeff[j], root)
+            if j + 1 < degree:
+                coeff[j] ^= coeff[j + 1]
+        root = ((root << 1) ^ ((root >> 7) * 0x11D)) & 0xFF
+    return coeff
+
+
+def _rs_remainder(coeff, data):
+    result = [0] * len(coeff)
+    for byte in data:
+        factor = byte ^ result[0]
+        result = result[1:] + [0]
+        for j, c in enumerate(coeff):
+            result[j] ^= _rs_multiply(c, factor)
+    return result
+
+
+def _interleave(version, ecc_bits, data):
+    num_blocks = NUM_ERROR_CORRECTION_BLOCKS[ecc_bits][version - 1]
+    total_ecc = NUM_ERROR_CORRECTION_CODEWORDS[ecc_bits][version - 1]
+    module_count = NUM_RAW_DATA_MODULES[version - 1]
+
+    block_ecc_len = total_ecc // num_blocks
+    num_short_blocks = num_blocks - module_count // 8 % num_blocks
+    short_block_len = module_count // 8 // num_blocks
+    short_data_len = short_block_len - block_ecc_len
+
+    blocks = []
+    offset = 0
+    for block in range(num_blocks):
+        length = short_data_len + (0 if block < num_short_blocks else 1)
+        blocks.append(data[offset:offset + length])
+        offset += length
+
+    coeff = _rs_generator(block_ecc_len)
+    result = []
+    for i in range(short_data_len + 1):
+        for block in blocks:
+            if i < len(block):
+                result.append(block[i])
+    eccs = [_rs_remainder(coeff, block) for block in blocks]
+    for i in range(block_ecc_len):
+        for ecc in eccs:
+            result.append(ecc[i])
+    return result, module_count
+
+
+class _Grid:
+    def __init__(self, size):
+        self.size = size
+        self.modules = [[False] * size for _ in range(size)]
+        self.is_function = [[False] * size for _ in range(size)]
+
+    def set_function(self, x, y, on):
+        self.modules[y][x] = on
+        self.is_function[y][x] = True
+
+
+def _draw_finder(grid, x, y):
+    for i in range(-4, 5):
+        for j in range(-4, 5):
+            dist = max(abs(i), abs(j))
+            xx, yy = x + j, y + i
+            if 0 <= xx < grid.size and 0 <= yy < grid.size:
+                grid.set_function(xx, yy, dist != 2 and dist != 4)
+
+
+def _draw_alignment(grid, x, y):
+    for i in range(-2, 3):
+        for j in range(-2, 3):
+            grid.set_function(x + j, y + i, max(abs(i), abs(j)) != 1)
+
+
+def _draw_format_bits(grid, ecc_bits, mask):
+    size = grid.size
+    data = ecc_bits << 3 | mask
+    rem = data
+    for _ in range(10):
+        rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+    data = (data << 10 | rem) ^ 0x5412
+
+    for i in range(6):
+        grid.set_function(8, i, (data >> i) & 1 != 0)
+    grid.set_function(8, 7, (data >> 6) & 1 != 0)
+    grid.set_function(8, 8, (data >> 7) & 1 != 0)
+    grid.set_function(7, 8, (data >> 8) & 1 != 0)
+    for i in range(9, 15):
+        grid.set_function(14 - i, 8, (data >> i) & 1 != 0)
+
+    for i in range(8):
+        grid.set_function(size - 1 - i, 8, (data >> i) & 1 != 0)
+    for i in range(8, 15):
+        grid.set_function(8, size - 15 + i, (data >> i) & 1 != 0)
+    grid.set_function(8, size - 8, True)
+
+
+def _draw_version(grid, version):
+    if version < 7:
+        return
+    rem = version
+    for _ in range(12):
+        rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+    data = version << 12 | rem
+    for i in range(18):
+        bit = (data >> i) & 1 != 0
+        a, b = grid.size - 11 + i % 3, i // 3
+        grid.set_function(a, b, bit)
+        grid.set_function(b, a, bit)
+
+
+def _draw_function_patterns(grid, version, ecc_bits):
+    size = grid.size
+    for i in range(size):
+        grid.set_function(6, i, i % 2 == 0)
+        grid.set_function(i, 6, i % 2 == 0)
+
+    _draw_finder(grid, 3, 3)
+    _draw_finder(grid, size - 4, 3)
+    _draw_finder(grid, 3, size - 4)
+
+    if version > 1:
+        align_count = version // 7 + 2
+        if version != 32:
+            step = (version * 4 + align_count * 2 + 1) // (2 * align_count - 2) * 2
+        else:
+            step = 26
+        positions = [0] * align_count
+        positions[0] = 6
+        pos = size - 7
+        for i in range(align_count - 1):
+            positions[align_count - 1 - i] = pos
+            pos -= step
+        for i in range(align_count):
+            for j in range(align_count):
+                if (i == 0 and j == 0) or (i == 0 and j == align_count - 1) or (i == align_count - 1 and j == 0):
+                    continue
+                _draw_alignment(grid, positions[i], positions[j])
+
+    _draw_format_bits(grid, ecc_bits, 0)
+    _draw_version(grid, version)
+
+
+def _draw_codewords(grid, codewords, bit_length):
+    size = grid.size
+    i = 0
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5
+        for vert in range(size):
+            for j in range(2):
+                x = right - j
+                upwards = ((right & 2) == 0) ^ (x < 6)
+                y = size - 1 - vert if upwards else vert
+                if not grid.is_function[y][x] and i < bit_length:
+                    grid.modules[y][x] = (codewords[i >> 3] >> (7 - (i & 7))) & 1 != 0
+                    i += 1
+        right -= 2
+
+
+def _mask_bit(mask, x, y):
+    if mask == 0:
+        return (x + y) % 2 == 0
+    if mask == 1:
+        return y % 2 == 0
+    if mask == 2:
+        return x % 3 == 0
+    if mask == 3:
+        return (x + y) % 3 == 0
+    if mask == 4:
+        return (x // 3 + y // 2) % 2 == 0
+    if mask == 5:
+        return x * y % 2 + x * y % 3 == 0
+    if mask == 6:
+        return (x * y % 2 + x * y % 3) % 2 == 0
+    return ((x + y) % 2 + x * y % 3) % 2 == 0
+
+
+def _apply_mask(grid, mask):
+    for y in range(grid.size):
+        row, function_row = grid.modules[y], grid.is_function[y]
+        for x in range(grid.size):
+            if not function_row[x] and _mask_bit(mask, x, y):
+                row[x] = not row[x]
+
+
+def _penalty(modules):
+    size = len(modules)
+    result = 0
+
+    for lines in (modules, [list(col) for col in zip(*modules)]):
+        for line in lines:
+            run = 1
+            for k in range(1, size):
+                if line[k] == line[k - 1]:
+                    run += 1
+                    if run == 5:
+                        result += 3
+                    elif run > 5:
+                        result += 1
+                else:
+                    run = 1
+
+    black = 0
+    for y in range(size):
+        bits_row = bits_col = 0
+        for x in range(size):
+            color = modules[y][x]
+            if x > 0 and y > 0:
+                if color == modules[y - 1][x - 1] == modules[y - 1][x] == modules[y][x - 1]:
+                    result += 3
+            bits_row = ((bits_row << 1) & 0x7FF) | color
+            bits_col = ((bits_col << 1) & 0x7FF) | modules[x][y]
+            if x >= 10:
+                if bits_row in (0x05D, 0x5D0):
+                    result += 40
+                if bits_col in (0x05D, 0x5D0):
+                    result += 40
+            if color:
+                black += 1
+
+    total = size * size
+    k = 0
+    while black * 20 < (9 - k) * total or black * 20 > (11 + k) * total:
+        result += 10
+        k += 1
+    return result
+
+
+def fits(data, version, ecc=ECC_LOW):
+    """True if encode() can store `data` in a symbol of this version"""
+    if isinstance(data, str):
+        data = data.encode()
+    if not 1 <= version <= 40:
+        return False
+    capacity = NUM_RAW_DATA_MODULES[version - 1] // 8 - NUM_ERROR_CORRECTION_CODEWORDS[ECC_FORMAT_BITS[ecc]][version - 1]
+    buffer = _BitBuffer()
+    _encode_data(buffer, data, version)
+    return len(buffer.bits) <= capacity * 8
+
+
+def encode(data, version, ecc=ECC_LOW):
+    """Encode `data` (str or bytes) like qrcode_initText(version, ecc)"""
+    if isinstance(data, str):
+        data = data.encode()
+    if not 1 <= version <= 40:
+        raise ValueError(f"Unsupported QR version: {version}")
+    ecc_bits = ECC_FORMAT_BITS[ecc]
+    module_count = NUM_RAW_DATA_MODULES[version - 1]
+    capacity = module_count // 8 - NUM_ERROR_CORRECTION_CODEWORDS[ecc_bits][version - 1]
+
+    buffer = _BitBuffer()
+    mode = _encode_data(buffer, data, version)
+    if len(buffer.bits) > capacity * 8:
+        raise ValueError(f"Data too long for QR version {version}")
+
+    buffer.append(0, min(4, capacity * 8 - len(buffer.bits)))
+    buffer.append(0, (8 - len(buffer.bits) % 8) % 8)
+    pad = 0xEC
+    while len(buffer.bits) < capacity * 8:
+        buffer.append(pad, 8)
+        pad ^= 0xEC ^ 0x11
+
+    grid = _Grid(version * 4 + 17)
+    _draw_function_patterns(grid, version, ecc_bits)
+    codewords, bit_length = _interleave(version, ecc_bits, list(buffer.to_bytes()))
+    # Remainder bits past the last codeword stay light
+    _draw_codewords(grid, codewords + [0], bit_length)
+
+    best_mask, min_penalty = 0, None
+    for mask in range(8):
+        _draw_format_bits(grid, ecc_bits, mask)
+        _apply_mask(grid, mask)
+        penalty = _penalty(grid.modules)
+        if min_penalty is None or penalty < min_penalty:
+            best_mask, min_penalty = mask, penalty
+        _apply_mask(grid, mask)
+
+    _draw_format_bits(grid, ecc_bits, best_mask)
+    _apply_mask(grid, best_mask)
+    return QRMatrix(version, ecc, mode, best_mask, grid.modules)
+
+
+@lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def matrix_for(data, version, ecc=ECC_LOW):
+    """encode() through an LRU cache keyed by (data, version, ecc); None if the data does not fit.
+
+    The returned matrix is shared, so callers must not modify it.
+    """
+    if not fits(data, version, ecc):
+        return None
+    return encode(data, version, ecc)
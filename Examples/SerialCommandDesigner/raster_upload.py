@@ -0,0 +1,210 @@
+"""Raster uploads: render the design on the host and blit the pixels.
+
+Dense designs can take fewer bytes as pixels than as vector commands. The
+design is rendered with the reference rasterizer, cut into physical canvas
+rows and sent as run-length encoded blit commands that the sketch writes
+straight into its Arduino_Canvas buffer.
+
+plan_transfer() prices three ways of putting a design on the panel and
+picks the cheapest on the wire:
+
+    vector  the usual (delta) command stream from prepare_upload
+    raster  every canvas row as blits
+    hybrid  raster for the screen tiles where pixels are cheaper than the
+            items touching them, vector commands for everything else
+
+Hybrid uploads draw the vector items first and blit the raster tiles last;
+the blitted pixels are the final image, so they may cover anything.
+"""
+
+import numpy as np
+
+from binary_protocol import FRAME_MAX_TEXT, encode_command
+from design_compiler import item_command
+from design_items import item_bounds
+from gfx_font import find_font
+from occlusion import cull_hidden_items
+from rasterizer import CANVAS_WIDTH, CANVAS_HEIGHT, render_design
+from upload_pipeline import prepare_upload
+
+TILE_SIZE = 64
+MAX_RUN = 128
+MAX_LITERAL = 127  # Header plus 127 pixels fills one frame
+UPLOAD_MODES = ("auto", "vector", "raster", "hybrid")
+
+
+def rle_packets(span):
+    """Run-length encode a row of RGB565 pixels into (packet bytes, pixel count) pairs.
+
+    See rasterizer.rle_decode() for the packet format.
+    """
+    span = np.asarray(span, dtype=np.uint16)
+    if not len(span):
+        return []
+    starts = np.flatnonzero(np.r_[True, span[1:] != span[:-1]])
+    lengths = np.diff(np.r_[starts, len(span)])
+    packets = []
+    literal = []
+
+    def flush_literal():
+        for i in range(0, len(literal), MAX_LITERAL):
+            chunk = literal[i:i + MAX_LITERAL]
+            packets.append((bytes([len(chunk) - 1]) + np.array(chunk, dtype="<u2").tobytes(), len(chunk)))
+        literal.clear()
+
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        color = int(span[start])
+        # A pair only pays off as a run if it does not split a literal
+        if length >= 3 or (length == 2 and not literal):
+            flush_literal()
+            while length > 0:
+                n = min(length, MAX_RUN)
+                packets.append((bytes([0x80 | (n - 1), color & 0xFF, color >> 8]), n))
+                length -= n
+        else:
+            literal.extend([color] * length)
+    flush_literal()
+    return packets
+
+
+def span_commands(pixels, x1, x2, y):
+    """Blit commands for physical row `y`, columns x1..x2-1 of `pixels`"""
+    commands = []
+    data, count, start = b"", 0, x1
+    for packet, n in rle_packets(pixels[y, x1:x2]):
+        if len(data) + len(packet) > FRAME_MAX_TEXT:
+            commands.append(f"blit|{start}|{y}|{count}|{data.hex()}")
+            data, start, count = b"", start + count, 0
+        data += packet
+        count += n
+    if count:
+        commands.append(f"blit|{start}|{y}|{count}|{data.hex()}")
+    return commands
+
+
+def region_commands(pixels, rect):
+    x1, y1, x2, y2 = rect
+    commands = []
+    for y in range(y1, y2):
+        commands.extend(span_commands(pixels, x1, x2, y))
+    return commands
+
+
+def command_bytes(commands, encoder=encode_command):
+    return sum(len(encoder(command)) for command in commands)
+
+
+def screen_tiles(tile=TILE_SIZE):
+    """Physical canvas tiles (x1, y1, x2, y2), row by row"""
+    return [(x, y, min(x + tile, CANVAS_WIDTH), min(y + tile, CANVAS_HEIGHT))
+            for y in range(0, CANVAS_HEIGHT, tile) for x in range(0, CANVAS_WIDTH, tile)]
+
+
+def physical_bounds(item):
+    """Physical canvas box around an item; covers both rotation conventions of the library"""
+    x1, y1, x2, y2 = item_bounds(item)
+    return (max(CANVAS_WIDTH - y2, 0), max(x1, 0),
+            min(CANVAS_WIDTH - y1 + 1, CANVAS_WIDTH), min(x2, CANVAS_HEIGHT))
+
+
+def _overlap(a, b):
+    return max(0, min(a[2], b[2]) - max(a[0], b[0])) * max(0, min(a[3], b[3]) - max(a[1], b[1]))
+
+
+def _exact_text(item, framebuffer):
+    """Whether the rasterizer draws a text item's glyphs like the device"""
+    if item.get("font"):
+        return find_font(item["font"]) is not None
+    return framebuffer.font is not None
+
+
+class TransferPlan:
+    """The cheapest way found to show a design, with the price of each candidate in bytes"""
+
+    def __init__(self, mode, commands, snapshot, repainted, costs, raster_tiles=0, vector_plan=None):
+        self.mode = mode
+        self.commands = commands
+        self.snapshot = snapshot
+        self.repainted = repainted
+        self.costs = costs
+        self.raster_tiles = raster_tiles
+        self.vector_plan = vector_plan
+
+    @property
+    def bytes(self):
+        return self.costs[self.mode]
+
+    def summary(self):
+        costs = ", ".join(f"{mode} {size} B" for mode, size in self.costs.items())
+        summary = f"{self.mode} upload, {len(self.commands)} commands ({costs})"
+        if self.mode == "hybrid":
+            summary += f", {self.raster_tiles} raster tile(s)"
+        return summary
+
+
+def plan_transfer(items, snapshot=None, mode="auto", cull=True, clip=False, background=(0, 0, 0),
+                  encoder=encode_command, command_for=item_command, tile=TILE_SIZE):
+    """Plan an upload of `items` as vector commands, raster blits or a mix.
+
+    `mode` forces one candidate ("vector", "raster", "hybrid") or picks the
+    one with the fewest bytes through `encoder` ("auto"). Designs with text
+    stay vector where text is drawn if the rasterizer has no real font.
+    Returns a TransferPlan.
+    """
+    vector_plan = prepare_upload(items, snapshot, cull=cull, clip=clip, background=background,
+                                 command_for=command_for)
+    candidates = {"vector": vector_plan.commands}
+    costs = {"vector": command_bytes(vector_plan.commands, encoder)}
+    raster_tiles = 0
+    # Every raster row costs at least one frame, so small streams can skip rendering
+    min_raster = command_bytes(["blit|0|0|1|800000"], encoder) * min(tile, CANVAS_HEIGHT % tile or tile)
+    if mode != "vector" and items and (mode != "auto" or costs["vector"] > min_raster):
+        framebuffer = render_design(items, background)
+        pixels = framebuffer.pixels
+        visible = cull_hidden_items(items, clip=clip)[0] if cull else list(items)
+        bounds = [physical_bounds(item) for item in visible]
+        # Text in fonts the rasterizer cannot draw exactly has to stay vector
+        vector_text = [item["type"] == "text" and not _exact_text(item, framebuffer) for item in visible]
+        has_text = any(vector_text)
+
+        if not has_text:
+            raster = [command for y in range(CANVAS_HEIGHT)
+                      for command in span_commands(pixels, 0, CANVAS_WIDTH, y)] + ["flush"]
+            candidates["raster"] = raster
+            costs["raster"] = command_bytes(raster, encoder)
+
+        # Spread the bytes of every item over the tiles it touches, by area
+        tiles = screen_tiles(tile)
+        vector_cost = [0.0] * len(tiles)
+        forced = [False] * len(tiles)
+        for item, box, text in zip(visible, bounds, vector_text):
+            area = max(1, (box[2] - box[0]) * (box[3] - box[1]))
+            size = command_bytes(command_for(item).split("\n"), encoder)
+            for i, rect in enumerate(tiles):
+                share = _overlap(box, rect)
+                if share:
+                    vector_cost[i] += size * share / area
+                    if text:
+                        forced[i] = True
+        tile_commands = [region_commands(pixels, rect) for rect in tiles]
+        use_raster = [not forced[i] and command_bytes(tile_commands[i], encoder) < vector_cost[i]
+                      for i in range(len(tiles))]
+        raster_tiles = sum(use_raster)
+        if 0 < raster_tiles < len(tiles):
+            vector_rects = [rect for rect, raster in zip(tiles, use_raster) if not raster]
+            kept = [item for item, box in zip(visible, bounds)
+                    if any(_overlap(box, rect) for rect in vector_rects)]
+            hybrid = prepare_upload(kept, None, cull=False, background=background, command_for=command_for).commands
+            if hybrid and hybrid[-1] == "flush":
+                hybrid = hybrid[:-1]
+            for commands, raster in zip(tile_commands, use_raster):
+                if raster:
+                    hybrid.extend(commands)
+            hybrid.append("flush")
+            candidates["hybrid"] = hybrid
+            costs["hybrid"] = command_bytes(hybrid, encoder)
+
+    if mode == "auto" or mode not in candidates:
+        mode = min(costs, key=costs.get)
+    repainted = vector_plan.repainted if mode == "vector" else len(items)
+    return TransferPlan(mode, candidates[mode], vector_plan.snapshot, repainted, costs, raster_tiles, vector_plan)
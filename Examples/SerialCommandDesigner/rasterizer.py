@@ -0,0 +1,662 @@
+"""Headless reference renderer for the SerialCommandDesigner command set.
+
+Renders commands into an RGB565 framebuffer the same way the sketch does:
+the JC3248W535EN methods in src/JC3248W535EN-Touch-LCD.cpp (including their
+coordinate rotation and clamping) on top of the Arduino_GFX primitives of a
+320x480 Arduino_Canvas. Fills are done with NumPy slices and span masks.
+
+Text uses the classic 5x7 Adafruit GFX font from Arduino_GFX's glcdfont.
+Point GLCDFONT_PATH at that file if it is not found in the usual Arduino
+library folders; without it every glyph is drawn as a solid 5x7 block.
+Text naming a GFXfont is drawn with that font's header (see gfx_font.py).
+"""
+
+import re
+import struct
+import zlib
+
+import numpy as np
+
+from binary_protocol import FRAME_MAX_TEXT
+from gfx_font import GFXFont, classic_font, find_font, load_classic_font
+from item_geometry import qr_version_for
+import qr_encoder
+
+# Arduino_Canvas size; the designer's 480x320 screen is this rotated
+CANVAS_WIDTH = 320
+CANVAS_HEIGHT = 480
+
+def color565(r, g, b):
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+def rgb565_to_rgb888(pixels):
+    """Expand an RGB565 array to an (..., 3) uint8 array"""
+    pixels = pixels.astype(np.uint32)
+    r = (pixels >> 11) & 0x1F
+    g = (pixels >> 5) & 0x3F
+    b = pixels & 0x1F
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(np.uint8)
+
+
+def split_command(command):
+    """Split a text command into at most 11 parts the way the sketch does.
+
+    The line is trimmed, a trailing empty part is dropped and anything after
+    the eleventh delimiter is ignored.
+    """
+    command = command.strip()
+    parts = []
+    start = 0
+    while len(parts) < 11:
+        delimiter = command.find('|', start)
+        if delimiter == -1:
+            break
+        parts.append(command[start:delimiter])
+        start = delimiter + 1
+    if start < len(command) and len(parts) < 11:
+        parts.append(command[start:])
+    return parts
+
+
+def _int16(value):
+    return ((int(value) + 0x8000) & 0xFFFF) - 0x8000
+
+
+def _uint8(value):
+    return int(value) & 0xFF
+
+
+def rle_decode(data, count):
+    """Pixels of a run-length encoded span, as decoded by JC3248W535EN::writePixels.
+
+    `data` is a sequence of packets: a header byte n < 0x80 followed by n + 1
+    literal little-endian RGB565 pixels, or n >= 0x80 followed by one pixel
+    repeated (n & 0x7F) + 1 times. Raises ValueError unless the packets
+    decode to exactly `count` pixels.
+    """
+    out = np.empty(count, dtype=np.uint16)
+    pos = i = 0
+    while i < len(data):
+        header = data[i]
+        n = (header & 0x7F) + 1
+        if pos + n > count:
+            raise ValueError("Blit data overruns the span")
+        if header & 0x80:
+            if i + 3 > len(data):
+                raise ValueError("Truncated blit run")
+            out[pos:pos + n] = data[i + 1] | (data[i + 2] << 8)
+            i += 3
+        else:
+            if i + 1 + 2 * n > len(data):
+                raise ValueError("Truncated blit literal")
+            out[pos:pos + n] = np.frombuffer(bytes(data[i + 1:i + 1 + 2 * n]), dtype="<u2")
+            i += 1 + 2 * n
+        pos += n
+    if pos != count:
+        raise ValueError("Blit data does not fill the span")
+    return out
+
+
+def arduino_to_int(text):
+    """String::toInt(): leading integer of the string, 0 if there is none"""
+    match = re.match(r"\s*([+-]?\d+)", text)
+    return int(match.group(1)) if match else 0
+
+
+class Framebuffer:
+    """An Arduino_Canvas plus the JC3248W535EN drawing methods.
+
+    `pixels` is the physical 480x320 (rows x columns) canvas; `logical` is a
+    writable 320x480 view in the designer's landscape coordinates.
+    """
+
+    def __init__(self, font=None):
+        self.pixels = np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH), dtype=np.uint16)
+        self.font = font if font is not None else load_classic_font()
+        self.text_font = classic_font() if font is None else GFXFont.classic_glyphs(font)
+        self.color = 0xFFFF
+        self.flushes = 0
+
+    @property
+    def logical(self):
+        # Arduino_GFX rotation 1: physical x = WIDTH - 1 - y, physical y = x
+        return np.rot90(self.pixels)
+
+    # Arduino_GFX primitives, physical coordinates
+
+    def _pixels(self, xs, ys, color, target=None):
+        target = self.pixels if target is None else target
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        h, w = target.shape
+        keep = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+        target[ys[keep], xs[keep]] = color
+
+    def fill_rect(self, x, y, w, h, color, target=None):
+        target = self.pixels if target is None else target
+        if w < 0:
+            x, w = x + w + 1, -w
+        if h < 0:
+            y, h = y + h + 1, -h
+        rows, cols = target.shape
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, cols), min(y + h, rows)
+        if x1 < x2 and y1 < y2:
+            target[y1:y2, x1:x2] = color
+
+    def _fill_vspans(self, xs, ys, hs, color):
+        """Vertical lines (x, y, h) filled in one vectorized assignment"""
+        xs = np.asarray(xs, dtype=np.int64)
+        y0 = np.asarray(ys, dtype=np.int64)
+        y1 = y0 + np.asarray(hs, dtype=np.int64)
+        keep = (xs >= 0) & (xs < CANVAS_WIDTH) & (y1 > y0)
+        xs, y0, y1 = xs[keep], y0[keep], y1[keep]
+        if not len(xs):
+            return
+        rows = np.arange(CANVAS_HEIGHT)[:, None]
+        r, k = np.nonzero((rows >= y0) & (rows < y1))
+        self.pixels[r, xs[k]] = color
+
+    def _fill_hspans(self, xs, ys, ws, color):
+        """Horizontal lines (x, y, w) filled in one vectorized assignment"""
+        x0 = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        x1 = x0 + np.asarray(ws, dtype=np.int64)
+        keep = (ys >= 0) & (ys < CANVAS_HEIGHT) & (x1 > x0)
+        x0, ys, x1 = x0[keep], ys[keep], x1[keep]
+        if not len(ys):
+            return
+        cols = np.arange(CANVAS_WIDTH)[None, :]
+        k, c = np.nonzero((cols >= x0[:, None]) & (cols < x1[:, None]))
+        self.pixels[ys[k], c] = color
+
+    def draw_line(self, x0, y0, x1, y1, color):
+        if x0 == x1:
+            if y0 > y1:
+                y0, y1 = y1, y0
+            self.fill_rect(x0, y0, 1, y1 - y0 + 1, color)
+            return
+        if y0 == y1:
+            if x0 > x1:
+                x0, x1 = x1, x0
+            self.fill_rect(x0, y0, x1 - x0 + 1, 1, color)
+            return
+        steep = abs(y1 - y0) > abs(x1 - x0)
+        if steep:
+            x0, y0 = y0, x0
+            x1, y1 = y1, x1
+        if x0 > x1:
+            x0, x1 = x1, x0
+            y0, y1 = y1, y0
+        dx = x1 - x0
+        dy = abs(y1 - y0)
+        ystep = 1 if y0 < y1 else -1
+        # Bresenham in closed form: err starts at dx / 2 and y steps each
+        # time it drops below zero
+        k = np.arange(dx + 1, dtype=np.int64)
+        steps = -((dx // 2 - k * dy) // dx)
+        xs = x0 + k
+        ys = y0 + ystep * steps
+        if steep:
+            xs, ys = ys, xs
+        self._pixels(xs, ys, color)
+
+    def draw_rect(self, x, y, w, h, color):
+        self.fill_rect(x, y, w, 1, color)
+        self.fill_rect(x, y + h - 1, w, 1, color)
+        self.fill_rect(x, y, 1, h, color)
+        self.fill_rect(x + w - 1, y, 1, h, color)
+
+    @staticmethod
+    def _circle_steps(r):
+        """(x, y) pairs visited by the Adafruit midpoint circle loop"""
+        f = 1 - r
+        ddf_x = 1
+        ddf_y = -2 * r
+        x, y = 0, r
+        steps = []
+        while x < y:
+            if f >= 0:
+                y -= 1
+                ddf_y += 2
+                f += ddf_y
+            x += 1
+            ddf_x += 2
+            f += ddf_x
+            steps.append((x, y))
+        return steps
+
+    def _circle_helper(self, x0, y0, r, corners, color):
+        xs, ys = [], []
+        for x, y in self._circle_steps(r):
+            if corners & 0x4:
+                xs += [x0 + x, x0 + y]
+                ys += [y0 + y, y0 + x]
+            if corners & 0x2:
+                xs += [x0 + x, x0 + y]
+                ys += [y0 - y, y0 - x]
+            if corners & 0x8:
+                xs += [x0 - y, x0 - x]
+                ys += [y0 + x, y0 + y]
+            if corners & 0x1:
+                xs += [x0 - y, x0 - x]
+                ys += [y0 - x, y0 - y]
+        self._pixels(xs, ys, color)
+
+    def draw_circle(self, x0, y0, r, color):
+        xs = [x0, x0, x0 + r, x0 - r]
+        ys = [y0 + r, y0 - r, y0, y0]
+        for x, y in self._circle_steps(r):
+            xs += [x0 + x, x0 - x, x0 + x, x0 - x, x0 + y, x0 - y, x0 + y, x0 - y]
+            ys += [y0 + y, y0 + y, y0 - y, y0 - y, y0 + x, y0 + x, y0 - x, y0 - x]
+        self._pixels(xs, ys, color)
+
+    def _fill_circle_helper(self, x0, y0, r, corners, delta, color):
+        f = 1 - r
+        ddf_x = 1
+        ddf_y = -2 * r
+        x, y = 0, r
+        px, py = x, y
+        delta += 1
+        xs, ys, hs = [], [], []
+        while x < y:
+            if f >= 0:
+                y -= 1
+                ddf_y += 2
+                f += ddf_y
+            x += 1
+            ddf_x += 2
+            f += ddf_x
+            if x < y + 1:
+                if corners & 1:
+                    xs.append(x0 + x)
+                    ys.append(y0 - y)
+                    hs.append(2 * y + delta)
+                if corners & 2:
+                    xs.append(x0 - x)
+                    ys.append(y0 - y)
+                    hs.append(2 * y + delta)
+            if y != py:
+                if corners & 1:
+                    xs.append(x0 + py)
+                    ys.append(y0 - px)
+                    hs.append(2 * px + delta)
+                if corners & 2:
+                    xs.append(x0 - py)
+                    ys.append(y0 - px)
+                    hs.append(2 * px + delta)
+                py = y
+            px = x
+        self._fill_vspans(xs, ys, hs, color)
+
+    def fill_circle(self, x0, y0, r, color):
+        self.fill_rect(x0, y0 - r, 1, 2 * r + 1, color)
+        self._fill_circle_helper(x0, y0, r, 3, 0, color)
+
+    def draw_round_rect(self, x, y, w, h, r, color):
+        r = min(r, min(w, h) // 2)
+        self.fill_rect(x + r, y, w - 2 * r, 1, color)
+        self.fill_rect(x + r, y + h - 1, w - 2 * r, 1, color)
+        self.fill_rect(x, y + r, 1, h - 2 * r, color)
+        self.fill_rect(x + w - 1, y + r, 1, h - 2 * r, color)
+        self._circle_helper(x + r, y + r, r, 1, color)
+        self._circle_helper(x + w - r - 1, y + r, r, 2, color)
+        self._circle_helper(x + w - r - 1, y + h - r - 1, r, 4, color)
+        self._circle_helper(x + r, y + h - r - 1, r, 8, color)
+
+    def fill_round_rect(self, x, y, w, h, r, color):
+        r = min(r, min(w, h) // 2)
+        self.fill_rect(x + r, y, w - 2 * r, h, color)
+        self._fill_circle_helper(x + w - r - 1, y + r, r, 1, h - 2 * r - 1, color)
+        self._fill_circle_helper(x + r, y + r, r, 2, h - 2 * r - 1, color)
+
+    def draw_triangle(self, x0, y0, x1, y1, x2, y2, color):
+        self.draw_line(x0, y0, x1, y1, color)
+        self.draw_line(x1, y1, x2, y2, color)
+        self.draw_line(x2, y2, x0, y0, color)
+
+    def fill_triangle(self, x0, y0, x1, y1, x2, y2, color):
+        # Sort by y (y2 >= y1 >= y0)
+        if y0 > y1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        if y1 > y2:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        if y0 > y1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+
+        if y0 == y2:
+            a = b = x0
+            if x1 < a:
+                a = x1
+            elif x1 > b:
+                b = x1
+            if x2 < a:
+                a = x2
+            elif x2 > b:
+                b = x2
+            self.fill_rect(a, y0, b - a + 1, 1, color)
+            return
+
+        def cdiv(n, d):
+            # C integer division truncates towards zero
+            q = abs(n) // abs(d)
+            return q if (n >= 0) == (d > 0) else -q
+
+        dx01, dy01 = x1 - x0, y1 - y0
+        dx02, dy02 = x2 - x0, y2 - y0
+        dx12, dy12 = x2 - x1, y2 - y1
+        sa = sb = 0
+        last = y1 if y1 == y2 else y1 - 1
+
+        xs, ys, ws = [], [], []
+        y = y0
+        while y <= last:
+            a = x0 + cdiv(sa, dy01)
+            b = x0 + cdiv(sb, dy02)
+            sa += dx01
+            sb += dx02
+            if a > b:
+                a, b = b, a
+            xs.append(a)
+            ys.append(y)
+            ws.append(b - a + 1)
+            y += 1
+
+        sa = dx12 * (y - y1)
+        sb = dx02 * (y - y0)
+        while y <= y2:
+            a = x1 + cdiv(sa, dy12)
+            b = x0 + cdiv(sb, dy02)
+            sa += dx12
+            sb += dx02
+            if a > b:
+                a, b = b, a
+            xs.append(a)
+            ys.append(y)
+            ws.append(b - a + 1)
+            y += 1
+        self._fill_hspans(xs, ys, ws, color)
+
+    @staticmethod
+    def _ellipse_steps(rx, ry):
+        """(x, y) pairs of the midpoint ellipse loops used for ellipses"""
+        rx2, ry2 = rx * rx, ry * ry
+        fx2, fy2 = 4 * rx2, 4 * ry2
+        steps = []
+        x, y = 0, ry
+        s = 2 * ry2 + rx2 * (1 - 2 * ry)
+        while ry2 * x <= rx2 * y:
+            steps.append((x, y))
+            if s >= 0:
+                s += fx2 * (1 - y)
+                y -= 1
+            s += ry2 * (4 * x + 6)
+            x += 1
+        x, y = rx, 0
+        s = 2 * rx2 + ry2 * (1 - 2 * rx)
+        while rx2 * y <= ry2 * x:
+            steps.append((x, y))
+            if s >= 0:
+                s += fy2 * (1 - x)
+                x -= 1
+            s += rx2 * (4 * y + 6)
+            y += 1
+        return steps
+
+    def draw_ellipse(self, x0, y0, rx, ry, color):
+        if rx < 0 or ry < 0 or (rx == 0 and ry == 0):
+            return
+        if ry == 0:
+            self.fill_rect(x0 - rx, y0, 2 * rx + 1, 1, color)
+            return
+        if rx == 0:
+            self.fill_rect(x0, y0 - ry, 1, 2 * ry + 1, color)
+            return
+        xs, ys = [], []
+        for x, y in self._ellipse_steps(rx, ry):
+            xs += [x0 + x, x0 - x, x0 - x, x0 + x]
+            ys += [y0 + y, y0 + y, y0 - y, y0 - y]
+        self._pixels(xs, ys, color)
+
+    def fill_ellipse(self, x0, y0, rx, ry, color):
+        if rx < 0 or ry < 0 or (rx == 0 and ry == 0):
+            return
+        if ry == 0:
+            self.fill_rect(x0 - rx, y0, 2 * rx + 1, 1, color)
+            return
+        if rx == 0:
+            self.fill_rect(x0, y0 - ry, 1, 2 * ry + 1, color)
+            return
+        xs, ys, ws = [], [], []
+        for x, y in self._ellipse_steps(rx, ry):
+            xs += [x0 - x, x0 - x]
+            ys += [y0 - y, y0 + y]
+            ws += [2 * x + 1, 2 * x + 1]
+        self._fill_hspans(xs, ys, ws, color)
+
+    def draw_text(self, text, x, y, size, color, font=None):
+        """Arduino_GFX println() with `font` (the classic font by default), landscape coordinates"""
+        target = self.logical
+        height, width = target.shape
+        (x1, y1), mask = (font or self.text_font).render(text, x, y, size, width)
+        tx1, ty1 = max(x1, 0), max(y1, 0)
+        tx2, ty2 = min(x1 + mask.shape[1], width), min(y1 + mask.shape[0], height)
+        if tx1 < tx2 and ty1 < ty2:
+            target[ty1:ty2, tx1:tx2][mask[ty1 - y1:ty2 - y1, tx1 - x1:tx2 - x1]] = color
+
+    # JC3248W535EN methods, landscape coordinates as sent by the designer
+
+    def set_color(self, r, g, b):
+        self.color = color565(r, g, b)
+
+    def clear(self, r=0, g=0, b=0):
+        self.pixels[:] = color565(r, g, b)
+
+    def flush(self):
+        self.flushes += 1
+
+    @staticmethod
+    def _rotated_rect(x, y, w, h):
+        px = 320 - (y + h)
+        py = x
+        pw = h
+        ph = w
+        if px < 0:
+            px = 0
+        if py < 0:
+            py = 0
+        if px + pw > 320:
+            pw = 320 - px
+        if py + ph > 480:
+            ph = 480 - py
+        return _int16(px), _int16(py), _int16(pw), _int16(ph)
+
+    def draw_fill_rect(self, x, y, w, h):
+        self.fill_rect(*self._rotated_rect(x, y, w, h), self.color)
+
+    def draw_rect_outline(self, x, y, w, h):
+        self.draw_rect(*self._rotated_rect(x, y, w, h), self.color)
+
+    def draw_line_between(self, x0, y0, x1, y1):
+        self.draw_line(_int16(320 - y0), x0, _int16(320 - y1), x1, self.color)
+
+    def draw_fill_circle(self, x, y, radius):
+        self.fill_circle(_int16(320 - y), x, radius, self.color)
+
+    def draw_circle_outline(self, x, y, radius):
+        self.draw_circle(_int16(320 - y), x, radius, self.color)
+
+    def draw_triangle_outline(self, x0, y0, x1, y1, x2, y2):
+        self.draw_triangle(_int16(320 - y0), x0, _int16(320 - y1), x1, _int16(320 - y2), x2, self.color)
+
+    def draw_fill_triangle(self, x0, y0, x1, y1, x2, y2):
+        self.fill_triangle(_int16(320 - y0), x0, _int16(320 - y1), x1, _int16(320 - y2), x2, self.color)
+
+    def draw_round_rect_outline(self, x, y, w, h, radius):
+        self.draw_round_rect(*self._rotated_rect(x, y, w, h), radius, self.color)
+
+    def draw_fill_round_rect(self, x, y, w, h, radius):
+        self.fill_round_rect(*self._rotated_rect(x, y, w, h), radius, self.color)
+
+    def draw_ellipse_outline(self, x, y, rx, ry):
+        # The library swaps the radii for the rotated canvas
+        self.draw_ellipse(_int16(320 - y), x, ry, rx, self.color)
+
+    def draw_fill_ellipse(self, x, y, rx, ry):
+        self.fill_ellipse(_int16(320 - y), x, ry, rx, self.color)
+
+    def prt(self, text, x, y, size=1, font=None):
+        """Print with the GFXfont named `font`; raises ValueError if there is no header for it"""
+        face = None
+        if font:
+            face = find_font(font)
+            if face is None:
+                raise ValueError("Unknown font")
+        self.draw_text(text, x, y, size, self.color, face)
+
+    def draw_qr_code(self, data, x, y, module_size=3, bg=(255, 255, 255), fg=(0, 0, 0)):
+        """Draw a QR code; returns the encoded QRMatrix, or None if it did not fit"""
+        matrix = qr_encoder.matrix_for(data, qr_version_for(data))
+        if matrix is None:
+            return None  # The sketch overruns its buffer here; draw nothing
+        size = matrix.size * module_size
+        self.set_color(*bg)
+        self.draw_fill_rect(x, y, size, size)
+        self.set_color(*fg)
+        self._draw_mask(x, y, np.array(matrix.modules, dtype=bool), module_size)
+        self.flush()
+        return matrix
+
+    def draw_bitmap(self, x, y, width, scale, data):
+        """Draw packed 1-bpp rows in the current colour like JC3248W535EN::drawBitmap (drawBitmap command)"""
+        stride = (width + 7) // 8
+        if not width or not data or len(data) % stride or len(data) > FRAME_MAX_TEXT:
+            raise ValueError("Bad bitmap data")
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8).reshape(-1, stride), axis=1)
+        self._draw_mask(x, y, bits[:, :width].astype(bool), scale)
+
+    def _draw_mask(self, x, y, dark, scale):
+        """Fill the set cells of a boolean grid as scale x scale blocks, one fill per horizontal run"""
+        rows, cols = dark.shape
+        if scale > 0 and self._rotated_rect(x, y, cols * scale, rows * scale) == \
+                (320 - (y + rows * scale), x, rows * scale, cols * scale):
+            # Entirely on screen: every block lands where it should, so the
+            # whole grid can be written as one scaled mask
+            mask = np.kron(dark, np.ones((scale, scale), dtype=bool))
+            self.logical[y:y + rows * scale, x:x + cols * scale][mask] = self.color
+            return
+        # Clamped fills shift runs that cross an edge, so draw them as the device does
+        edges = np.diff(np.pad(dark.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+        for row, start in zip(*np.nonzero(edges == 1)):
+            end = start + int(np.argmax(edges[row, start + 1:] == -1)) + 1
+            self.draw_fill_rect(x + int(start) * scale, y + int(row) * scale, (end - int(start)) * scale, scale)
+
+    def write_pixels(self, x, y, count, data):
+        """Decode RLE pixels straight into physical row `y` from column `x` (blit command)"""
+        if y >= CANVAS_HEIGHT or x + count > CANVAS_WIDTH:
+            raise ValueError("Blit span outside the canvas")
+        self.pixels[y, x:x + count] = rle_decode(data, count)
+
+    def execute(self, command):
+        """Run one `cmd|p1|p2|...` command like processSerialCommand() does.
+
+        Returns False for unknown or incomplete commands.
+        """
+        return self.execute_parts(split_command(command))
+
+    def execute_parts(self, parts):
+        """Run a command already split into its parts"""
+        if not parts:
+            return False
+        count = len(parts)
+        parts = parts + [""] * (11 - count)
+        cmd = parts[0]
+        n = [arduino_to_int(p) for p in parts]
+
+        if cmd == "prt" and count >= 4:
+            # Raises ValueError for a font without header, answered with "Unknown font"
+            self.prt(parts[1], _int16(n[2]), _int16(n[3]), _uint8(n[4]), parts[5])
+        elif cmd == "clear":
+            if count >= 4:
+                self.clear(_uint8(n[1]), _uint8(n[2]), _uint8(n[3]))
+            else:
+                self.clear()
+        elif cmd == "setColor" and count >= 4:
+            self.set_color(_uint8(n[1]), _uint8(n[2]), _uint8(n[3]))
+        elif cmd == "drawQRCode" and count >= 11:
+            self.draw_qr_code(parts[1], _int16(n[2] & 0xFFFF), _int16(n[3] & 0xFFFF), _uint8(n[4]),
+                              (_uint8(n[5]), _uint8(n[6]), _uint8(n[7])),
+                              (_uint8(n[8]), _uint8(n[9]), _uint8(n[10])))
+        elif cmd == "drawFillRect" and count >= 5:
+            self.draw_fill_rect(*(_int16(v) for v in n[1:5]))
+        elif cmd == "drawRect" and count >= 5:
+            self.draw_rect_outline(*(_int16(v) for v in n[1:5]))
+        elif cmd == "drawLine" and count >= 5:
+            self.draw_line_between(*(_int16(v) for v in n[1:5]))
+        elif cmd == "drawFillCircle" and count >= 4:
+            self.draw_fill_circle(*(_int16(v) for v in n[1:4]))
+        elif cmd == "drawCircleOutline" and count >= 4:
+            self.draw_circle_outline(*(_int16(v) for v in n[1:4]))
+        elif cmd == "drawTriangle" and count >= 7:
+            self.draw_triangle_outline(*(_int16(v) for v in n[1:7]))
+        elif cmd == "drawFillTriangle" and count >= 7:
+            self.draw_fill_triangle(*(_int16(v) for v in n[1:7]))
+        elif cmd == "drawRoundRect" and count >= 6:
+            self.draw_round_rect_outline(*(_int16(v) for v in n[1:6]))
+        elif cmd == "drawFillRoundRect" and count >= 6:
+            self.draw_fill_round_rect(*(_int16(v) for v in n[1:6]))
+        elif cmd == "drawEllipse" and count >= 5:
+            self.draw_ellipse_outline(*(_int16(v) for v in n[1:5]))
+        elif cmd == "drawFillEllipse" and count >= 5:
+            self.draw_fill_ellipse(*(_int16(v) for v in n[1:5]))
+        elif cmd == "flush":
+            self.flush()
+        elif cmd == "blit" and count >= 5:
+            # Raises ValueError for bad data, answered with "Bad blit data"
+            self.write_pixels(n[1] & 0xFFFF, n[2] & 0xFFFF, n[3] & 0xFFFF, bytes.fromhex(parts[4]))
+        elif cmd == "drawBitmap" and count >= 6:
+            # Raises ValueError for bad data, answered with "Bad bitmap data"
+            self.draw_bitmap(_int16(n[1]), _int16(n[2]), _uint8(n[3]), _uint8(n[4]), bytes.fromhex(parts[5]))
+        else:
+            return False
+        return True
+
+    def to_rgb888(self):
+        """Landscape 320x480x3 image as shown on the panel"""
+        return rgb565_to_rgb888(self.logical)
+
+    def save_png(self, path):
+        write_png(path, self.to_rgb888())
+
+
+def write_png(path, rgb):
+    """Write an (h, w, 3) uint8 array as a PNG file"""
+    height, width, _ = rgb.shape
+    raw = b"".join(b"\x00" + rgb[row].tobytes() for row in range(height))
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def render_commands(commands, framebuffer=None):
+    framebuffer = framebuffer or Framebuffer()
+    for command in commands:
+        try:
+            framebuffer.execute(command)
+        except ValueError:
+            pass  # The sketch answers with an error and draws nothing
+    return framebuffer
+
+
+def render_design(items, background=(0, 0, 0), framebuffer=None):
+    """Render design items from a cleared screen, exactly as an upload would"""
+    from design_compiler import design_commands
+    return render_commands(design_commands(items, background), framebuffer)
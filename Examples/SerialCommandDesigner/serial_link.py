@@ -0,0 +1,496 @@
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+from binary_protocol import encode_command, probe_binary_support
+from design_compiler import redraw_commands
+
+# Response line the sketch prints for each successfully processed command.
+# Anything that does not match one of these (or an error line) is treated as
+# log output, e.g. the "QR code version ..." line printed by drawQRCode.
+ACK_RESPONSES = {
+    "prt": "Text printed: ",
+    "clear": "Screen cleared",
+    "setColor": "Color set",
+    "drawQRCode": "QR code drawn",
+    "drawFillRect": "Rectangle filled",
+    "drawRect": "Rectangle drawn",
+    "drawLine": "Line drawn",
+    "drawFillCircle": "Circle filled",
+    "drawCircleOutline": "Circle outline drawn",
+    "drawTriangle": "Triangle drawn",
+    "drawFillTriangle": "Triangle filled",
+    "drawRoundRect": "Rounded rectangle drawn",
+    "drawFillRoundRect": "Rounded rectangle filled",
+    "drawEllipse": "Ellipse drawn",
+    "drawFillEllipse": "Ellipse filled",
+    "flush": "Screen flushed",
+    "blit": "Pixels written",
+    "drawBitmap": "Bitmap drawn",
+    "ping": "Pong ",
+}
+
+ERROR_RESPONSES = ("Unknown or incomplete command: ", "Invalid command format", "Bad frame", "Bad blit data",
+                   "Bad bitmap data", "Unknown font")
+
+# Sequenced commands are answered with "ok <seq>" or "err <seq> <code>"
+SEQ_MODULO = 256
+ERR_UNKNOWN = 1  # Unknown or incomplete command
+ERR_FORMAT = 2   # Invalid command format
+ERR_FRAME = 3    # Bad or truncated binary frame; its sequence number may be garbled too
+ERR_DATA = 4     # Bad blit or bitmap data, unknown font
+DEFAULT_RETRIES = 3
+
+# Stable port name of a running device_emulator.py
+EMULATOR_PORT = "/tmp/ttySerialCommandDesigner"
+
+DEFAULT_WINDOW = 8
+# Stay below the 256 byte receive buffer of the ESP32 serial drivers
+DEFAULT_MAX_INFLIGHT_BYTES = 240
+
+
+class SerialLinkError(Exception):
+    pass
+
+
+class TransferCancelled(SerialLinkError):
+    def __init__(self, stats):
+        super().__init__("Transfer cancelled")
+        self.stats = stats
+
+
+def is_ack(line):
+    for response in ACK_RESPONSES.values():
+        if line.startswith(response):
+            return True
+    return is_error(line)
+
+
+def is_error(line):
+    return line.startswith(ERROR_RESPONSES)
+
+
+def encode_text(command, seq=None):
+    if seq is not None:
+        command = f"#{seq}|{command}"
+    return (command + '\n').encode()
+
+
+def parse_seq_ack(line):
+    """(seq, error code) of an "ok <seq>" or "err <seq> <code>" line, code 0 for ok; None otherwise"""
+    parts = line.split()
+    try:
+        if len(parts) == 2 and parts[0] == "ok":
+            return int(parts[1]), 0
+        if len(parts) == 3 and parts[0] == "err":
+            return int(parts[1]), int(parts[2])
+    except ValueError:
+        pass
+    return None
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class TransferStats:
+    def __init__(self):
+        self.commands = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.round_trips = []  # Seconds from writing each command to its ack
+        # Seconds from when the device could start on each command (written
+        # and the previous one acked) to its ack
+        self.service_times = []
+        self.retransmits = 0  # Commands sent again to repair lost or failed ones
+
+    @property
+    def commands_per_second(self):
+        return self.commands / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes_sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def round_trip_percentile(self, percent):
+        """Nearest-rank percentile of the per-command round trip times"""
+        return percentile(self.round_trips, percent)
+
+    def summary(self):
+        summary = (f"{self.commands} commands, {self.bytes_sent} bytes in {self.elapsed:.2f} s "
+                   f"({self.commands_per_second:.0f} cmd/s, {self.bytes_per_second:.0f} B/s)")
+        if self.retransmits:
+            summary += f", {self.retransmits} resent"
+        return summary
+
+
+class PipelinedSender:
+    """Sliding-window transmitter for the line based command protocol.
+
+    Up to `window` commands (and at most `max_inflight_bytes` bytes) are kept
+    in flight; every ack from the device frees a slot and the lines that fit
+    into the freed space are written in a single write() call. `encoder`
+    turns a text command into the bytes put on the wire.
+    """
+
+    def __init__(self, serial_conn, window=DEFAULT_WINDOW,
+                 max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES, ack_timeout=2.0, encoder=encode_text):
+        self.serial_conn = serial_conn
+        self.window = max(1, int(window))
+        self.max_inflight_bytes = max_inflight_bytes
+        self.ack_timeout = ack_timeout
+        self.encoder = encoder
+        self.responses = []
+
+    def send(self, commands, progress=None, cancel=None):
+        """Send all commands and wait for their acks.
+
+        `progress` is called as progress(acked, total, response) after every ack.
+        Setting the `cancel` event stops sending new commands; once the commands
+        already in flight are acknowledged TransferCancelled is raised.
+        Raises SerialLinkError if the device stops acknowledging.
+        """
+        lines = [self.encoder(command.strip()) for command in commands if command.strip()]
+        total = len(lines)
+        stats = TransferStats()
+        self.responses = []
+
+        in_flight = []  # byte lengths of unacknowledged lines, oldest first
+        sent_at = []    # write times of the same lines
+        next_line = 0
+        start = time.perf_counter()
+        last_ack = start
+
+        while len(self.responses) < total:
+            cancelled = cancel is not None and cancel.is_set()
+            if cancelled and not in_flight:
+                stats.elapsed = time.perf_counter() - start
+                raise TransferCancelled(stats)
+
+            batch = []
+            inflight_bytes = sum(in_flight)
+            while not cancelled and next_line < total and len(in_flight) < self.window:
+                size = len(lines[next_line])
+                # Always allow one line in flight, even if it is oversized
+                if in_flight and inflight_bytes + size > self.max_inflight_bytes:
+                    break
+                batch.append(lines[next_line])
+                in_flight.append(size)
+                inflight_bytes += size
+                next_line += 1
+
+            if batch:
+                data = b"".join(batch)
+                self.serial_conn.write(data)
+                self.serial_conn.flush()
+                stats.bytes_sent += len(data)
+                sent_at.extend([time.perf_counter()] * len(batch))
+
+            # Block for one ack, then take every ack that has already arrived
+            # so the next write can refill the whole freed part of the window
+            while True:
+                response = self._read_ack()
+                in_flight.pop(0)
+                now, sent = time.perf_counter(), sent_at.pop(0)
+                stats.round_trips.append(now - sent)
+                stats.service_times.append(now - max(sent, last_ack))
+                last_ack = now
+                self.responses.append(response)
+                stats.commands += 1
+                if is_error(response):
+                    stats.errors += 1
+                if progress:
+                    progress(len(self.responses), total, response)
+                if not in_flight or not getattr(self.serial_conn, "in_waiting", 0):
+                    break
+
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    def _read_ack(self):
+        deadline = time.perf_counter() + self.ack_timeout
+        while True:
+            line = self.serial_conn.readline().decode(errors="replace").strip()
+            if line and is_ack(line):
+                return line
+            if time.perf_counter() > deadline:
+                raise SerialLinkError("Timed out waiting for acknowledgement from device")
+
+
+class SequencedSender(PipelinedSender):
+    """Pipelined sender for sketches that answer "ok <seq>" / "err <seq> <code>".
+
+    Every transmission carries a sequence number, so answers are matched to
+    commands whatever log output comes in between. The sketch handles
+    commands in order: an answer for a later sequence means the unanswered
+    earlier ones never arrived. Lost and failed commands are repaired up to
+    `retries` times with the commands from redraw_commands(), so what was
+    drawn over them since is drawn again too. `encoder` is called as
+    encoder(command, seq).
+
+    `responses` and the per-command timing in the returned stats follow
+    the order of the commands, as with PipelinedSender.
+    """
+
+    def __init__(self, serial_conn, window=DEFAULT_WINDOW, max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES,
+                 ack_timeout=2.0, encoder=encode_text, retries=DEFAULT_RETRIES):
+        super().__init__(serial_conn, window, max_inflight_bytes, ack_timeout, encoder)
+        # Keep sequence numbers in flight unambiguous
+        self.window = min(self.window, SEQ_MODULO // 2)
+        self.retries = retries
+
+    def send(self, commands, progress=None, cancel=None):
+        commands = [command.strip() for command in commands if command.strip()]
+        total = len(commands)
+        stats = TransferStats()
+        stats.round_trips = [0.0] * total
+        stats.service_times = [0.0] * total
+        responses = [None] * total
+        done = 0
+        attempts = [0] * total
+
+        # A group is one command, or the repair of one, and completes
+        # the command it stands for (its anchor) once all of it is acked
+        groups = {}  # group id -> [anchor, unacked count, failed]
+        next_group = 0
+        repairs = deque()  # (group id, command) waiting to go out before new commands
+        in_flight = deque()  # [seq, group id, command, size, sent at], oldest first
+        next_line = 0
+        next_seq = 0
+        start = time.perf_counter()
+        last_ack = start
+
+        def finish(anchor, response, sent, now, error=False):
+            nonlocal done
+            if responses[anchor] is not None:
+                return
+            responses[anchor] = response
+            stats.round_trips[anchor] = now - sent
+            stats.service_times[anchor] = now - max(sent, last_ack)
+            stats.commands += 1
+            stats.errors += error
+            done += 1
+            if progress:
+                progress(done, total, response)
+
+        def fail(group, response):
+            """Queue the repair of a group's anchor; raises once a lost command runs out of retries"""
+            nonlocal next_group
+            anchor, _, failed = groups[group]
+            if failed:
+                return  # Already being repaired
+            groups[group][2] = True
+            attempts[anchor] += 1
+            if attempts[anchor] > self.retries:
+                if response is None:
+                    raise SerialLinkError("Device keeps losing commands")
+                now = time.perf_counter()
+                finish(anchor, response, now, now, error=True)
+                return
+            repair = redraw_commands(commands, anchor, next_line)
+            if not repair:
+                # Painted over since, nothing to put right
+                now = time.perf_counter()
+                finish(anchor, "ok", now, now)
+                return
+            groups[next_group] = [anchor, len(repair), False]
+            repairs.extend((next_group, command) for command in repair)
+            next_group += 1
+
+        while done < total or in_flight or repairs:
+            cancelled = cancel is not None and cancel.is_set()
+            if cancelled and not in_flight:
+                stats.elapsed = time.perf_counter() - start
+                self.responses = [response for response in responses if response is not None]
+                raise TransferCancelled(stats)
+
+            batch = []
+            inflight_bytes = sum(entry[3] for entry in in_flight)
+            while not cancelled and len(in_flight) < self.window:
+                if repairs:
+                    group, command = repairs[0]
+                elif next_line < total:
+                    group, command = next_group, commands[next_line]
+                else:
+                    break
+                line = self.encoder(command, next_seq)
+                # Always allow one line in flight, even if it is oversized
+                if in_flight and inflight_bytes + len(line) > self.max_inflight_bytes:
+                    break
+                if repairs:
+                    repairs.popleft()
+                    stats.retransmits += 1
+                else:
+                    groups[group] = [next_line, 1, False]
+                    next_group += 1
+                    next_line += 1
+                batch.append(line)
+                in_flight.append([next_seq, group, command, len(line), 0.0])
+                inflight_bytes += len(line)
+                next_seq = (next_seq + 1) % SEQ_MODULO
+
+            if batch:
+                data = b"".join(batch)
+                self.serial_conn.write(data)
+                self.serial_conn.flush()
+                stats.bytes_sent += len(data)
+                now = time.perf_counter()
+                for entry in in_flight:
+                    entry[4] = entry[4] or now
+            if not in_flight:
+                continue
+
+            # Block for one answer, then take every answer that has already arrived
+            while in_flight:
+                answer = self._read_seq_ack()
+                now = time.perf_counter()
+                if answer is None:
+                    # Timed out: nothing in flight made it
+                    while in_flight:
+                        fail(in_flight.popleft()[1], None)
+                    break
+                line, seq, code = answer
+                position = next((i for i, entry in enumerate(in_flight) if entry[0] == seq), None)
+                if position is None:
+                    if code != ERR_FRAME:
+                        continue  # Stale answer to a command already given up on
+                    position = 0  # A mangled frame, most likely the oldest one
+                for _ in range(position):
+                    fail(in_flight.popleft()[1], None)
+                _, group, _, _, sent = in_flight.popleft()
+                if code:
+                    fail(group, line)
+                else:
+                    groups[group][1] -= 1
+                    anchor, unacked, failed = groups[group]
+                    if not unacked and not failed:
+                        finish(anchor, line, sent, now)
+                last_ack = now
+                if not getattr(self.serial_conn, "in_waiting", 0):
+                    break
+
+        stats.elapsed = time.perf_counter() - start
+        self.responses = responses
+        return stats
+
+    def _read_seq_ack(self):
+        """(line, seq, code) of the next answer, or None if none came within ack_timeout"""
+        deadline = time.perf_counter() + self.ack_timeout
+        while True:
+            line = self.serial_conn.readline().decode(errors="replace").strip()
+            answer = parse_seq_ack(line) if line else None
+            if answer is not None:
+                return (line,) + answer
+            if time.perf_counter() > deadline:
+                return None
+
+
+class SerialJob:
+    def __init__(self, name, commands, window=DEFAULT_WINDOW, binary=False):
+        self.name = name
+        self.commands = list(commands)
+        self.window = window
+        self.binary = binary
+        self.cancelled = threading.Event()
+
+
+class SerialWorker(threading.Thread):
+    """Owns the serial connection and runs queued jobs off the UI thread.
+
+    Results are reported as tuples on the `events` queue, which the UI drains
+    from its own thread:
+        ("progress", job, acked, total, response)
+        ("done", job, stats)
+        ("cancelled", job, stats)
+        ("error", job, message)
+        ("status", None, message)
+    The worker closes the serial connection when it is stopped, after
+    calling `on_close(serial_conn)` if given. `max_inflight_bytes` is the
+    block size negotiated with the sketch. Set `sequenced` for firmware
+    that answers sequenced commands.
+    """
+
+    def __init__(self, serial_conn, max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES, on_close=None):
+        super().__init__(daemon=True)
+        self.serial_conn = serial_conn
+        self.max_inflight_bytes = max_inflight_bytes
+        self.on_close = on_close
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.current_job = None
+        self.binary_supported = None  # Result of the binary protocol probe
+        self.sequenced = False
+
+    def submit(self, name, commands, window=DEFAULT_WINDOW, binary=False):
+        job = SerialJob(name, commands, window, binary)
+        self.jobs.put(job)
+        return job
+
+    def cancel(self):
+        """Cancel the running job and drop every queued one."""
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self.jobs.put(None)
+                break
+            self.events.put(("cancelled", job, TransferStats()))
+        job = self.current_job
+        if job:
+            job.cancelled.set()
+
+    def stop(self, timeout=5.0):
+        self.cancel()
+        self.jobs.put(None)
+        self.join(timeout)
+
+    def run(self):
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                self.current_job = job
+                try:
+                    self._run_job(job)
+                finally:
+                    self.current_job = None
+        finally:
+            if self.on_close:
+                self.on_close(self.serial_conn)
+            self.serial_conn.close()
+
+    def _run_job(self, job):
+        encoder = encode_text
+        if job.binary:
+            if self.binary_supported is None:
+                self.binary_supported = probe_binary_support(self.serial_conn)
+                if not self.binary_supported:
+                    self.events.put(("status", None, "Firmware has no binary protocol, using text commands"))
+            if self.binary_supported:
+                encoder = encode_command
+
+        def progress(acked, total, response):
+            self.events.put(("progress", job, acked, total, response))
+
+        sender_class = SequencedSender if self.sequenced else PipelinedSender
+        sender = sender_class(self.serial_conn, window=job.window,
+                              max_inflight_bytes=self.max_inflight_bytes, encoder=encoder)
+        try:
+            stats = sender.send(job.commands, progress, job.cancelled)
+        except TransferCancelled as e:
+            self.events.put(("cancelled", job, e.stats))
+        except Exception as e:
+            self.events.put(("error", job, str(e)))
+        else:
+            self.events.put(("done", job, stats))
@@ -0,0 +1,149 @@
+from delta_sync import item_uid
+from design_items import as_item
+from item_geometry import SCREEN_WIDTH, SCREEN_HEIGHT
+
+GRID_CELL = 32
+
+
+def pick_bounds(item):
+    """Box (x1, y1, x2, y2) around the clickable area of an item on the editor canvas"""
+    return as_item(item).pick_bounds()
+
+
+def hit_test(item, x, y):
+    """True if the point (x, y) on the editor canvas is on the item"""
+    return as_item(item).hit_test(x, y)
+
+
+class SpatialIndex:
+    """Uniform grid over the pick bounds of design items.
+
+    Items are registered in every grid cell their bounds overlap within the
+    canvas, so a point query only looks at the items of a single cell. The
+    index also remembers the stacking order of the items to return the
+    topmost hit first; call reorder() after layers change places.
+    """
+
+    def __init__(self, cell=GRID_CELL, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        self.cell = cell
+        self.max_cx = (width - 1) // cell
+        self.max_cy = (height - 1) // cell
+        self.cells = {}    # (cx, cy) -> {uid: item}
+        self.entries = {}  # uid -> (item, cell keys)
+        self.z = {}        # uid -> stacking order, higher is on top
+        self._next_z = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _cell_keys(self, bounds):
+        if bounds is None:
+            return []
+        x1, y1, x2, y2 = bounds
+        c = self.cell
+        cx1, cy1 = max(int(x1) // c, 0), max(int(y1) // c, 0)
+        cx2, cy2 = min(int(x2) // c, self.max_cx), min(int(y2) // c, self.max_cy)
+        return [(cx, cy) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1)]
+
+    def insert(self, item):
+        """Add an item on top of all others"""
+        self.update(item)
+        self.z[item_uid(item)] = self._next_z
+        self._next_z += 1
+
+    def insert_between(self, item, lower, upper, z=None):
+        """Add an item between the layers of `lower` and `upper` (None for bottom or top).
+
+        `z`, the item's stacking order before it was removed, is reused if it
+        still lies between the two. Returns False if no order fits in
+        between any more; reorder() the layers then.
+        """
+        z_low = self.z[item_uid(lower)] if lower is not None else None
+        z_high = self.z[item_uid(upper)] if upper is not None else None
+        if z is None or (z_low is not None and z <= z_low) or (z_high is not None and z >= z_high):
+            if z_high is None:
+                z = self._next_z
+            elif z_low is None:
+                z = z_high - 1
+            else:
+                z = (z_low + z_high) / 2
+        self.update(item)
+        self.z[item_uid(item)] = z
+        self._next_z = max(self._next_z, int(z) + 1)
+        return (z_low is None or z > z_low) and (z_high is None or z < z_high)
+
+    def update(self, item):
+        """Re-register an item after its geometry changed, keeping its layer"""
+        uid = item_uid(item)
+        self._unlink(uid)
+        keys = self._cell_keys(pick_bounds(item))
+        for key in keys:
+            self.cells.setdefault(key, {})[uid] = item
+        self.entries[uid] = (item, keys)
+
+    def remove(self, item):
+        uid = item_uid(item)
+        self._unlink(uid)
+        self.entries.pop(uid, None)
+        self.z.pop(uid, None)
+
+    def _unlink(self, uid):
+        entry = self.entries.get(uid)
+        if entry is None:
+            return
+        for key in entry[1]:
+            cell = self.cells[key]
+            del cell[uid]
+            if not cell:
+                del self.cells[key]
+
+    def clear(self):
+        self.cells = {}
+        self.entries = {}
+        self.z = {}
+        self._next_z = 0
+
+    def rebuild(self, items):
+        self.clear()
+        for item in items:
+            self.insert(item)
+
+    def reorder(self, items, start=0, stop=None):
+        """Take the stacking order from `items` (bottom layer first).
+
+        If only items[start:stop] changed places, pass the range to hand the
+        stacking orders those layers already have out again in list order,
+        which leaves every other layer as it is.
+        """
+        if start == 0 and stop is None:
+            self.z = {item_uid(item): z for z, item in enumerate(items)}
+            self._next_z = len(items)
+            return
+        uids = [item_uid(item) for item in items[start:stop]]
+        for uid, z in zip(uids, sorted(self.z[uid] for uid in uids)):
+            self.z[uid] = z
+
+    def items_at(self, x, y):
+        """Items under the point (x, y), topmost first"""
+        c = self.cell
+        cell = self.cells.get((int(x) // c, int(y) // c), {})
+        hits = [item for item in cell.values() if hit_test(item, x, y)]
+        hits.sort(key=lambda item: self.z[item["uid"]], reverse=True)
+        return hits
+
+    def item_at(self, x, y):
+        hits = self.items_at(x, y)
+        return hits[0] if hits else None
+
+    def items_in_rect(self, rect):
+        """Items whose pick bounds lie completely inside `rect`, bottom layer first"""
+        x1, y1, x2, y2 = rect
+        found = {}
+        for key in self._cell_keys(rect):
+            for uid, item in self.cells.get(key, {}).items():
+                if uid in found:
+                    continue
+                bx1, by1, bx2, by2 = pick_bounds(item)
+                if x1 <= bx1 and y1 <= by1 and bx2 <= x2 and by2 <= y2:
+                    found[uid] = item
+        return sorted(found.values(), key=lambda item: self.z[item["uid"]])
@@ -0,0 +1,47 @@
+"""Binary design files against the JSON format they replace."""
+
+import json
+
+import pytest
+
+from benchmark import generate_design
+from design_file import DesignFile, convert, read_design, write_design
+
+
+def as_json(items):
+    """Items as the design file format, with tuples turned into lists like json.load returns them"""
+    return json.loads(json.dumps([item.to_dict() for item in items]))
+
+
+def test_json_round_trip_is_lossless(tmp_path):
+    data = [item.to_dict() for item in generate_design(200, seed=3)]
+    # Records that do not fit the compact layout are kept as JSON
+    data.append({"type": "line", "coords": [1.5, 2, 30, 40], "color": [1, 2, 3], "note": "float coords"})
+    data.append({"type": "text", "coords": [5, 5], "color": [9, 9, 9], "text": "héllo", "size": 2,
+                 "font": "FreeSans9pt7b"})
+    source = tmp_path / "design.json"
+    source.write_text(json.dumps(data))
+
+    convert(str(source), str(tmp_path / "design.scd"))
+    convert(str(tmp_path / "design.scd"), str(tmp_path / "back.json"))
+    assert json.loads((tmp_path / "back.json").read_text()) == json.loads(json.dumps(data))
+
+
+def test_items_decode_on_access(tmp_path):
+    items = generate_design(50, seed=1)
+    path = str(tmp_path / "design.scd")
+    write_design(path, items)
+    with DesignFile(path) as design:
+        assert len(design) == len(items)
+        assert as_json([design[-1]]) == as_json(items[-1:])
+        assert design[-1] is design[len(items) - 1]
+        with pytest.raises(IndexError):
+            design[len(items)]
+    assert as_json(read_design(path)) == as_json(items)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "design.scd"
+    path.write_bytes(b"not a design file at all")
+    with pytest.raises(ValueError):
+        DesignFile(str(path))
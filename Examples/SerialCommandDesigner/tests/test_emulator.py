@@ -0,0 +1,31 @@
+"""Round trips through the emulated sketch on a pseudo-terminal."""
+
+import os
+
+import numpy as np
+import pytest
+import serial
+
+from benchmark import generate_design
+from binary_protocol import encode_command
+from device_emulator import DeviceEmulator
+from rasterizer import render_design
+from serial_link import PipelinedSender, DEFAULT_WINDOW, encode_text
+from upload_pipeline import prepare_upload
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the emulator needs a pty")
+
+
+@pytest.mark.parametrize("encoder", [encode_text, encode_command], ids=["text", "binary"])
+def test_upload_round_trip(encoder):
+    items = generate_design(60, seed=7)
+    plan = prepare_upload(items)
+    with DeviceEmulator(banner=False) as emulator:
+        conn = serial.Serial(emulator.port, 115200, timeout=1)
+        try:
+            stats = PipelinedSender(conn, DEFAULT_WINDOW, encoder=encoder).send(plan.commands)
+        finally:
+            conn.close()
+    assert stats.errors == 0
+    assert stats.commands == len(plan.commands)
+    assert np.array_equal(emulator.framebuffer.pixels, render_design(items).pixels)
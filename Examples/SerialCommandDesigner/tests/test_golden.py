@@ -0,0 +1,98 @@
+"""Pixel-exact checks of the upload planners against the reference rasterizer.
+
+Every plan must leave the panel showing exactly what a naive upload of the
+whole design shows, so each test renders both with the rasterizer and
+compares framebuffers.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from benchmark import generate_design
+from design_compiler import design_commands, optimize_commands
+from design_items import make_item
+from occlusion import cull_hidden_items
+from raster_upload import plan_transfer
+from rasterizer import Framebuffer, render_commands, render_design
+from upload_pipeline import prepare_upload
+
+SEEDS = [0, 1, 2]
+
+# Shapes only, so raster and hybrid plans are not held back by text
+SHAPES = {"rect": 2, "fillrect": 3, "roundrect": 1, "fillroundrect": 1, "circle": 1, "fillcircle": 2,
+          "line": 3, "qrcode": 0.2}
+
+
+def scribble_design(seed=0):
+    """A tangle of lines in one corner, which is cheaper as pixels, and a plain fill elsewhere"""
+    rng = random.Random(seed)
+    items = [make_item({"type": "line", "coords": [rng.randrange(40) for _ in range(4)], "color": (255, 255, 255)})
+             for _ in range(300)]
+    items.append(make_item({"type": "fillrect", "coords": [200, 100, 300, 200], "color": (0, 0, 255)}))
+    return items
+
+
+def assert_same_pixels(actual, expected):
+    diff = np.count_nonzero(actual.pixels != expected.pixels)
+    assert diff == 0, f"{diff} pixel(s) differ"
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_optimizer_keeps_pixels(seed):
+    commands = design_commands(generate_design(150, seed=seed))
+    optimized, stats = optimize_commands(commands)
+    assert len(optimized) <= len(commands)
+    assert_same_pixels(render_commands(optimized), render_commands(commands))
+
+
+@pytest.mark.parametrize("clip", [False, True])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_occlusion_culling_keeps_pixels(seed, clip):
+    items = generate_design(300, seed=seed)
+    visible, stats = cull_hidden_items(items, clip=clip)
+    assert len(visible) <= len(items)
+    assert_same_pixels(render_design(visible), render_design(items))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_delta_upload_matches_full_upload(seed):
+    items = generate_design(120, seed=seed)
+    first = prepare_upload(items)
+    panel = render_commands(first.commands)
+
+    # Move, recolour, delete and add a few items, then send only the difference
+    edited = [item.copy() for item in items]
+    edited[3].move(17, -9)
+    edited[10]["color"] = (1, 2, 3)
+    del edited[20:25]
+    edited.append(make_item({"type": "fillcircle", "coords": [200, 150, 30], "color": (250, 0, 0)}))
+    delta = prepare_upload(edited, first.snapshot)
+    assert delta.repainted < len(edited)
+
+    render_commands(delta.commands, panel)
+    assert_same_pixels(panel, render_design(edited))
+
+
+@pytest.mark.parametrize("mode", ["vector", "raster", "hybrid"])
+def test_transfer_plans_match_design(mode):
+    items = generate_design(80, mix=SHAPES, seed=4) if mode != "hybrid" else scribble_design()
+    plan = plan_transfer(items, mode=mode)
+    assert plan.mode == mode
+    # Start from leftovers of another design: every plan must paint over them
+    panel = render_design(generate_design(40, mix=SHAPES, seed=5))
+    render_commands(plan.commands, panel)
+    assert_same_pixels(panel, render_design(items))
+
+
+def test_auto_transfer_picks_cheapest_plan():
+    plan = plan_transfer(scribble_design(), mode="auto")
+    assert plan.mode == "hybrid"
+    assert plan.costs["hybrid"] == min(plan.costs.values())
+
+
+def test_unknown_font_draws_nothing():
+    framebuffer = Framebuffer()
+    render_commands(["setColor|255|255|255", "prt|hidden|10|10|2|NoSuchFont"], framebuffer)
+    assert not framebuffer.pixels.any()
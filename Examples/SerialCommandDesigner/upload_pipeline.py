@@ -0,0 +1,36 @@
+from delta_sync import plan_upload
+from design_compiler import item_command, optimize_commands
+from occlusion import cull_hidden_items
+
+
+class UploadPlan:
+    def __init__(self, commands, snapshot, repainted, compile_stats, occlusion_stats=None):
+        self.commands = commands
+        self.snapshot = snapshot
+        self.repainted = repainted
+        self.compile_stats = compile_stats
+        self.occlusion_stats = occlusion_stats
+
+    def summary(self):
+        summary = self.compile_stats.summary()
+        if self.occlusion_stats is not None:
+            summary += f" ({self.occlusion_stats.summary()})"
+        return summary
+
+
+def prepare_upload(items, snapshot=None, cull=True, clip=False, background=(0, 0, 0), command_for=item_command):
+    """Commands that bring the panel from `snapshot` to showing `items`.
+
+    This is everything "Send to Arduino" does before handing the commands to
+    the serial worker: optionally drop hidden items, plan a delta against
+    the last upload and optimize the command stream. Returns an UploadPlan.
+    """
+    occlusion_stats = None
+    if cull:
+        items, occlusion_stats = cull_hidden_items(items, clip=clip)
+    commands, new_snapshot, repainted = plan_upload(snapshot, items, command_for, background)
+    if commands:
+        commands, compile_stats = optimize_commands(commands)
+    else:
+        _, compile_stats = optimize_commands([])
+    return UploadPlan(commands, new_snapshot, repainted, compile_stats, occlusion_stats)
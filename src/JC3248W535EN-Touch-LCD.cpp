@@ -307,18 +307,22 @@ void JC3248W535EN::drawQRCode(const char* data, uint16_t x, uint16_t y, uint8_t
    // Set QR code color
    setColor(fgColorR, fgColorG, fgColorB);
    
-   // Draw each dark module (skip drawing light modules since they're the same as background)
+   // Draw the dark modules (light ones are already background), one fill per horizontal run
    for (uint8_t qrY = 0; qrY < qrcode.size; qrY++) {
-     for (uint8_t qrX = 0; qrX < qrcode.size; qrX++) {
-       // Only draw the dark modules (more efficient)
-       if (qrcode_getModule(&qrcode, qrX, qrY)) {
-         drawFillRect2(
-           x + qrX * moduleSize,
-           y + qrY * moduleSize,
-           moduleSize,
-           moduleSize
-         );
+     uint8_t qrX = 0;
+     while (qrX < qrcode.size) {
+       if (!qrcode_getModule(&qrcode, qrX, qrY)) {
+         qrX++;
+         continue;
        }
+       uint8_t start = qrX;
+       while (qrX < qrcode.size && qrcode_getModule(&qrcode, qrX, qrY)) qrX++;
+       drawFillRect2(
+         x + start * moduleSize,
+         y + qrY * moduleSize,
+         (qrX - start) * moduleSize,
+         moduleSize
+       );
      }
    }
    
@@ -353,11 +357,11 @@ void JC3248W535EN::image(const uint16_t* bitmap, int16_t x, int16_t y, int16_t w
         ph = 480 - py;
     }
     
-    // We need to render each pixel individually as drawBitmap only accepts uint8_t* and our bitmap is uint16_t*
-    for (int16_t i = 0; i < ph; i++) {
-        for (int16_t j = 0; j < pw; j++) {
-            uint16_t color = bitmap[i * w + j]; // Get color from bitmap
-            gfx->drawPixel(px + j, py + i, color);
+    // Copy rows straight into the canvas buffer instead of calling drawPixel per pixel
+    uint16_t* fb = gfx->getFramebuffer();
+    if (fb && pw > 0) {
+        for (int16_t i = 0; i < ph; i++) {
+            memcpy(fb + (py + i) * 320 + px, bitmap + i * w, pw * sizeof(uint16_t));
         }
     }
     
@@ -365,6 +369,56 @@ void JC3248W535EN::image(const uint16_t* bitmap, int16_t x, int16_t y, int16_t w
     flush();
 }
 
+// Decode run-length encoded RGB565 pixels into one row of the canvas buffer.
+// x, y and count are physical canvas coordinates (320 x 480, not rotated).
+// `data` holds packets: a header byte n < 0x80 followed by n + 1 literal
+// little-endian pixels, or n >= 0x80 followed by one pixel repeated
+// (n & 0x7F) + 1 times. Returns false unless the data fills exactly `count` pixels.
+bool JC3248W535EN::writePixels(uint16_t x, uint16_t y, uint16_t count, const uint8_t* data, size_t len) {
+    uint16_t* fb = gfx->getFramebuffer();
+    if (!fb || y >= 480 || x + count > 320) return false;
+    
+    uint16_t* dst = fb + y * 320 + x;
+    uint16_t left = count;
+    size_t i = 0;
+    while (i < len) {
+        uint8_t header = data[i++];
+        uint16_t n = (header & 0x7F) + 1;
+        if (n > left) return false;
+        if (header & 0x80) {
+            if (i + 2 > len) return false;
+            uint16_t color = data[i] | (data[i + 1] << 8);
+            i += 2;
+            for (uint16_t k = 0; k < n; k++) *dst++ = color;
+        } else {
+            if (i + 2 * n > len) return false;
+            for (uint16_t k = 0; k < n; k++, i += 2) *dst++ = data[i] | (data[i + 1] << 8);
+        }
+        left -= n;
+    }
+    return left == 0;
+}
+
+// Draw a 1-bpp bitmap in the current color, e.g. a QR code encoded by the host.
+// Every row is (width + 7) / 8 bytes with the leftmost pixel in the top bit;
+// set bits become scale x scale blocks, filled one horizontal run at a time.
+void JC3248W535EN::drawBitmap(const uint8_t* bits, int16_t x, int16_t y, uint16_t width, uint16_t height, uint8_t scale) {
+    uint16_t stride = (width + 7) / 8;
+    for (uint16_t row = 0; row < height; row++) {
+        const uint8_t* line = bits + row * stride;
+        uint16_t col = 0;
+        while (col < width) {
+            if (!(line[col >> 3] & (0x80 >> (col & 7)))) {
+                col++;
+                continue;
+            }
+            uint16_t start = col;
+            while (col < width && (line[col >> 3] & (0x80 >> (col & 7)))) col++;
+            drawFillRect2(x + start * scale, y + row * scale, (col - start) * scale, scale);
+        }
+    }
+}
+
 // Modified getPixel function that just returns a default value without serial logging
 uint16_t JC3248W535EN::getPixel(int16_t x, int16_t y) {
     // Transform coordinates to match screen orientation
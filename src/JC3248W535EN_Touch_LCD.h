@@ -42,6 +42,8 @@ public:
     
     // Image functions
     void image(const uint16_t* bitmap, int16_t x, int16_t y, int16_t w, int16_t h);
+    bool writePixels(uint16_t x, uint16_t y, uint16_t count, const uint8_t* data, size_t len);
+    void drawBitmap(const uint8_t* bits, int16_t x, int16_t y, uint16_t width, uint16_t height, uint8_t scale = 1);
     void fetchJpeg(const char* url, int16_t x, int16_t y);
     uint16_t getPixel(int16_t x, int16_t y); // New function to read a pixel color
     bool loadImageFromUrl(const char* url, int16_t x, int16_t y); // Integrated image loading method